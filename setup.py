@@ -37,6 +37,9 @@ CLASSIFIERS = [
 ]
 PACKAGE_DATA = {}
 DATA_FILES = []
+ENTRY_POINTS = {
+    'console_scripts': ['tidegates = tidegates.cli:main'],
+}
 
 if __name__ == "__main__":
     setup(
@@ -55,4 +58,5 @@ if __name__ == "__main__":
         platforms=PLATFORMS,
         classifiers=CLASSIFIERS,
         install_requires=None,
+        entry_points=ENTRY_POINTS,
     )
@@ -0,0 +1,91 @@
+""" Deferred imports for python-tidegates.
+
+Importing ``arcpy`` takes several seconds (it checks out a license and
+loads most of ArcGIS), and it isn't available at all on machines
+without ArcGIS. The modules of python-tidegates therefore refer to
+``arcpy`` through a :class:`LazyModule` that only imports it when one
+of its attributes is first used. That keeps ``import tidegates`` (and
+every worker process that imports it) fast, and lets the numpy parts
+of the library and the GDAL backend work without ArcGIS.
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import sys
+import types
+import importlib
+import threading
+
+
+class LazyModule(types.ModuleType):
+    """ Stand-in for a module that is imported on first attribute
+    access.
+
+    Attribute lookups are always forwarded to the real module (instead
+    of being copied) so that patches applied to the real module (e.g.,
+    with ``mock.patch('arcpy.Raster')``) are seen through the stand-in.
+
+    Parameters
+    ----------
+    name : str
+        The full name of the module to import.
+
+    Examples
+    --------
+    >>> from tidegates._lazy import LazyModule
+    >>> arcpy = LazyModule('arcpy')  # nothing imported yet
+    >>> arcpy.env.workspace  # imports arcpy
+    None
+
+    """
+
+    def __init__(self, name):
+        super(LazyModule, self).__init__(name)
+        self.__dict__['_lock'] = threading.RLock()
+        self.__dict__['_module'] = None
+        self.__dict__['_callbacks'] = []
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self.__name__)
+                    self.__dict__['_module'] = module
+                    for callback in self._callbacks:
+                        callback(module)
+        return self._module
+
+    @property
+    def is_loaded(self):
+        """ True once the real module has been imported (by anyone). """
+        return self._module is not None or self.__name__ in sys.modules
+
+    def on_load(self, callback):
+        """ Registers a function that will be called with the real
+        module right after it is imported.
+
+        """
+
+        self._callbacks.append(callback)
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'loaded' if self.is_loaded else 'not loaded'
+        return '<lazy module {!r} ({})>'.format(self.__name__, state)
+
+
+arcpy = LazyModule('arcpy')
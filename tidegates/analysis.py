@@ -3,6 +3,10 @@
 This contains main functions to evaluate the extent of floodinga and
 damage due to floods.
 
+Each of them also accepts a ``context`` keyword argument: a
+:class:`tidegates.backends.ExecutionContext` whose workspace (and
+backend) are used instead of the global ones while the function runs.
+
 (c) Geosyntec Consultants, 2015.
 
 Released under the BSD 3-clause license (see LICENSE file for more info)
@@ -15,19 +19,29 @@ Written by Paul Hobson (phobson@geosyntec.com)
 import os
 import sys
 import glob
+import shutil
+import hashlib
 import datetime
+import tempfile
+import itertools
 
 import numpy
 
-import arcpy
+from ._lazy import arcpy
 
 from . import utils
+from . import engine
+from . import profiling
+from . import backends
 
 
 METERS_PER_FOOT = 0.3048
 
 
-def process_dem_and_zones(dem, zones, ID_column, cleanup=True, **verbose_options):
+@backends.contextual
+@profiling.traced()
+def process_dem_and_zones(dem, zones, ID_column, cleanup=True, cache=None,
+                          memmap=False, **verbose_options):
     """ Convert DEM and Zones layers to numpy arrays.
 
     This is a pre-processor of the DEM and Zone of Influent input data.
@@ -48,6 +62,16 @@ def process_dem_and_zones(dem, zones, ID_column, cleanup=True, **verbose_options
         uniquely identifies each tidegate.
     cleanup : bool, optional (True)
         Toggles the removal of temporary files.
+    cache : str, optional
+        Path to a folder in which the arrays and template will be
+        saved. Subsequent calls with the same, unmodified ``dem`` and
+        ``zones`` load the arrays from the cache instead of repeating
+        the geoprocessing.
+    memmap : bool or str, optional (False)
+        When True (or the path to a folder), the arrays are returned as
+        read-only memory maps of ``.npy`` files in the temporary (or
+        given) folder. See :func:`tidegates.utils.rasters_to_arrays`.
+        Arrays loaded from ``cache`` map the cache's own files instead.
 
     Other Parameters
     ----------------
@@ -74,7 +98,19 @@ def process_dem_and_zones(dem, zones, ID_column, cleanup=True, **verbose_options
 
     """
 
-    utils._status('WorkSpace set to {}'.format(arcpy.env.workspace), **verbose_options)
+    utils._status('WorkSpace set to {}'.format(backends.env().workspace), **verbose_options)
+
+    if cache is not None:
+        cachedir = _dem_and_zones_cache(cache, dem, zones, ID_column)
+        if os.path.isdir(cachedir):
+            utils._status('Loading cached arrays from {}'.format(cachedir), **verbose_options)
+            mode = 'r' if memmap else None
+            topo_array = numpy.load(os.path.join(cachedir, 'topo.npy'), mmap_mode=mode)
+            zones_array = numpy.load(os.path.join(cachedir, 'zones.npy'), mmap_mode=mode)
+            georef = numpy.load(os.path.join(cachedir, 'georef.npy'))
+            crs = str(numpy.load(os.path.join(cachedir, 'crs.npy'))) or None
+            template = utils.RasterTemplate.from_georef(georef, crs=crs, shape=zones_array.shape)
+            return topo_array, zones_array, template
 
     # load the raw DEM (topo data)
     raw_topo = utils.load_data(
@@ -110,24 +146,154 @@ def process_dem_and_zones(dem, zones, ID_column, cleanup=True, **verbose_options
     topo_array, zones_array = utils.rasters_to_arrays(
         topo_raster,
         zones_raster,
+        memmap=memmap,
         msg='Converting rasters to arrays',
         **verbose_options
     )
 
     if cleanup:
-        _temp_files = []
-        utils.cleanup_temp_results(
+        utils.defer_cleanup(
             _p2r_outfile,
             _cd2z_outfile,
             msg="Removing intermediate rasters",
             **verbose_options
         )
 
+    if cache is not None:
+        _save_cache(cachedir, topo=topo_array, zones=zones_array, georef=template.georef,
+                    crs=template.crs or '')
+
     return topo_array, zones_array, template
 
 
+def _dem_and_zones_cache(cache, dem, zones, ID_column):
+    """ Path to the folder of cached arrays of a DEM and zones of
+    influence. The name is a hash of the inputs' paths, sizes, and modification times.
+
+    """
+
+    def fingerprint(data):
+        path = getattr(data, 'dataSource', None) or getattr(data, 'catalogPath', None) or data
+        path = os.path.abspath(os.path.join(backends.env().workspace or '.', str(path)))
+
+        # feature classes and rasters in geodatabases aren't files, so
+        # use the nearest parent that is.
+        existing = path
+        while existing and not os.path.exists(existing) and os.path.dirname(existing) != existing:
+            existing = os.path.dirname(existing)
+
+        stats = os.stat(existing) if os.path.exists(existing) else None
+        return path, stats and stats.st_size, stats and stats.st_mtime
+
+    key = repr((fingerprint(dem), fingerprint(zones), ID_column))
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache, 'dem_and_zones_{}'.format(digest))
+
+
+def _save_cache(cachedir, **arrays):
+    """ Saves each array to its own ``.npy`` file (so that they can be
+    memory-mapped when loaded) in a temporary folder next to
+    ``cachedir`` and then renames that folder, so that a crash (or
+    another run sharing the cache) never leaves a partial cache under
+    its name.
+
+    """
+
+    folder = os.path.dirname(cachedir)
+    try:
+        os.makedirs(folder)
+    except OSError:
+        if not os.path.isdir(folder):
+            raise
+
+    partial = tempfile.mkdtemp(prefix='.partial_', dir=folder)
+    try:
+        for name, array in arrays.items():
+            numpy.save(os.path.join(partial, name + '.npy'), array)
+        try:
+            os.rename(partial, cachedir)
+        except OSError:
+            # renaming onto an existing folder fails, but then another
+            # run has already saved the same arrays.
+            if not os.path.isdir(cachedir):
+                raise
+    finally:
+        if os.path.exists(partial):
+            shutil.rmtree(partial)
+
+
+def _elevation_in_meters(elevation_feet):
+    if hasattr(elevation_feet, 'items'):
+        return dict(
+            (zone, elev * METERS_PER_FOOT) for zone, elev in elevation_feet.items()
+        )
+    return numpy.asarray(elevation_feet) * METERS_PER_FOOT
+
+
+@backends.contextual
+def flood_array(topo_array, zones_array, elevation_feet, **verbose_options):
+    """ Floods the zones up to an elevation (in feet).
+
+    Parameters
+    ----------
+    topo_array, zones_array, elevation_feet
+        See :func:`flood_area`.
+
+    Returns
+    -------
+    flooded_array : numpy.ndarray
+        The zone IDs where there is flooding (see
+        :func:`tidegates.utils.flood_zones`).
+
+    """
+
+    return utils.flood_zones(
+        zones_array=zones_array,
+        topo_array=topo_array,
+        elevation=_elevation_in_meters(elevation_feet),
+        msg='Flooding areas up to {} ft'.format(elevation_feet),
+        **verbose_options
+    )
+
+
+@backends.contextual
+@profiling.traced()
+def flood_raster(topo_array, zones_array, template, elevation_feet, num=0,
+                 **verbose_options):
+    """ Floods the zones up to an elevation and saves the flooded zones
+    to a temporary raster. This is the first half of
+    :func:`flood_area`.
+
+    Parameters
+    ----------
+    topo_array, zones_array, template, elevation_feet, num
+        See :func:`flood_area`.
+
+    Returns
+    -------
+    flooded_raster : arcpy.Raster
+
+    """
+
+    # compute floods of zoned areas of topo
+    flooded_array = flood_array(topo_array, zones_array, elevation_feet, **verbose_options)
+
+    # convert flooded zone array back into a Raster
+    _fr_outfile = utils.create_temp_filename('floods_raster', filetype='raster', num=num)
+    return utils.array_to_raster(
+        array=flooded_array,
+        template=template,
+        outfile=_fr_outfile,
+        msg='Converting flooded array to a raster dataset',
+        **verbose_options
+    )
+
+
+@backends.contextual
+@profiling.traced()
 def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
-               filename=None, num=0, cleanup=True, **verbose_options):
+               filename=None, num=0, cleanup=True, flooded_raster=None,
+               **verbose_options):
     """ Mask out portions of a a tidegates area of influence below
     a certain elevation.
 
@@ -135,9 +301,10 @@ def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
     ----------
     topo_array : numpy array
         Floating point array of the digital elevation model.
-    zones_array : numpy array
+    zones_array : numpy array or utils.CompactArrays
         Categorical (integer) array of where each non-zero value
-        delineates a tidegate's zone of influence.
+        delineates a tidegate's zone of influence, or the compacted
+        zones and DEM (in which case ``topo_array`` is ignored).
     template : arcpy.Raster or utils.RasterTemplate
         A raster or raster-like object that define the spatial extent
         of the analysis area. Required attributes are:
@@ -147,13 +314,20 @@ def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
     ID_column : str
         Name of the column in the ``zones`` layer that associates
         each geomstry with a tidegate.
-    elevation_feet: float
+    elevation_feet: float, mapping, or numpy array
         The theoritical flood elevation (in ft MSL) that will be
-        analyzed.
+        analyzed. A mapping of zone ID to elevation, an array of
+        elevations indexed by zone ID, or a water surface applies
+        different elevations to each zone (see
+        :func:`tidegates.utils.flood_zones`).
     filename : str, optional
         Filename to which the flooded zone will be saved.
     cleanup : bool (default = True)
         When True, temporary results are removed from disk.
+    flooded_raster : arcpy.Raster, optional
+        The raster of the flooded zones, if it was already made (e.g.,
+        with :func:`flood_raster`) and saved as the ``floods_raster``
+        temporary file of ``num``.
 
     Other Parameters
     ----------------
@@ -180,9 +354,6 @@ def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
 
     """
 
-    # convert the elevation to meters to match the DEM
-    elevation_meters = elevation_feet * METERS_PER_FOOT
-
     if filename is None: # pragma: no cover
         datefmt = '%Y%m%d_%H%M'
         datestring = datetime.datetime.now().strftime(datefmt)
@@ -190,24 +361,12 @@ def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
     else:
         temp_filename = utils.create_temp_filename(filename, filetype='shape', num=num)
 
-    # compute floods of zoned areas of topo
-    flooded_array = utils.flood_zones(
-        zones_array=zones_array,
-        topo_array=topo_array,
-        elevation=elevation_meters,
-        msg='Flooding areas up to {} ft'.format(elevation_feet),
-        **verbose_options
-    )
-
-    # convert flooded zone array back into a Raster
+    # flood the zones and convert them to a raster (unless that's
+    # already been done)
     _fr_outfile = utils.create_temp_filename('floods_raster', filetype='raster', num=num)
-    flooded_raster = utils.array_to_raster(
-        array=flooded_array,
-        template=template,
-        outfile=_fr_outfile,
-        msg='Converting flooded array to a raster dataset',
-        **verbose_options
-    )
+    if flooded_raster is None:
+        flooded_raster = flood_raster(topo_array, zones_array, template, elevation_feet,
+                                      num=num, **verbose_options)
 
     # convert raster into polygons
     temp_polygons = utils.raster_to_polygons(
@@ -228,8 +387,7 @@ def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
     )
 
     if cleanup:
-        _temp_files = []
-        utils.cleanup_temp_results(
+        utils.defer_cleanup(
             temp_polygons.dataSource,
             _fr_outfile,
             msg="Removing intermediate files",
@@ -239,6 +397,225 @@ def flood_area(topo_array, zones_array, template, ID_column, elevation_feet,
     return flood_zones
 
 
+@backends.contextual
+@profiling.traced()
+def prefilter_assets(topo_array, zones_array, template, elevation_feet, assets,
+                     filename=None, cleanup=True, **verbose_options):
+    """ Selects the assets that could be impacted by the floods of a
+    run.
+
+    Floods only grow with the flood elevation, so the only assets that
+    any scenario of a run can impact are the ones that intersect the
+    flooded zones at its highest elevation. Intersecting the floods of
+    each scenario with selection layers of only those (usually far
+    fewer) candidates instead of the full asset layers gives the same
+    results, faster.
+
+    Parameters
+    ----------
+    topo_array, zones_array, template
+        See :func:`flood_area`.
+    elevation_feet : float
+        The highest flood elevation (in ft MSL) of the run.
+    assets : list of str
+        Paths of the asset layers (e.g., wetlands and buildings).
+        Entries that are None are returned as None.
+    filename : str, optional
+        Where the polygons of the flood extent are saved. Defaults to
+        a temporary file. They are kept, so that other processes can
+        select the same candidates (with
+        :func:`tidegates.utils.select_intersecting`).
+    cleanup : bool (default = True)
+        When True, the temporary raster of the flood extent is removed
+        from disk.
+
+    Returns
+    -------
+    extent : arcpy.mapping.Layer
+        The polygons of the flood extent. They aren't simplified, so
+        they cover exactly the flooded cells.
+    candidates : list of arcpy.mapping.Layer
+        Layers of each of ``assets`` in which the assets that
+        intersect the flood extent are selected.
+
+    See also
+    --------
+    assess_impact
+
+    """
+
+    if filename is None:
+        filename = utils.create_temp_filename('flood_extent', filetype='shape')
+
+    flooded_raster = flood_raster(topo_array, zones_array, template, elevation_feet,
+                                  num='extent', **verbose_options)
+    extent = utils.raster_to_polygons(
+        flooded_raster,
+        filename,
+        simplify=False,
+        msg='Converting the largest flood extent to polygons',
+        **verbose_options
+    )
+
+    candidates = []
+    for assets_input in assets:
+        if assets_input is None:
+            candidates.append(None)
+        else:
+            candidates.append(utils.select_intersecting(
+                assets_input,
+                extent,
+                msg='Selecting the assets within {} ft floods'.format(elevation_feet),
+                **verbose_options
+            ))
+
+    if cleanup:
+        utils.defer_cleanup(
+            flooded_raster,
+            msg="Removing intermediate files",
+            **verbose_options
+        )
+
+    return extent, candidates
+
+
+@backends.contextual
+@profiling.traced()
+def rasterize_assets(zones_array, template, assets_input, all_touched=False,
+                     num=0, cleanup=True, **verbose_options):
+    """ Converts an asset layer (e.g., wetlands or buildings) to an
+    array on the grid of the zones of influence.
+
+    Each feature is numbered (in a temporary copy of the layer) and the
+    numbers are burned into a raster with the extent and cells of the
+    zones (see :func:`tidegates.utils.polygons_to_raster`).
+
+    Parameters
+    ----------
+    zones_array, template
+        See :func:`flood_area`.
+    assets_input : str
+        Path of the asset layer.
+    all_touched : bool, optional (False)
+        When False, a feature only covers the cells whose centers it
+        contains, like the zones. When True, features also cover the
+        cells they partly overlap, so that none are smaller than a
+        cell. Overlapping features still share the cells they have in
+        common, so a feature may lose some (or rarely all) of its
+        cells to its neighbors.
+    num : int, optional (0)
+        Number of the temporary files (see
+        :func:`tidegates.utils.create_temp_filename`).
+    cleanup : bool (default = True)
+        When True, the temporary copy and raster of the assets are
+        removed from disk.
+
+    Returns
+    -------
+    array : numpy.ndarray
+        The number (starting at 1) of the feature that covers each
+        cell, or 0.
+
+    See also
+    --------
+    zone_index
+
+    """
+
+    nrows, ncols = zones_array.shape
+    extent = (template.xmin, template.ymin, template.xmin + ncols * template.cellwidth,
+              template.ymin + nrows * template.cellheight)
+
+    numbered = utils.concat_results(
+        utils.create_temp_filename(assets_input, prefix='_numbered_', filetype='shape'),
+        assets_input,
+        msg='Numbering the features of {}'.format(assets_input),
+        **verbose_options
+    )
+    utils.add_field_with_value(numbered, 'ASSET_NUM', field_type='LONG', overwrite=True)
+    counter = itertools.count(1)
+    utils.populate_field(numbered, lambda row: next(counter), 'ASSET_NUM')
+
+    _a2r_outfile = utils.create_temp_filename('assets_as_rstr', filetype='raster', num=num)
+    raster = utils.polygons_to_raster(
+        polygons=numbered,
+        ID_column='ASSET_NUM',
+        cellsize=template.meanCellWidth,
+        outfile=_a2r_outfile,
+        extent=extent,
+        all_touched=all_touched,
+        msg='Processing {} polygons'.format(assets_input),
+        **verbose_options
+    )
+    array = utils.rasters_to_arrays(raster, squeeze=True)
+
+    if cleanup:
+        utils.defer_cleanup(
+            numbered,
+            _a2r_outfile,
+            msg="Removing intermediate files",
+            **verbose_options
+        )
+
+    return numpy.where(array > 0, array, 0).astype(numpy.int32)
+
+
+@backends.contextual
+@profiling.traced()
+def zone_index(topo_array, zones_array, template, wetlands=None,
+               buildings=None, cleanup=True, **verbose_options):
+    """ Builds the :class:`tidegates.engine.ZoneIndex` of the zones of
+    influence, with the wetlands and buildings layers rasterized onto
+    their grid (see :func:`rasterize_assets`).
+
+    Wetlands cover the cells whose centers they contain, so that their
+    flooded area is comparable to that of the zones. Buildings cover
+    every cell they touch, like the flood polygons that
+    :func:`count_of_impacts` intersects them with. Buildings that only
+    share cells with other buildings are not counted.
+
+    Parameters
+    ----------
+    topo_array, zones_array, template
+        See :func:`flood_area`.
+    wetlands, buildings : str, optional
+        Paths of the wetlands and building footprints layers.
+    cleanup : bool (default = True)
+        See :func:`rasterize_assets`.
+
+    Returns
+    -------
+    index : tidegates.engine.ZoneIndex
+
+    Examples
+    --------
+    >>> import tidegates
+    >>> from tidegates import engine
+    >>> topo, zones, template = tidegates.process_dem_and_zones(
+    ...     'dem.tif', 'zones.shp', 'GeoID')
+    >>> index = tidegates.zone_index(topo, zones, template,
+    ...                              buildings='buildings.shp')
+    >>> bands = engine.ensemble(index, [1.0, 2.0]).totals()
+
+    """
+
+    wetlands_array = buildings_array = None
+    if wetlands is not None:
+        wetlands_array = rasterize_assets(
+            zones_array, template, wetlands, num=0, cleanup=cleanup, **verbose_options
+        ) > 0
+    if buildings is not None:
+        buildings_array = rasterize_assets(
+            zones_array, template, buildings, all_touched=True, num=1,
+            cleanup=cleanup, **verbose_options
+        )
+
+    return engine.ZoneIndex(topo_array, zones_array, cellsize=template.meanCellWidth,
+                            wetlands_array=wetlands_array, buildings_array=buildings_array)
+
+
+@backends.contextual
+@profiling.traced()
 def assess_impact(floods_path, flood_idcol, cleanup=False,
                   wetlands_path=None, wetlands_output=None,
                   buildings_path=None, buildings_output=None,
@@ -259,7 +636,9 @@ def assess_impact(floods_path, flood_idcol, cleanup=False,
         Paths to layers containing wetlands and building footprints.
     wetlands_output, buildings_output : str
         Path to where the final output of the assessed damage to the
-        wetlands and buildings should be saved.
+        wetlands and buildings should be saved. The flooded part of
+        each wetland in each flooded area is a separate feature (see
+        the ``by_asset`` option of :func:`area_of_impacts`).
     cleanup : bool (default = True)
         When True, temporary results are removed from disk.
 
@@ -304,11 +683,12 @@ def assess_impact(floods_path, flood_idcol, cleanup=False,
             flood_idcol=flood_idcol,
             assets_input=wetlands_path,
             assets_output=wetlands_output,
+            by_asset=True,
             msg='Assessing impact to wetlands',
             **verbose_options
         )
         if cleanup:
-            utils.cleanup_temp_results(flooded_wetlands)
+            utils.defer_cleanup(flooded_wetlands)
     else:
         flooded_wetlands = None
 
@@ -324,17 +704,18 @@ def assess_impact(floods_path, flood_idcol, cleanup=False,
             **verbose_options
         )
         if cleanup:
-            utils.cleanup_temp_results(flooded_buildings)
+            utils.defer_cleanup(flooded_buildings)
     else:
         flooded_buildings = None
 
     return utils.load_data(floods_path, "layer"), flooded_wetlands, flooded_buildings
 
 
+@backends.contextual
 @utils.update_status()
 def area_of_impacts(floods_path, flood_idcol, assets_input,
                     fieldname='wetlands', assets_output=None,
-                    cleanup=False, **verbose_options):
+                    cleanup=False, by_asset=False, **verbose_options):
 
     """ Computes the area of assets impacted by a flooded area.
 
@@ -359,6 +740,12 @@ def area_of_impacts(floods_path, flood_idcol, assets_input,
     assets_output : str, optional
         Path/filename of the dataset in which only the impacted assets
         will be saved.
+    by_asset : bool, optional (False)
+        When True, the flooded parts of each asset are saved as
+        separate features of ``assets_output`` (one per asset and
+        flooded area), with the ID of the asset (see
+        :func:`tidegates.utils.source_id_field`). Otherwise, there's
+        one feature per flooded area.
 
     Returns
     -------
@@ -384,10 +771,14 @@ def area_of_impacts(floods_path, flood_idcol, assets_input,
         **verbose_options
     )
 
-    # aggregate the wetlands based on the flood zone
+    # aggregate the wetlands based on the flood zone (and wetland)
+    dissolve_fields = [flood_idcol]
+    if by_asset:
+        dissolve_fields.append(utils.source_id_field(temp_flooded_assets, assets_input))
+
     flooded_assets = utils.aggregate_polygons(
         temp_flooded_assets,
-        flood_idcol,
+        dissolve_fields,
         assets_output
     )
 
@@ -408,11 +799,12 @@ def area_of_impacts(floods_path, flood_idcol, assets_input,
     )
 
     if cleanup:
-        utils.cleanup_temp_results(temp_flooded_assets)
+        utils.defer_cleanup(temp_flooded_assets)
 
     return flooded_assets
 
 
+@backends.contextual
 @utils.update_status()
 def count_of_impacts(floods_path, flood_idcol, assets_input,
                      fieldname='buildings', asset_idcol='STRUCT_ID',
@@ -0,0 +1,1122 @@
+""" Geoprocessing backends for python-tidegates.
+
+The functions in :mod:`tidegates.utils` wrap their ``arcpy``
+counterparts so that ``arcpy`` can be swapped out. This module is the
+registry that does the swapping: each wrapper decorated with
+:func:`dispatch` calls the method of the same name on the active
+backend, or falls back to the ``arcpy`` implementation in
+:mod:`tidegates.utils` when the backend doesn't provide one.
+
+Two backends are available:
+
+  1. "arcpy" (the default) -- the original ``arcpy`` wrappers.
+  2. "gdal" -- an in-process implementation built on GDAL/OGR and
+     numpy that runs without ArcGIS (e.g., on Linux compute nodes).
+     It reads anything GDAL/OGR can open, but writes GeoTIFF rasters
+     and ESRI shapefiles, so its workspace should be a folder.
+
+The backend is selected with :func:`set_backend`, the :func:`use`
+context manager, or the ``TIDEGATES_BACKEND`` environment variable.
+
+The workspace, overwrite setting, and backend can also be given to an
+:class:`ExecutionContext`, which only applies to the thread that
+enters it. Several tasks can then run in threads of the same process
+with different workspaces.
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import os
+import itertools
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
+
+import numpy
+
+from . import _lazy
+
+
+BACKEND_ENV_VAR = 'TIDEGATES_BACKEND'
+
+_string_types = (type(b''), type(u''))
+
+# backend classes by name, and their (lazily created) instances
+_registry = OrderedDict()
+_instances = {}
+_active = [os.environ.get(BACKEND_ENV_VAR, 'arcpy')]
+
+
+class Environment(object):
+    """ Mimics the parts of ``arcpy.env`` used by python-tidegates.
+
+    Attributes
+    ----------
+    workspace : str or None
+        Folder against which relative paths are resolved.
+    overwriteOutput : bool
+        When False, existing outputs are not overwritten.
+
+    """
+
+    def __init__(self):
+        self.workspace = None
+        self.overwriteOutput = False
+
+
+class Backend(object):
+    """ Base class for geoprocessing backends.
+
+    Methods of a backend that share the name of a function in
+    :mod:`tidegates.utils` replace that function while the backend is
+    active. The methods accept the same arguments (minus the verbosity
+    options) and return objects with the same attributes as the
+    ``arcpy`` objects they replace.
+
+    Attributes
+    ----------
+    name : str
+        The name under which the backend is registered.
+    env : Environment
+        The workspace and overwrite settings of the backend.
+
+    """
+
+    name = None
+
+    def __init__(self):
+        self.env = Environment()
+
+
+def register(backendclass):
+    """ Registers a :class:`Backend` subclass under its ``name``. Can
+    be used as a class decorator.
+
+    """
+
+    _registry[backendclass.name] = backendclass
+    return backendclass
+
+
+def available():
+    """ Names of the registered backends. """
+    return list(_registry.keys())
+
+
+def get_backend(name=None):
+    """ Gets the active backend (or the backend called ``name``). The
+    backend of the current thread's :class:`ExecutionContext` (if any)
+    takes precedence over :func:`set_backend` and :func:`use`.
+
+    Raises
+    ------
+    ValueError
+        If no backend called ``name`` is registered.
+
+    """
+
+    if name is None:
+        context = current_context()
+        name = context.backend if context is not None else _active[-1]
+
+    if name not in _instances:
+        try:
+            backendclass = _registry[name]
+        except KeyError:
+            raise ValueError('backend "{}" not in {}'.format(name, available()))
+        _instances[name] = backendclass()
+
+    return _instances[name]
+
+
+def set_backend(name):
+    """ Makes ``name`` the active backend. """
+    backend = get_backend(name)
+    _active[-1] = name
+    return backend
+
+
+@contextmanager
+def use(name):
+    """ Context manager that activates the backend ``name``.
+
+    Examples
+    --------
+    >>> from tidegates import backends, utils
+    >>> with backends.use('gdal'), utils.WorkSpace('/data/tidegates'):
+    ...     floods = tidegates.flood_area(...)
+
+    """
+
+    backend = get_backend(name)
+    _active.append(name)
+    try:
+        yield backend
+    finally:
+        _active.pop()
+
+
+# the ExecutionContexts entered by each thread (innermost last)
+_local = threading.local()
+
+
+def _context_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_context():
+    """ The innermost :class:`ExecutionContext` entered by the current
+    thread, or None.
+
+    """
+
+    stack = _context_stack()
+    return stack[-1] if stack else None
+
+
+class ExecutionContext(object):
+    """ Workspace, overwrite setting, and backend of a task that only
+    apply to the thread(s) that enter the context.
+
+    Settings that aren't given fall back to the context that was
+    current when this one was created, and then to the (process-wide)
+    settings of the backend. Within the context, :func:`env` returns the
+    context itself, so :func:`tidegates.utils.WorkSpace`,
+    :func:`tidegates.utils.OverwriteState`, and
+    :func:`tidegates.utils.create_temp_filename` use and change its
+    settings instead of the global ones.
+
+    ``arcpy``'s own tools read the process-wide ``arcpy.env``, so the
+    wrappers in :mod:`tidegates.utils` that fall back to ``arcpy``
+    apply the context's settings to ``arcpy.env`` while they run (see
+    :func:`arcpy_env`). They hold a lock while doing so, so the
+    ``arcpy`` tools of different threads run one at a time.
+
+    Parameters
+    ----------
+    workspace : str, optional
+    overwriteOutput : bool, optional
+    backend : str, optional
+        Name of the backend.
+
+    Examples
+    --------
+    >>> def task(elev, workspace):
+    ...     with backends.ExecutionContext(workspace=workspace, backend='gdal'):
+    ...         return tidegates.flood_area(topo, zones, template, 'GeoID', elev,
+    ...                                     filename='floods.shp')
+    >>> threads = [threading.Thread(target=task, args=(elev, 'run{}'.format(elev)))
+    ...            for elev in (4, 6, 8)]
+
+    """
+
+    _settings = ('workspace', 'overwriteOutput', 'backend')
+
+    def __init__(self, workspace=None, overwriteOutput=None, backend=None, parent=None):
+        self.__dict__['parent'] = parent if parent is not None else current_context()
+        self.__dict__['_values'] = dict(workspace=workspace, overwriteOutput=overwriteOutput,
+                                        backend=backend)
+
+    def __getattr__(self, attr):
+        if attr not in self._settings:
+            raise AttributeError(attr)
+
+        value = self._values[attr]
+        if value is not None:
+            return value
+        elif self.parent is not None:
+            return getattr(self.parent, attr)
+        elif attr == 'backend':
+            return _active[-1]
+        return getattr(get_backend(self.backend).env, attr)
+
+    def __setattr__(self, attr, value):
+        if attr not in self._settings:
+            raise AttributeError('{} is not a setting of the context'.format(attr))
+        self._values[attr] = value
+
+    def __enter__(self):
+        _context_stack().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        stack = _context_stack()
+        if self in stack:
+            stack.reverse()
+            stack.remove(self)
+            stack.reverse()
+
+    def __repr__(self):
+        return '<ExecutionContext workspace={!r} backend={!r}>'.format(self.workspace, self.backend)
+
+
+@contextmanager
+def activate(context):
+    """ Enters ``context`` (e.g., the context of the thread that handed
+    work to a background thread) in the current thread, or does nothing
+    if it's None.
+
+    """
+
+    if context is None:
+        yield None
+    else:
+        with context:
+            yield context
+
+
+# arcpy.env is shared by every thread, so the tools of different
+# threads run one at a time, each with its own context's settings
+_arcpy_lock = threading.RLock()
+
+
+@contextmanager
+def arcpy_env():
+    """ Holds the lock on ``arcpy.env`` and applies the settings of the
+    current thread's :class:`ExecutionContext` (if any) to it until the
+    block exits.
+
+    """
+
+    with _arcpy_lock:
+        context = current_context()
+        if context is None:
+            yield
+            return
+
+        arcpy_env = get_backend('arcpy').env
+        original = (arcpy_env.workspace, arcpy_env.overwriteOutput)
+        arcpy_env.workspace = context.workspace
+        arcpy_env.overwriteOutput = context.overwriteOutput
+        try:
+            yield
+        finally:
+            arcpy_env.workspace, arcpy_env.overwriteOutput = original
+
+
+def env():
+    """ The ``arcpy.env``-like settings of the current thread's
+    :class:`ExecutionContext`, or of the active backend.
+
+    """
+
+    context = current_context()
+    if context is not None:
+        return context
+    return get_backend().env
+
+
+def contextual(func):
+    """ Decorator for functions that accept an :class:`ExecutionContext`
+    as their ``context`` keyword argument and run inside it.
+
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        context = kwargs.pop('context', None)
+        if context is None:
+            return func(*args, **kwargs)
+        with context:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def dispatch(func):
+    """ Decorator that sends calls to a function in
+    :mod:`tidegates.utils` to the method of the same name of the active
+    backend. The ``arcpy`` implementation runs inside
+    :func:`arcpy_env`.
+
+    """
+
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        implementation = getattr(get_backend(), name, None)
+        if implementation is None:
+            with arcpy_env():
+                return func(*args, **kwargs)
+        return implementation(*args, **kwargs)
+    return wrapper
+
+
+@register
+class ArcpyBackend(Backend):
+    """ The original ``arcpy`` wrappers in :mod:`tidegates.utils`.
+
+    Until ``arcpy`` is imported, :attr:`env` is a plain
+    :class:`Environment`, so setting the workspace (e.g., for
+    :func:`tidegates.utils.create_temp_filename`) doesn't import
+    ``arcpy``. Its settings are copied to ``arcpy.env`` when ``arcpy``
+    is imported.
+
+    """
+
+    name = 'arcpy'
+
+    def __init__(self):
+        super(ArcpyBackend, self).__init__()
+        _lazy.arcpy.on_load(self._copy_env)
+
+    def _copy_env(self, arcpy):
+        arcpy.env.workspace = self._env.workspace
+        arcpy.env.overwriteOutput = self._env.overwriteOutput
+
+    @property
+    def env(self):
+        if _lazy.arcpy.is_loaded:
+            return _lazy.arcpy.env
+        return self._env
+
+    @env.setter
+    def env(self, value):
+        self._env = value
+
+
+Point = namedtuple('Point', ['X', 'Y'])
+
+
+class Extent(object):
+    """ Mimics ``arcpy.Extent``. """
+
+    def __init__(self, XMin, YMin, XMax, YMax):
+        self.XMin = XMin
+        self.YMin = YMin
+        self.XMax = XMax
+        self.YMax = YMax
+        self.lowerLeft = Point(XMin, YMin)
+        self.upperRight = Point(XMax, YMax)
+
+
+class Raster(object):
+    """ Mimics the attributes of ``arcpy.Raster`` for a raster
+    dataset opened by GDAL.
+
+    Parameters
+    ----------
+    path : str
+        Full path to the raster dataset.
+
+    """
+
+    def __init__(self, path):
+        from osgeo import gdal
+
+        ds = gdal.Open(path)
+        if ds is None:
+            raise ValueError('could not open {} as a raster'.format(path))
+
+        x0, width, _, y0, _, height = ds.GetGeoTransform()
+        self.catalogPath = path
+        self.path, self.name = os.path.split(path)
+        self.width = ds.RasterXSize
+        self.height = ds.RasterYSize
+        self.meanCellWidth = width
+        self.meanCellHeight = abs(height)
+        self.extent = Extent(x0, y0 - self.height * self.meanCellHeight,
+                             x0 + self.width * width, y0)
+        self.noDataValue = ds.GetRasterBand(1).GetNoDataValue()
+        self.spatialReference = ds.GetProjection()
+
+    def __repr__(self):
+        return '<Raster {}>'.format(self.catalogPath)
+
+
+class Layer(object):
+    """ Mimics the attributes of ``arcpy.mapping.Layer`` for a vector
+    dataset opened by OGR.
+
+    Parameters
+    ----------
+    path : str
+        Full path to the shapefile, or to the layer within a dataset
+        (e.g., ``data.gpkg/zones``).
+
+    """
+
+    isRasterLayer = False
+
+    # the FIDs of the selected features (by `select_intersecting`), or
+    # None; like arcpy's selections, `intersect_polygon_layers` only
+    # uses the selected features
+    selection = None
+
+    def __init__(self, path):
+        ds, layer = _open_vector(path)
+        if layer is None:
+            raise ValueError('could not open {} as a layer'.format(path))
+
+        self.dataSource = path
+        self.name = layer.GetName()
+        ds = None
+
+    def __repr__(self):
+        return '<Layer {}>'.format(self.dataSource)
+
+
+def _open_vector(path, update=False):
+    """ Opens the dataset and layer of a vector path with OGR. Paths
+    that don't exist are treated as ``<dataset>/<layer name>``.
+
+    """
+
+    from osgeo import ogr
+
+    if os.path.exists(path):
+        ds = ogr.Open(path, int(update))
+        layer = ds.GetLayer(0) if ds is not None else None
+    else:
+        ds = ogr.Open(os.path.dirname(path), int(update))
+        layer = ds.GetLayerByName(os.path.basename(path)) if ds is not None else None
+    return ds, layer
+
+
+def _field_names(layer):
+    defn = layer.GetLayerDefn()
+    return [defn.GetFieldDefn(i).GetName() for i in range(defn.GetFieldCount())]
+
+
+def _polygonal(geom):
+    """ The polygons (as a multipolygon) within an OGR geometry, or None.
+    """
+
+    from osgeo import ogr
+
+    if geom is None or geom.IsEmpty():
+        return None
+
+    gtype = ogr.GT_Flatten(geom.GetGeometryType())
+    if gtype in (ogr.wkbPolygon, ogr.wkbMultiPolygon):
+        return ogr.ForceToMultiPolygon(geom)
+    elif gtype == ogr.wkbGeometryCollection:
+        parts = ogr.Geometry(ogr.wkbMultiPolygon)
+        for n in range(geom.GetGeometryCount()):
+            part = _polygonal(geom.GetGeometryRef(n))
+            if part is not None:
+                for m in range(part.GetGeometryCount()):
+                    parts.AddGeometry(part.GetGeometryRef(m))
+        return parts if parts.GetGeometryCount() > 0 else None
+    return None
+
+
+@register
+class GDALBackend(Backend):
+    """ Geoprocessing with GDAL/OGR and numpy, without ArcGIS.
+
+    Requires the ``osgeo`` python bindings of GDAL (version 2.1 or
+    later).
+
+    """
+
+    name = 'gdal'
+
+    _field_types = {
+        'SHORT': 'OFTInteger',
+        'LONG': 'OFTInteger',
+        'FLOAT': 'OFTReal',
+        'DOUBLE': 'OFTReal',
+        'TEXT': 'OFTString',
+    }
+
+    _raster_types = {
+        'bool': 'GDT_Byte',
+        'uint8': 'GDT_Byte',
+        'int8': 'GDT_Int16',
+        'int16': 'GDT_Int16',
+        'uint16': 'GDT_UInt16',
+        'int32': 'GDT_Int32',
+        'uint32': 'GDT_UInt32',
+        'int64': 'GDT_Int32',
+        'float32': 'GDT_Float32',
+        'float64': 'GDT_Float64',
+    }
+
+    def __init__(self):
+        from osgeo import gdal, ogr
+        gdal.UseExceptions()
+        ogr.UseExceptions()
+        super(GDALBackend, self).__init__()
+
+    # -- paths and datasets ------------------------------------------
+    def _path(self, data):
+        if isinstance(data, Raster):
+            return data.catalogPath
+        elif isinstance(data, Layer):
+            return data.dataSource
+        return os.path.abspath(os.path.join(env().workspace or '.', data))
+
+    def _prepare_output(self, path):
+        if os.path.exists(path):
+            if not env().overwriteOutput:
+                raise IOError('{} already exists'.format(path))
+            self._delete(path)
+        return path
+
+    def _delete(self, path):
+        from osgeo import gdal, ogr
+
+        if not os.path.exists(path):
+            return
+        elif path.lower().endswith('.shp'):
+            ogr.GetDriverByName('ESRI Shapefile').DeleteDataSource(path)
+        elif gdal.IdentifyDriver(path) is not None:
+            gdal.GetDriverByName(gdal.IdentifyDriver(path).ShortName).Delete(path)
+        else:
+            os.remove(path)
+
+    def _create_layer(self, path, srs, fields, geomtype=None):
+        """ Creates a shapefile with ``fields`` (a list of OGR field
+        definitions) and returns the dataset and its layer.
+
+        """
+
+        from osgeo import ogr
+
+        if geomtype is None:
+            geomtype = ogr.wkbMultiPolygon
+
+        self._prepare_output(path)
+        ds = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        layer = ds.CreateLayer(name, srs, geomtype)
+        for field in fields:
+            layer.CreateField(field)
+        return ds, layer
+
+    # -- loading data ------------------------------------------------
+    def load_data(self, datapath, datatype, greedyRasters=True):
+        if datatype.lower() in ('raster', 'grid'):
+            objtype = Raster
+        elif datatype.lower() in ('shape', 'layer'):
+            objtype = Layer
+        else:
+            msg = "Datatype {} not supported. Must be raster or layer".format(datatype)
+            raise ValueError(msg)
+
+        if isinstance(datapath, objtype):
+            return datapath
+
+        path = self._path(datapath)
+        try:
+            return objtype(path)
+        except Exception:
+            if objtype is Layer and greedyRasters:
+                try:
+                    return Raster(path)
+                except Exception:
+                    pass
+            raise ValueError("could not load {} as a {}".format(datapath, objtype.__name__))
+
+    # -- rasters -----------------------------------------------------
+    def rasters_to_arrays(self, *rasters, **kwargs):
+        from osgeo import gdal, gdal_array
+        from tidegates import utils
+
+        squeeze = kwargs.pop("squeeze", False)
+        memmap = kwargs.pop("memmap", False)
+        window = kwargs.pop("window", None)
+
+        arrays = []
+        for r in rasters:
+            ds = gdal.Open(self._path(r))
+            band = ds.GetRasterBand(1)
+            if window is None:
+                r0, r1, c0, c1 = 0, ds.RasterYSize, 0, ds.RasterXSize
+            else:
+                r0, r1, c0, c1 = window
+            nodata = band.GetNoDataValue()
+            dtype = numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+            if nodata is not None and dtype.kind in 'ui' and dtype.itemsize < 4:
+                # make room for the -999 sentinel
+                dtype = numpy.dtype(numpy.int32)
+
+            if memmap:
+                # read straight into the file, never holding the whole
+                # raster in memory
+                array = utils.scratch_array(
+                    (r1 - r0, c1 - c0), dtype,
+                    folder=None if memmap is True else memmap,
+                    name=utils._raster_name(r)
+                )
+                band.ReadAsArray(c0, r0, c1 - c0, r1 - r0, buf_obj=array)
+            else:
+                array = band.ReadAsArray(c0, r0, c1 - c0, r1 - r0).astype(dtype, copy=False)
+
+            if nodata is not None and numpy.isnan(nodata):
+                array[numpy.isnan(array)] = -999
+            elif nodata is not None:
+                array[array == nodata] = -999
+
+            if memmap:
+                array = utils.readonly_memmap(array)
+            arrays.append(array)
+            ds = None
+
+        if squeeze and len(arrays) == 1:
+            arrays = arrays[0]
+
+        return arrays
+
+    def array_to_raster(self, array, template, outfile=None, nodata=0, tiled=False,
+                        compress=None, overviews=None):
+        from osgeo import gdal
+        from tidegates.utils import TILE_SIZE, OVERVIEW_FACTORS
+
+        if outfile is None:
+            outfile = '/vsimem/tidegates_{}.tif'.format(id(array))
+        else:
+            outfile = self._prepare_output(self._path(outfile))
+
+        dtype = array.dtype.name
+        if dtype == 'int64':
+            array = array.astype(numpy.int32)
+        elif dtype == 'bool':
+            array = array.astype(numpy.uint8)
+
+        nrows, ncols = array.shape
+        xmin = template.extent.lowerLeft.X
+        ymin = template.extent.lowerLeft.Y
+        options = ['COMPRESS={}'.format(compress or 'LZW')]
+        if tiled:
+            options.extend(['TILED=YES', 'BLOCKXSIZE={}'.format(TILE_SIZE),
+                            'BLOCKYSIZE={}'.format(TILE_SIZE)])
+
+        ds = gdal.GetDriverByName('GTiff').Create(
+            outfile, ncols, nrows, 1, getattr(gdal, self._raster_types[dtype]),
+            options=options
+        )
+        ds.SetGeoTransform((
+            xmin, template.meanCellWidth, 0,
+            ymin + nrows * template.meanCellHeight, 0, -template.meanCellHeight
+        ))
+
+        srs = getattr(template, 'spatialReference', None)
+        if isinstance(srs, _string_types) and srs:
+            ds.SetProjection(srs)
+
+        band = ds.GetRasterBand(1)
+        band.WriteArray(array)
+        if nodata is not None:
+            band.SetNoDataValue(nodata)
+        if overviews:
+            ds.BuildOverviews('NEAREST', list(OVERVIEW_FACTORS if overviews is True else overviews))
+        ds.FlushCache()
+        ds = None
+
+        return Raster(outfile)
+
+    def polygons_to_raster(self, polygons, ID_column, cellsize=4, outfile=None,
+                           extent=None, all_touched=False):
+        from osgeo import gdal
+
+        zones = self.load_data(polygons, 'shape')
+        ds, layer = _open_vector(zones.dataSource)
+        self._check_fields(layer, ID_column, should_exist=True)
+
+        if outfile is None:
+            outfile = '/vsimem/tidegates_zones_{}.tif'.format(id(zones))
+        else:
+            outfile = self._prepare_output(self._path(outfile))
+
+        source = zones.dataSource
+        if not os.path.exists(source):
+            source = os.path.dirname(source)
+
+        gdal.Rasterize(
+            outfile, source,
+            format='GTiff',
+            layers=[layer.GetName()],
+            attribute=ID_column,
+            xRes=cellsize,
+            yRes=cellsize,
+            outputBounds=None if extent is None else list(extent),
+            allTouched=all_touched,
+            outputType=gdal.GDT_Int32,
+            initValues=0,
+            noData=0,
+            creationOptions=['COMPRESS=LZW'],
+        )
+        ds = None
+
+        return Raster(outfile)
+
+    def clip_dem_to_zones(self, dem, zones, outfile=None):
+        from osgeo import gdal
+
+        _dem = self.load_data(dem, 'raster')
+        _zones = self.load_data(zones, 'raster')
+
+        if outfile is None:
+            outfile = '/vsimem/tidegates_clipped_{}.tif'.format(id(_dem))
+        else:
+            outfile = self._prepare_output(self._path(outfile))
+
+        ext = _zones.extent
+        gdal.Warp(
+            outfile, _dem.catalogPath,
+            format='GTiff',
+            outputBounds=(ext.XMin, ext.YMin, ext.XMax, ext.YMax),
+            xRes=_zones.meanCellWidth,
+            yRes=_zones.meanCellHeight,
+            resampleAlg='near',
+            creationOptions=['COMPRESS=LZW'],
+        )
+
+        return Raster(outfile)
+
+    # -- vectors -----------------------------------------------------
+    def raster_to_polygons(self, zonal_raster, filename, newfield=None, simplify=True):
+        # Polygonize never simplifies: the polygons follow the cells
+        from osgeo import gdal, ogr, osr
+
+        raster = self.load_data(zonal_raster, 'raster')
+        rds = gdal.Open(raster.catalogPath)
+        band = rds.GetRasterBand(1)
+
+        srs = osr.SpatialReference(rds.GetProjection()) if rds.GetProjection() else None
+        fields = [ogr.FieldDefn('gridcode', ogr.OFTInteger)]
+        if newfield is not None:
+            fields.append(ogr.FieldDefn(newfield, ogr.OFTInteger))
+
+        path = self._path(filename)
+        ds, layer = self._create_layer(path, srs, fields, geomtype=ogr.wkbPolygon)
+        gdal.Polygonize(band, band.GetMaskBand(), layer, 0, [], callback=None)
+
+        if newfield is not None:
+            layer.ResetReading()
+            for feature in layer:
+                feature.SetField(newfield, feature.GetField('gridcode'))
+                layer.SetFeature(feature)
+
+        ds = None
+        rds = None
+        return Layer(path)
+
+    def aggregate_polygons(self, polygons, ID_field, filename):
+        from osgeo import ogr
+
+        source = self.load_data(polygons, 'layer')
+        sds, slayer = _open_vector(source.dataSource)
+        fields = [ID_field] if isinstance(ID_field, _string_types) else list(ID_field)
+        self._check_fields(slayer, *fields, should_exist=True)
+
+        groups = OrderedDict()
+        for feature in slayer:
+            geom = _polygonal(feature.GetGeometryRef())
+            if geom is not None:
+                key = tuple(feature.GetField(f) for f in fields)
+                groups.setdefault(key, ogr.Geometry(ogr.wkbMultiPolygon))
+                for n in range(geom.GetGeometryCount()):
+                    groups[key].AddGeometry(geom.GetGeometryRef(n))
+
+        defn = slayer.GetLayerDefn()
+        fielddefns = [ogr.FieldDefn(f, defn.GetFieldDefn(defn.GetFieldIndex(f)).GetType())
+                      for f in fields]
+        path = self._path(filename)
+        ds, layer = self._create_layer(path, slayer.GetSpatialRef(), fielddefns)
+        for key, geom in groups.items():
+            feature = ogr.Feature(layer.GetLayerDefn())
+            for field, value in zip(fields, key):
+                feature.SetField(field, value)
+            feature.SetGeometry(_polygonal(geom.UnionCascaded()))
+            layer.CreateFeature(feature)
+
+        ds = None
+        sds = None
+        return Layer(path)
+
+    def _copy_fields(self, layer, sources):
+        """ Adds the fields of the source layers to ``layer``, renaming
+        duplicates like ArcGIS does (e.g., "GeoID_1"). Returns the
+        output field name of each (source, field) pair.
+
+        """
+
+        names = {}
+        existing = set(_field_names(layer))
+        for n, source in enumerate(sources):
+            defn = source.GetLayerDefn()
+            for i in range(defn.GetFieldCount()):
+                field = defn.GetFieldDefn(i)
+                name = field.GetName()
+                newname, suffix = name, 0
+                while newname in existing:
+                    suffix += 1
+                    newname = '{}_{}'.format(name[:8], suffix)
+                existing.add(newname)
+
+                newfield = type(field)(newname, field.GetType())
+                newfield.SetWidth(field.GetWidth())
+                newfield.SetPrecision(field.GetPrecision())
+                layer.CreateField(newfield)
+                names[(n, name)] = newname
+        return names
+
+    def intersect_polygon_layers(self, destination, *layers, **intersect_options):
+        from osgeo import ogr
+
+        sources = []
+        selections = []
+        for lyr in layers:
+            lyr = self.load_data(lyr, 'layer')
+            sources.append(_open_vector(lyr.dataSource))
+            selections.append(lyr.selection)
+
+        def selected(n, feature):
+            return selections[n] is None or feature.GetFID() in selections[n]
+
+        # pairwise intersection of the geometries, keeping the
+        # features that make up each piece
+        pieces = [(f.GetGeometryRef().Clone(), [f]) for f in sources[0][1] if selected(0, f)]
+        for n, (ds, layer) in enumerate(sources[1:], 1):
+            newpieces = []
+            for geom, features in pieces:
+                layer.SetSpatialFilter(geom)
+                for other in layer:
+                    if not selected(n, other):
+                        continue
+                    overlap = _polygonal(geom.Intersection(other.GetGeometryRef()))
+                    if overlap is not None:
+                        newpieces.append((overlap, features + [other]))
+                layer.SetSpatialFilter(None)
+            pieces = newpieces
+
+        path = self._path(destination)
+        ds, outlayer = self._create_layer(path, sources[0][1].GetSpatialRef(), [])
+        for n, (_, source) in enumerate(sources):
+            fid = ogr.FieldDefn('FID_{}'.format(source.GetName())[:10], ogr.OFTInteger)
+            outlayer.CreateField(fid)
+        names = self._copy_fields(outlayer, [layer for _, layer in sources])
+
+        for geom, features in pieces:
+            out = ogr.Feature(outlayer.GetLayerDefn())
+            for n, feature in enumerate(features):
+                out.SetField(n, feature.GetFID())
+                for name in _field_names(sources[n][1]):
+                    out.SetField(names[(n, name)], feature.GetField(name))
+            out.SetGeometry(geom)
+            outlayer.CreateFeature(out)
+
+        ds = None
+        return Layer(path)
+
+    def select_intersecting(self, features, boundary):
+        from osgeo import ogr
+
+        source_path = self.load_data(features, 'layer').dataSource
+        sds, source = _open_vector(source_path)
+        bds, blayer = _open_vector(self.load_data(boundary, 'layer').dataSource)
+
+        area = ogr.Geometry(ogr.wkbMultiPolygon)
+        for feature in blayer:
+            geom = _polygonal(feature.GetGeometryRef())
+            if geom is not None:
+                for n in range(geom.GetGeometryCount()):
+                    area.AddGeometry(geom.GetGeometryRef(n))
+
+        layer = Layer(source_path)
+        layer.selection = frozenset()
+        if area.GetGeometryCount() > 0:
+            area = area.UnionCascaded()
+            source.SetSpatialFilter(area)
+            layer.selection = frozenset(f.GetFID() for f in source
+                                        if f.GetGeometryRef().Intersects(area))
+            source.SetSpatialFilter(None)
+        return layer
+
+    def concat_results(self, destination, *input_files):
+        from osgeo import ogr
+
+        sources = [_open_vector(self._path(f)) for f in input_files]
+        path = self._path(destination)
+        ds, outlayer = self._create_layer(path, sources[0][1].GetSpatialRef(), [])
+
+        existing = []
+        for _, layer in sources:
+            defn = layer.GetLayerDefn()
+            for i in range(defn.GetFieldCount()):
+                field = defn.GetFieldDefn(i)
+                if field.GetName() not in existing:
+                    outlayer.CreateField(field)
+                    existing.append(field.GetName())
+
+        for _, layer in sources:
+            fields = _field_names(layer)
+            for feature in layer:
+                out = ogr.Feature(outlayer.GetLayerDefn())
+                for name in fields:
+                    out.SetField(name, feature.GetField(name))
+                out.SetGeometry(feature.GetGeometryRef())
+                outlayer.CreateFeature(out)
+
+        ds = None
+        return Layer(path)
+
+    def join_results_to_baseline(self, destination, result_file, baseline_file):
+        from osgeo import ogr
+
+        bds, baseline = _open_vector(self.load_data(baseline_file, 'layer').dataSource)
+        rds, results = _open_vector(self.load_data(result_file, 'layer').dataSource)
+        idfield = self.source_id_field(result_file, baseline_file)
+
+        path = self._path(destination)
+        if idfield is not None:
+            # the results, then the attributes of the baseline feature
+            # they came from (like JoinField)
+            ds, outlayer = self._create_layer(path, baseline.GetSpatialRef(), [])
+            sources = [results, baseline]
+            pairs = []
+            for match in results:
+                key = match.GetField(idfield)
+                target = baseline.GetFeature(key) if key is not None else None
+                if target is not None:
+                    pairs.append((target, match))
+        else:
+            # one output feature per matching pair (JOIN_ONE_TO_MANY,
+            # KEEP_COMMON)
+            ds, outlayer = self._create_layer(path, baseline.GetSpatialRef(), [
+                ogr.FieldDefn('Join_Count', ogr.OFTInteger),
+                ogr.FieldDefn('TARGET_FID', ogr.OFTInteger),
+                ogr.FieldDefn('JOIN_FID', ogr.OFTInteger),
+            ])
+            sources = [baseline, results]
+            pairs = []
+            for target in baseline:
+                geom = target.GetGeometryRef()
+                results.SetSpatialFilter(geom)
+                pairs.extend((target, f) for f in results if f.GetGeometryRef().Intersects(geom))
+                results.SetSpatialFilter(None)
+
+        names = self._copy_fields(outlayer, sources)
+        for target, match in pairs:
+            out = ogr.Feature(outlayer.GetLayerDefn())
+            if idfield is None:
+                out.SetField('Join_Count', 1)
+                out.SetField('TARGET_FID', target.GetFID())
+                out.SetField('JOIN_FID', match.GetFID())
+            features = [match, target] if idfield is not None else [target, match]
+            for n, feature in enumerate(features):
+                for name in _field_names(sources[n]):
+                    out.SetField(names[(n, name)], feature.GetField(name))
+            out.SetGeometry(target.GetGeometryRef())
+            outlayer.CreateFeature(out)
+
+        ds = None
+        return Layer(path)
+
+    def source_id_field(self, table, source):
+        tds, tlayer = _open_vector(self.load_data(table, 'layer').dataSource)
+        sds, slayer = _open_vector(self.load_data(source, 'layer').dataSource)
+        # named like in `intersect_polygon_layers`
+        fidfield = 'FID_{}'.format(slayer.GetName())[:10]
+        if fidfield in _field_names(tlayer):
+            return fidfield
+        return None
+
+    # -- attribute tables --------------------------------------------
+    def _check_fields(self, layer, *fieldnames, **kwargs):
+        should_exist = kwargs.pop('should_exist', False)
+        existing = _field_names(layer)
+        bad_names = [
+            name for name in fieldnames
+            if (name in existing) != should_exist and not name.startswith('SHAPE@')
+        ]
+        if len(bad_names) > 0:
+            qual = 'not' if should_exist else 'already'
+            raise ValueError('fields {} are {} in {}'.format(bad_names, qual, layer.GetName()))
+
+    @staticmethod
+    def _get_value(feature, field):
+        if field == 'SHAPE@AREA':
+            return feature.GetGeometryRef().GetArea()
+        elif field == 'SHAPE@':
+            return feature.GetGeometryRef().Clone()
+        return feature.GetField(field)
+
+    def add_field_with_value(self, table, field_name, field_value=None,
+                             overwrite=False, **field_opts):
+        from osgeo import ogr
+
+        typemap = {
+            int: 'LONG',
+            float: 'DOUBLE',
+            type(b''): 'TEXT',
+            type(u''): 'TEXT',
+            type(None): None
+        }
+        field_type = field_opts.pop("field_type", typemap[type(field_value)])
+        if field_value is None and field_type is None:
+            raise ValueError("must provide a `field_type` if not providing a value.")
+
+        ds, layer = _open_vector(self.load_data(table, 'layer').dataSource, update=True)
+        if not overwrite:
+            self._check_fields(layer, field_name, should_exist=False)
+
+        if field_name not in _field_names(layer):
+            field = ogr.FieldDefn(field_name, getattr(ogr, self._field_types[field_type.upper()]))
+            if 'field_length' in field_opts:
+                field.SetWidth(field_opts['field_length'])
+            layer.CreateField(field)
+        ds = None
+
+        if field_value is not None:
+            self.populate_field(table, lambda row: field_value, field_name)
+
+    def populate_field(self, table, value_fxn, valuefield, *keyfields):
+        fields = list(keyfields)
+        fields.append(valuefield)
+
+        ds, layer = _open_vector(self.load_data(table, 'layer').dataSource, update=True)
+        self._check_fields(layer, *fields, should_exist=True)
+        for feature in layer:
+            row = [self._get_value(feature, f) for f in fields]
+            value = value_fxn(row)
+            # OGR doesn't accept numpy scalars
+            feature.SetField(valuefield, getattr(value, 'item', lambda: value)())
+            layer.SetFeature(feature)
+        ds = None
+
+    def groupby_and_aggregate(self, input_path, groupfield, valuefield,
+                              aggfxn=None):
+        if aggfxn is None:
+            aggfxn = lambda x: int(numpy.unique(list(x)).shape[0])
+
+        ds, layer = _open_vector(self.load_data(input_path, 'layer').dataSource)
+        self._check_fields(layer, groupfield, valuefield, should_exist=True)
+        rows = [
+            (self._get_value(f, groupfield), self._get_value(f, valuefield))
+            for f in layer
+        ]
+        ds = None
+
+        counts = {}
+        if len(rows) == 0:
+            return counts
+
+        table = numpy.rec.fromrecords(rows, names=[groupfield, valuefield])
+        table.sort()
+        for groupname, shapes in itertools.groupby(table, lambda row: row[groupfield]):
+            counts[groupname] = aggfxn(shapes)
+
+        return counts
+
+    def dataset_exists(self, path):
+        return os.path.exists(self._path(path))
+
+    def cleanup_temp_results(self, *results):
+        for r in results:
+            if isinstance(r, (Raster, Layer) + _string_types):
+                self._delete(self._path(r))
+            else:
+                raise ValueError("Input must be paths, Rasters, or Layers")
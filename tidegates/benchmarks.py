@@ -0,0 +1,454 @@
+""" Scalable benchmarks for the hot paths of python-tidegates.
+
+The correctness tests in ``tidegates/tests`` use tiny fixtures and say
+nothing about how the library behaves on a county-sized DEM. This
+module times the expensive steps of the analysis over a grid of raster
+sizes (1000 x 1000 to 20000 x 20000 cells) and zone counts (10 to
+10,000 zones of influence) of the synthetic study areas from
+:mod:`tidegates.synthetic` and reports the timings and peak memory use
+in a stable JSON format so that runs can be compared over time.
+
+Run all of the benchmarks from a terminal with::
+
+    python -m tidegates.benchmarks --output benchmarks.json
+
+or select a subset with ``--benchmarks``, ``--sizes``, and ``--zones``
+(see ``python -m tidegates.benchmarks --help``).
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import threading
+from collections import OrderedDict
+
+import numpy
+
+from . import synthetic
+
+try:
+    import psutil
+except ImportError: # pragma: no cover
+    psutil = None
+
+try:
+    import tracemalloc
+except ImportError: # pragma: no cover
+    tracemalloc = None
+
+
+SCHEMA = 'tidegates-benchmarks/1'
+SIZES = (1000, 2000, 5000, 10000, 20000)
+ZONE_COUNTS = (10, 100, 1000, 10000)
+CELLSIZE = 4
+ID_COLUMN = 'GeoID'
+
+# name -> (function, requires_arcpy). Populated by `benchmark`.
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, requires_arcpy=True):
+    """ Decorator to register a benchmark.
+
+    The decorated function receives a :class:`Case` and performs all of
+    the untimed setup. It must return a callable that takes no
+    arguments and runs only the operation that should be timed.
+
+    """
+
+    def decorate(func):
+        BENCHMARKS[name] = (func, requires_arcpy)
+        return func
+    return decorate
+
+
+class Case(object):
+    """ A single combination of benchmark parameters.
+
+    Parameters
+    ----------
+    size : int
+        Number of rows and columns in the synthetic rasters.
+    nzones : int
+        Number of zones of influence in the synthetic data.
+    workspace : str
+        Folder in which any files needed by the benchmark are created.
+    cellsize : int or float, optional
+        Cell size of the synthetic rasters.
+    seed : int, optional (0)
+        Seed for :mod:`tidegates.synthetic`.
+
+    """
+
+    def __init__(self, size, nzones, workspace, cellsize=CELLSIZE, seed=0):
+        self.size = size
+        self.nzones = nzones
+        self.workspace = workspace
+        self.cellsize = cellsize
+        self.seed = seed
+        self._arrays = None
+
+    @property
+    def params(self):
+        return OrderedDict([('size', self.size), ('nzones', self.nzones), ('cellsize', self.cellsize)])
+
+    @property
+    def arrays(self):
+        """ Synthetic ``(topo_array, zones_array)`` for the case. """
+        if self._arrays is None:
+            self._arrays = (
+                synthetic.coastal_dem(self.size, seed=self.seed),
+                synthetic.zones_of_influence(self.size, nzones=self.nzones, seed=self.seed),
+            )
+        return self._arrays
+
+    @property
+    def template(self):
+        from tidegates import utils
+        return utils.RasterTemplate(self.cellsize, 0, 0, nrows=self.size, ncols=self.size)
+
+    def path(self, name):
+        return os.path.join(self.workspace, '{}_{}_{}'.format(name, self.size, self.nzones))
+
+
+class _MemoryMonitor(object):
+    """ Measures the peak memory used while the context is active.
+
+    Prefers sampling the resident set size with ``psutil`` (which
+    captures memory allocated by arcpy) and falls back to Python's
+    ``tracemalloc`` (which sees numpy's allocations).
+
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = None
+        self.method = None
+        self._stop = threading.Event()
+
+    def _sample(self, process, baseline):
+        peak = baseline
+        while not self._stop.is_set():
+            peak = max(peak, process.memory_info().rss)
+            self._stop.wait(self.interval)
+        self.peak = max(peak, process.memory_info().rss) - baseline
+
+    def __enter__(self):
+        if psutil is not None:
+            self.method = 'rss'
+            process = psutil.Process(os.getpid())
+            self._thread = threading.Thread(
+                target=self._sample,
+                args=(process, process.memory_info().rss)
+            )
+            self._thread.daemon = True
+            self._thread.start()
+        elif tracemalloc is not None:
+            self.method = 'tracemalloc'
+            tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.method == 'rss':
+            self._stop.set()
+            self._thread.join()
+        elif self.method == 'tracemalloc':
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    @property
+    def peak_mb(self):
+        if self.peak is None:
+            return None
+        return round(self.peak / 2.0**20, 3)
+
+
+def run_case(name, case, repeat=3):
+    """ Runs a single benchmark for a single :class:`Case`.
+
+    Returns
+    -------
+    result : OrderedDict
+        JSON-serializable results with keys *name*, *params*, *status*,
+        *repeat*, *times_s*, *min_s*, *median_s*, *peak_memory_mb*,
+        *memory_method*, and *message*.
+
+    """
+
+    func, requires_arcpy = BENCHMARKS[name]
+    result = OrderedDict([
+        ('name', name),
+        ('params', case.params),
+        ('status', 'ok'),
+        ('repeat', repeat),
+        ('times_s', []),
+        ('min_s', None),
+        ('median_s', None),
+        ('peak_memory_mb', None),
+        ('memory_method', None),
+        ('message', None),
+    ])
+
+    if requires_arcpy and not _has_arcpy():
+        result['status'] = 'skipped'
+        result['message'] = 'arcpy is not available'
+        return result
+
+    try:
+        timed = func(case)
+        peak = 0.0
+        for _ in range(repeat):
+            with _MemoryMonitor() as monitor:
+                tic = time.time()
+                timed()
+                toc = time.time()
+            result['times_s'].append(round(toc - tic, 6))
+            result['memory_method'] = monitor.method
+            if monitor.peak_mb is not None:
+                peak = max(peak, monitor.peak_mb)
+                result['peak_memory_mb'] = peak
+    except MemoryError:
+        result['status'] = 'error'
+        result['message'] = 'MemoryError'
+    except Exception as e:
+        result['status'] = 'error'
+        result['message'] = '{}: {}'.format(type(e).__name__, e)
+
+    if result['times_s']:
+        result['min_s'] = min(result['times_s'])
+        result['median_s'] = float(numpy.median(result['times_s']))
+
+    return result
+
+
+def run(names=None, sizes=SIZES, zone_counts=ZONE_COUNTS, repeat=3,
+        workspace=None, cellsize=CELLSIZE, verbose=False):
+    """ Runs a collection of benchmarks over all combinations of
+    raster sizes and zone counts.
+
+    Parameters
+    ----------
+    names : list of str, optional
+        Names of the benchmarks to run (see :data:`BENCHMARKS`).
+        Defaults to all of them.
+    sizes : list of int, optional
+        Number of rows and columns of the synthetic rasters.
+    zone_counts : list of int, optional
+        Number of zones of influence.
+    repeat : int, optional (3)
+        Number of times that each benchmark is timed.
+    workspace : str, optional
+        Folder for the files created by the benchmarks. A temporary
+        folder is created (and removed afterwards) if not provided.
+
+    Returns
+    -------
+    report : OrderedDict
+        JSON-serializable report of the environment and results.
+
+    """
+
+    if names is None:
+        names = list(BENCHMARKS.keys())
+
+    unknown = set(names) - set(BENCHMARKS.keys())
+    if unknown:
+        raise ValueError('unknown benchmarks: {}'.format(sorted(unknown)))
+
+    cleanup = workspace is None
+    if cleanup:
+        workspace = tempfile.mkdtemp(prefix='tidegates_bench_')
+
+    results = []
+    try:
+        for size in sizes:
+            for nzones in zone_counts:
+                case = Case(size, nzones, workspace, cellsize=cellsize)
+                for name in names:
+                    result = run_case(name, case, repeat=repeat)
+                    if verbose:
+                        print('{name:>24s} size={size:<6d} zones={nzones:<6d} {status} {median}'.format(
+                            name=name, size=size, nzones=nzones,
+                            status=result['status'], median=result['median_s']
+                        ))
+                    results.append(result)
+                del case
+    finally:
+        if cleanup:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = OrderedDict([
+        ('schema', SCHEMA),
+        ('created', datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')),
+        ('environment', _environment()),
+        ('results', results),
+    ])
+    return report
+
+
+def save(report, filename):
+    """ Writes a benchmark report to a JSON file. """
+    with open(filename, 'w') as output:
+        json.dump(report, output, indent=2)
+    return filename
+
+
+def _has_arcpy():
+    try:
+        import arcpy
+    except ImportError:
+        return False
+    return True
+
+
+def _environment():
+    env = OrderedDict([
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('numpy', numpy.__version__),
+        ('arcpy', None),
+        ('cpu_count', None),
+    ])
+
+    if psutil is not None:
+        env['cpu_count'] = psutil.cpu_count()
+
+    if _has_arcpy(): # pragma: no cover
+        import arcpy
+        env['arcpy'] = arcpy.GetInstallInfo().get('Version')
+
+    return env
+
+
+def _zone_polygons(case):
+    """ Creates (once) the polygons of the zones of influence. """
+    from tidegates import utils
+
+    filename = case.path('zones') + '.shp'
+    if not os.path.exists(filename):
+        raster = _zone_raster(case)
+        utils.raster_to_polygons(raster, filename, newfield=ID_COLUMN)
+    return filename
+
+
+def _zone_raster(case):
+    """ Creates (once) the raster of the zones of influence. """
+    from tidegates import utils
+
+    filename = case.path('zones') + '.tif'
+    if not os.path.exists(filename):
+        utils.array_to_raster(case.arrays[1], case.template, outfile=filename)
+    return filename
+
+
+@benchmark('flood_zones', requires_arcpy=False)
+def bench_flood_zones(case):
+    from tidegates import utils
+    topo, zones = case.arrays
+    return lambda: utils.flood_zones(zones, topo, 3.0)
+
+
+@benchmark('groupby_and_aggregate')
+def bench_groupby_and_aggregate(case):
+    from tidegates import utils
+    polygons = _zone_polygons(case)
+    return lambda: utils.groupby_and_aggregate(
+        polygons, ID_COLUMN, 'SHAPE@AREA',
+        aggfxn=lambda group: sum(row[1] for row in group)
+    )
+
+
+@benchmark('populate_field')
+def bench_populate_field(case):
+    from tidegates import utils
+    polygons = _zone_polygons(case)
+    utils.add_field_with_value(polygons, 'bench', field_type='DOUBLE', overwrite=True)
+    values = dict((n, n * 0.5) for n in range(case.nzones + 1))
+    return lambda: utils.populate_field(
+        polygons, lambda row: values.get(row[0], -999), 'bench', ID_COLUMN
+    )
+
+
+@benchmark('rasterization')
+def bench_rasterization(case):
+    from tidegates import utils
+    polygons = _zone_polygons(case)
+    outfile = case.path('rasterized') + '.tif'
+    return lambda: utils.polygons_to_raster(polygons, ID_COLUMN, cellsize=case.cellsize,
+                                            outfile=outfile)
+
+
+@benchmark('vectorization')
+def bench_vectorization(case):
+    from tidegates import utils
+    raster = utils.load_data(_zone_raster(case), 'raster')
+    outfile = case.path('vectorized') + '.shp'
+    return lambda: utils.raster_to_polygons(raster, outfile, newfield=ID_COLUMN)
+
+
+@benchmark('flood_area')
+def bench_flood_area(case):
+    import tidegates
+    from tidegates import utils
+    topo, zones = case.arrays
+    outfile = case.path('flood_area') + '.shp'
+
+    def timed():
+        with utils.WorkSpace(case.workspace), utils.OverwriteState(True):
+            tidegates.flood_area(topo, zones, case.template, ID_COLUMN, 10.0,
+                                 filename=outfile, cleanup=True)
+    return timed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m tidegates.benchmarks',
+        description='Benchmark the hot paths of python-tidegates.'
+    )
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS.keys()),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES),
+                        help='rows/columns of the synthetic rasters')
+    parser.add_argument('--zones', nargs='+', type=int, default=list(ZONE_COUNTS),
+                        help='numbers of zones of influence')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timings per benchmark')
+    parser.add_argument('--workspace', help='folder for intermediate files')
+    parser.add_argument('--output', help='JSON file for the results (default: stdout)')
+    args = parser.parse_args(argv)
+
+    report = run(
+        names=args.benchmarks,
+        sizes=args.sizes,
+        zone_counts=args.zones,
+        repeat=args.repeat,
+        workspace=args.workspace,
+        verbose=args.output is not None,
+    )
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        save(report, args.output)
+
+    errors = [r for r in report['results'] if r['status'] == 'error']
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
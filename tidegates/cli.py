@@ -0,0 +1,565 @@
+""" Command-line interface for python-tidegates.
+
+This runs the flood-impact analysis without ArcMap, ArcCatalog, or a
+notebook (e.g., from cron jobs, cluster schedulers, or a terminal).
+The inputs of the analysis are read from a JSON or YAML run config:
+
+.. code-block:: json
+
+    {
+        "workspace": "C:/data/tidegates.gdb",
+        "dem": "dem_x08",
+        "zones": "ZOI",
+        "ID_column": "GeoID",
+        "scenarios": "standard",
+        "assets": {
+            "wetlands": "wetlands",
+            "buildings": "buildings"
+        },
+        "outputs": {
+            "floods": "std_floods",
+            "wetlands": "std_wetlands",
+            "buildings": "std_buildings"
+        }
+    }
+
+``scenarios`` may be "standard" (the default), a list of custom flood
+elevations, or the path to a CSV file with an "elevation" column.
+The ``assets`` and their ``outputs`` are optional. YAML configs
+require PyYAML.
+
+Usage::
+
+    tidegates run config.json --jobs 4 --cache C:/data/cache --report timing.json
+
+The flood statistics of the scenarios (with percentiles for the
+uncertainty of the DEM, and expected annual damages) can be computed
+without making the output datasets (see :mod:`tidegates.engine`)::
+
+    tidegates stats config.json --realizations 500 --ead --output stats.json
+
+Large runs can be spread across several machines that share a
+directory (see :mod:`tidegates.distributed`)::
+
+    tidegates coordinate config.json //server/share/run01 --split zones --groups 8
+    tidegates work //server/share/run01
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import traceback
+from collections import OrderedDict
+
+from . import profiling
+from . import backends
+from . import toolbox
+from . import distributed
+
+
+OUTPUT_FORMATS = ('shapefile', 'featureclass')
+
+EXIT_SUCCESS = 0
+EXIT_FAILURE = 1
+EXIT_CONFIG_ERROR = 2
+
+
+class ConfigError(ValueError):
+    """ Raised when a run config is missing values or can't be read.
+    """
+    pass
+
+
+def load_config(filename):
+    """ Reads a JSON or YAML run config.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the config. Files ending with ".yml" or ".yaml" are
+        parsed as YAML, everything else as JSON.
+
+    Returns
+    -------
+    config : dict
+
+    """
+
+    if not os.path.exists(filename):
+        raise ConfigError('config file {} does not exist'.format(filename))
+
+    with open(filename, 'r') as configfile:
+        if os.path.splitext(filename)[1].lower() in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ConfigError('PyYAML is required to read {}'.format(filename))
+            config = yaml.safe_load(configfile)
+        else:
+            try:
+                config = json.load(configfile)
+            except ValueError as e:
+                raise ConfigError('{} is not valid JSON ({})'.format(filename, e))
+
+    if not isinstance(config, dict):
+        raise ConfigError('{} does not define a mapping of parameters'.format(filename))
+
+    return config
+
+
+def read_scenarios(scenarios, basedir='.'):
+    """ Parses the ``scenarios`` entry of a run config.
+
+    Parameters
+    ----------
+    scenarios : None, str, or list of floats
+        None or "standard" for the standard sea level rise and storm
+        surge scenarios, a list of flood elevations, or the path to a
+        CSV file (relative to ``basedir``) with an "elevation" column.
+    basedir : str, optional
+        Folder containing the run config.
+
+    Returns
+    -------
+    elevations : list of floats or None
+        Custom flood elevations, or None for the standard scenarios.
+
+    """
+
+    if scenarios is None or scenarios == 'standard':
+        return None
+
+    if isinstance(scenarios, (type(b''), type(u''))):
+        csvpath = os.path.join(basedir, scenarios)
+        if not os.path.exists(csvpath):
+            raise ConfigError('scenario table {} does not exist'.format(csvpath))
+
+        with open(csvpath, 'r') as csvfile:
+            rows = list(csv.DictReader(csvfile))
+
+        try:
+            scenarios = [row['elevation'] for row in rows]
+        except KeyError:
+            raise ConfigError('scenario table {} has no "elevation" column'.format(csvpath))
+
+    try:
+        elevations = [float(elev) for elev in scenarios]
+    except (TypeError, ValueError):
+        raise ConfigError('scenarios must be "standard", a list of elevations, or a CSV file')
+
+    if len(elevations) == 0:
+        raise ConfigError('no scenarios to analyze')
+
+    return elevations
+
+
+def _format_output(path, output_format):
+    if path is None or output_format is None:
+        return path
+
+    base, ext = os.path.splitext(path)
+    if output_format == 'shapefile':
+        return base + '.shp'
+    else:
+        return base
+
+
+def make_params(config, output_format=None, basedir='.'):
+    """ Converts a run config to the toolbox class and parameters
+    of its :meth:`~tidegates.toolbox.StandardScenarios.main_execute`
+    method.
+
+    Parameters
+    ----------
+    config : dict
+        The run config (see :func:`load_config`).
+    output_format : str, optional
+        Either "shapefile" (adds a ".shp" extension to the outputs) or
+        "featureclass" (removes the extensions so that the outputs are
+        saved in a geodatabase workspace). By default, the outputs are
+        left as they are in the config.
+    basedir : str, optional
+        Folder containing the run config. A relative workspace is
+        relative to this folder.
+
+    Returns
+    -------
+    toolclass : type
+        :class:`~tidegates.toolbox.StandardScenarios` or
+        :class:`~tidegates.toolbox.Flooder`.
+    params : dict
+
+    """
+
+    missing = [
+        key for key in ('workspace', 'dem', 'zones', 'ID_column')
+        if not config.get(key)
+    ]
+    if missing:
+        raise ConfigError('config is missing {}'.format(', '.join(missing)))
+
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ConfigError('unknown output format "{}"'.format(output_format))
+
+    assets = config.get('assets', {}) or {}
+    outputs = config.get('outputs', {}) or {}
+    if 'floods' not in outputs:
+        raise ConfigError('config is missing outputs.floods')
+
+    params = {
+        'workspace': os.path.join(basedir, config['workspace']),
+        'dem': config['dem'],
+        'zones': config['zones'],
+        'ID_column': config['ID_column'],
+        'flood_output': _format_output(outputs['floods'], output_format),
+    }
+
+    for asset, outputkey in [('wetlands', 'wetland_output'), ('buildings', 'building_output')]:
+        if assets.get(asset):
+            params[asset] = assets[asset]
+            if outputs.get(asset):
+                params[outputkey] = _format_output(outputs[asset], output_format)
+
+    elevations = read_scenarios(config.get('scenarios'), basedir=basedir)
+    if elevations is None:
+        toolclass = toolbox.StandardScenarios
+    else:
+        toolclass = toolbox.Flooder
+        params['elevation'] = elevations
+
+    return toolclass, params
+
+
+def timing_report(tracer, wall_time, status='success', message=None):
+    """ Summarizes the spans recorded during a run.
+
+    Parameters
+    ----------
+    tracer : tidegates.profiling.Tracer
+        The tracer that recorded the run.
+    wall_time : float
+        Total duration of the run, in seconds.
+    status : str, optional
+        "success" or "error".
+    message : str, optional
+        Error message of a failed run.
+
+    Returns
+    -------
+    report : OrderedDict
+        The status, total time, and the number of calls and total
+        time of each span name, slowest first. Spans are nested, so
+        the times of the spans overlap.
+
+    """
+
+    spans = {}
+    for event in tracer.events:
+        calls, total = spans.get(event['name'], (0, 0))
+        spans[event['name']] = (calls + 1, total + event['dur'] * 1e-6)
+
+    report = OrderedDict()
+    report['status'] = status
+    report['message'] = message
+    report['total_s'] = round(wall_time, 3)
+    report['spans'] = OrderedDict(
+        (name, OrderedDict([('calls', calls), ('total_s', round(total, 3))]))
+        for name, (calls, total) in sorted(spans.items(), key=lambda s: -s[1][1])
+    )
+    return report
+
+
+def _execute(func, trace=None):
+    """ Calls ``func`` and reports its status and timing (see
+    :func:`timing_report`).
+
+    """
+
+    status, message = 'success', None
+    begin = time.time()
+    with profiling.Tracer(trace) as tracer:
+        try:
+            func()
+        except Exception as e:
+            traceback.print_exc()
+            status, message = 'error', '{}: {}'.format(type(e).__name__, e)
+
+    return timing_report(tracer, time.time() - begin, status=status, message=message)
+
+
+def run(config, jobs=1, cache=None, output_format=None, trace=None, basedir='.',
+        memmap=False, compact=False, pipelined=False, prefilter=False):
+    """ Runs the analysis described by a run config.
+
+    Parameters
+    ----------
+    config : dict
+        The run config (see :func:`load_config`).
+    jobs : int, optional (1)
+        Number of worker processes among which the scenarios will be
+        divided.
+    cache : str, optional
+        Folder in which the DEM and zones are cached as arrays.
+    output_format : str, optional
+        "shapefile" or "featureclass" (see :func:`make_params`).
+    trace : str, optional
+        Path to a JSON file where a Chrome trace of the run will be
+        saved (see :mod:`tidegates.profiling`).
+    basedir : str, optional
+        Folder containing the run config.
+    memmap : bool or str, optional (False)
+        Keep the DEM and zones arrays in memory-mapped files in the
+        temporary (or given) folder, shared by the worker processes.
+    compact : bool, optional (False)
+        Hold the DEM and zones as compact arrays (see
+        :class:`tidegates.utils.CompactArrays`).
+    pipelined : bool, optional (False)
+        With a single job, flood the next scenario in a background
+        thread while the current one is analyzed.
+    prefilter : bool, optional (False)
+        Only intersect the floods with the wetlands and buildings that
+        the highest flood reaches (see
+        :func:`tidegates.analysis.prefilter_assets`).
+
+    Returns
+    -------
+    report : OrderedDict
+        The timing report (see :func:`timing_report`).
+
+    """
+
+    toolclass, params = make_params(config, output_format=output_format, basedir=basedir)
+
+    def execute():
+        toolclass().main_execute(jobs=jobs, cache=cache, memmap=memmap,
+                                 compact=compact, pipelined=pipelined,
+                                 prefilter=prefilter, **params)
+
+    return _execute(execute, trace=trace)
+
+
+def stats(config, realizations=0, sigma=0.15, ead=False, output=None,
+          cache=None, trace=None, basedir='.'):
+    """ Computes the flood statistics of the scenarios of a run config
+    with :meth:`~tidegates.toolbox.StandardScenarios.zone_statistics`.
+
+    Parameters
+    ----------
+    config : dict
+        The run config (see :func:`load_config`). Its outputs are not
+        used.
+    realizations, sigma, ead
+        See :meth:`~tidegates.toolbox.StandardScenarios.zone_statistics`.
+    output : str, optional
+        JSON file where the statistics will be saved. By default, they
+        are printed to stdout.
+    cache, trace, basedir
+        See :func:`run`.
+
+    Returns
+    -------
+    report : OrderedDict
+        The timing report (see :func:`timing_report`).
+
+    """
+
+    toolclass, params = make_params(config, basedir=basedir)
+
+    def execute():
+        results = toolclass().zone_statistics(realizations=realizations, sigma=sigma,
+                                              ead=ead, cache=cache, **params)
+        if output is None:
+            json.dump(results, sys.stdout, indent=2)
+            sys.stdout.write('\n')
+        else:
+            with open(output, 'w') as outfile:
+                json.dump(results, outfile, indent=2)
+
+    return _execute(execute, trace=trace)
+
+
+def coordinate(config, shared, split='scenario', groups=1, work=False,
+               poll=5, requeue_after=None, cache=None, output_format=None,
+               trace=None, basedir='.', prefilter=False):
+    """ Runs the analysis described by a run config across the workers
+    of a shared directory (see :mod:`tidegates.distributed`).
+
+    Parameters
+    ----------
+    config : dict
+        The run config (see :func:`load_config`).
+    shared : str
+        Directory shared with the workers.
+    split : str, optional ('scenario')
+        Split the run into tasks by "scenario" or by "zones" (i.e., by
+        scenario and group of zones of influence).
+    groups : int, optional (1)
+        Number of groups of zones when ``split`` is "zones".
+    work : bool, optional (False)
+        When True, the coordinator also works on the tasks.
+    poll : float, optional (5)
+        Seconds between checks for finished tasks.
+    requeue_after : float, optional
+        Seconds after which claimed tasks that their workers stopped
+        touching are assumed to be abandoned and are returned to the
+        queue. Must be longer than the workers' heartbeat (see
+        :data:`tidegates.distributed.HEARTBEAT`).
+    cache, output_format, trace, basedir, prefilter
+        See :func:`run`.
+
+    Returns
+    -------
+    report : OrderedDict
+        The timing report (see :func:`timing_report`).
+
+    """
+
+    toolclass, params = make_params(config, output_format=output_format, basedir=basedir)
+
+    def execute():
+        distributed.prepare(shared, split=split, ngroups=groups, cache=cache,
+                            prefilter=prefilter, **params)
+        if work:
+            distributed.work(shared)
+        distributed.wait(shared, poll=poll, requeue_after=requeue_after)
+        distributed.merge(shared)
+
+    return _execute(execute, trace=trace)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='tidegates',
+        description='Analyze the extent and impact of floods without ArcGIS Desktop.'
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    runparser = subparsers.add_parser('run', help='run the analysis described by a config file')
+    runparser.add_argument('config', help='JSON or YAML run config')
+    runparser.add_argument('--jobs', type=int, default=1,
+                           help='number of worker processes (default: 1)')
+    runparser.add_argument('--memmap', nargs='?', const=True, default=False, metavar='FOLDER',
+                           help='share the DEM and zones arrays among the workers as memory-mapped '
+                                'files (in FOLDER or the temporary folder)')
+    runparser.add_argument('--compact', action='store_true',
+                           help='hold the DEM and zones as float32 elevations, narrow zone codes, '
+                                'and a bit-packed validity mask')
+    runparser.add_argument('--pipeline', action='store_true',
+                           help='with a single job, flood the next scenario in a background thread '
+                                'while the current one is analyzed')
+
+    statsparser = subparsers.add_parser('stats',
+                                        help='compute the flood statistics of the scenarios '
+                                             'of a config file')
+    statsparser.add_argument('config', help='JSON or YAML run config')
+    statsparser.add_argument('--realizations', type=int, default=0,
+                             help='number of perturbed DEMs for percentiles (default: 0)')
+    statsparser.add_argument('--sigma', type=float, default=0.15,
+                             help='vertical error of the DEM, in its units (default: 0.15)')
+    statsparser.add_argument('--ead', action='store_true',
+                             help='also compute the expected annual damages')
+    statsparser.add_argument('--output', help='JSON file for the statistics (default: stdout)')
+
+    coordparser = subparsers.add_parser('coordinate',
+                                        help='divide a run among the workers of a shared directory')
+    coordparser.add_argument('config', help='JSON or YAML run config')
+    coordparser.add_argument('shared', help='directory shared with the workers')
+    coordparser.add_argument('--split', choices=('scenario', 'zones'), default='scenario',
+                             help='split the run by scenario or by scenario and group of zones')
+    coordparser.add_argument('--groups', type=int, default=1,
+                             help='number of groups of zones (with --split zones)')
+    coordparser.add_argument('--work', action='store_true',
+                             help='also work on the tasks')
+    coordparser.add_argument('--poll', type=float, default=5,
+                             help='seconds between checks for finished tasks (default: 5)')
+    coordparser.add_argument('--requeue-after', type=float,
+                             help='seconds after which claimed tasks that their workers stopped '
+                                  'touching are returned to the queue (more than {}s)'.format(
+                                      distributed.HEARTBEAT))
+
+    workparser = subparsers.add_parser('work', help='work on the tasks of a shared directory')
+    workparser.add_argument('shared', help='directory prepared by a coordinator')
+    workparser.add_argument('--max-tasks', type=int, help='stop after this many tasks')
+    workparser.add_argument('--poll', type=float,
+                            help='wait this many seconds for more tasks instead of stopping')
+
+    for subparser in (runparser, statsparser, coordparser, workparser):
+        subparser.add_argument('--backend', choices=backends.available(),
+                               help='geoprocessing backend (default: arcpy)')
+
+    for subparser in (runparser, statsparser, coordparser):
+        subparser.add_argument('--cache', help='folder for cached DEM and zones arrays')
+        subparser.add_argument('--report', help='JSON file for the timing report (default: stderr)')
+        subparser.add_argument('--trace', help='JSON file for a Chrome trace of the run')
+
+    for subparser in (runparser, coordparser):
+        subparser.add_argument('--output-format', choices=OUTPUT_FORMATS,
+                               help='save the outputs as shapefiles or geodatabase feature classes')
+        subparser.add_argument('--prefilter', action='store_true',
+                               help='only intersect the floods with the wetlands and buildings '
+                                    'that the highest flood reaches')
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_usage(sys.stderr)
+        return EXIT_CONFIG_ERROR
+
+    if args.backend is not None:
+        try:
+            backends.set_backend(args.backend)
+        except ImportError as e:
+            sys.stderr.write('tidegates: error: {} backend is unavailable ({})\n'.format(args.backend, e))
+            return EXIT_CONFIG_ERROR
+
+    if args.command == 'work':
+        count = distributed.work(args.shared, max_tasks=args.max_tasks, poll=args.poll)
+        sys.stderr.write('tidegates: analyzed {} tasks\n'.format(count))
+        return EXIT_SUCCESS
+
+    try:
+        config = load_config(args.config)
+        options = dict(
+            cache=args.cache,
+            trace=args.trace,
+            basedir=os.path.dirname(os.path.abspath(args.config)),
+        )
+        if args.command == 'stats':
+            report = stats(config, realizations=args.realizations, sigma=args.sigma,
+                           ead=args.ead, output=args.output, **options)
+        elif args.command == 'run':
+            report = run(config, jobs=args.jobs, memmap=args.memmap, compact=args.compact,
+                         pipelined=args.pipeline, prefilter=args.prefilter,
+                         output_format=args.output_format, **options)
+        else:
+            options['output_format'] = args.output_format
+            options['prefilter'] = args.prefilter
+            report = coordinate(config, args.shared, split=args.split, groups=args.groups,
+                                work=args.work, poll=args.poll,
+                                requeue_after=args.requeue_after, **options)
+    except ConfigError as e:
+        sys.stderr.write('tidegates: error: {}\n'.format(e))
+        return EXIT_CONFIG_ERROR
+
+    if args.report is None:
+        json.dump(report, sys.stderr, indent=2)
+        sys.stderr.write('\n')
+    else:
+        with open(args.report, 'w') as reportfile:
+            json.dump(report, reportfile, indent=2)
+
+    return EXIT_SUCCESS if report['status'] == 'success' else EXIT_FAILURE
+
+
+if __name__ == '__main__':
+    sys.exit(main())
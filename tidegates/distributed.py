@@ -0,0 +1,637 @@
+""" Distributed execution of python-tidegates over a shared filesystem.
+
+This spreads the scenarios of a large run across several machines
+that can all read and write the same directory (e.g., a network
+share). No message broker or network service is involved:
+
+  1. The coordinator (:func:`prepare`) converts the DEM and zones of
+     influence to arrays once, saves them as an input bundle in the
+     shared directory (``.npy`` files that the workers memory-map
+     instead of loading a copy each), and writes one JSON task descriptor per
+     scenario (or per scenario and group of zones) to
+     ``tasks/pending``.
+  2. Each worker (:func:`work`) claims a task by renaming its
+     descriptor into ``tasks/claimed``. Renames are atomic, so only
+     one worker can claim a given task. The worker records its ID in
+     the claim, touches it while it works (so that live workers' tasks
+     aren't requeued), and writes the paths to its partial outputs to
+     ``tasks/done``.
+  3. The coordinator (:func:`merge`) merges the partial outputs with
+     :meth:`tidegates.toolbox.StandardScenarios.merge_results`, just
+     like a single-machine run.
+
+The paths in the parameters of the run must be valid on every
+machine (e.g., UNC paths on Windows).
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import os
+import json
+import time
+import socket
+import threading
+import traceback
+
+import numpy
+
+import tidegates
+from tidegates import utils
+from tidegates import toolbox
+
+
+MANIFEST = 'run.json'
+BUNDLE = 'bundle.npz'
+BUNDLE_ARRAYS = ('topo', 'zones')
+OUTPUTS = 'outputs'
+EXTENT = 'flood_extent.shp'
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+# seconds between the touches of a claim by its worker. `requeue_after`
+# must be longer than this.
+HEARTBEAT = 60
+
+
+class WorkQueue(object):
+    """ A queue of JSON task descriptors in a shared directory.
+
+    Each task is a file that moves from ``tasks/pending`` to
+    ``tasks/claimed`` (when a worker starts it) and then either to
+    ``tasks/done`` or ``tasks/failed``.
+
+    Parameters
+    ----------
+    root : str
+        The shared directory.
+
+    """
+
+    def __init__(self, root):
+        self.root = root
+        for state in STATES:
+            folder = self.folder(state)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+
+    def folder(self, state):
+        return os.path.join(self.root, 'tasks', state)
+
+    def names(self, state):
+        """ Sorted names of the tasks in the given state. """
+        return sorted(
+            n for n in os.listdir(self.folder(state))
+            if n.endswith('.json')
+        )
+
+    def counts(self):
+        """ The number of tasks in each state. """
+        return dict((state, len(self.names(state))) for state in STATES)
+
+    def _write(self, state, task):
+        # write to a hidden file first so that nobody reads a partial
+        # descriptor, then move it into place.
+        path = os.path.join(self.folder(state), task['name'])
+        tmp = os.path.join(self.folder(state), '.{}.tmp'.format(task['name']))
+        with open(tmp, 'w') as taskfile:
+            json.dump(task, taskfile, indent=2)
+
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+        return path
+
+    def _read(self, state, name):
+        with open(os.path.join(self.folder(state), name), 'r') as taskfile:
+            return json.load(taskfile)
+
+    def owner(self, task):
+        """ The ID of the worker that has currently claimed ``task``,
+        or None if it isn't claimed.
+
+        """
+
+        try:
+            return self._read('claimed', task['name']).get('worker')
+        except (IOError, OSError, ValueError):
+            # not claimed (anymore), or being rewritten by its claimer
+            return None
+
+    def put(self, task):
+        """ Adds a task (a dictionary with a unique "name" that ends
+        with ".json") to the queue.
+
+        """
+
+        return self._write('pending', task)
+
+    def claim(self, worker_id):
+        """ Claims the first available task.
+
+        Parameters
+        ----------
+        worker_id : str
+            Identifies the worker in the claimed task.
+
+        Returns
+        -------
+        task : dict or None
+            None when no tasks are pending.
+
+        """
+
+        for name in self.names('pending'):
+            src = os.path.join(self.folder('pending'), name)
+            dst = os.path.join(self.folder('claimed'), name)
+            try:
+                os.rename(src, dst)
+            except OSError:
+                # another worker got there first
+                continue
+
+            # rewriting the claim records its owner and resets its
+            # age, which is used to find abandoned tasks
+            task = self._read('claimed', name)
+            task['worker'] = worker_id
+            self._write('claimed', task)
+            return task
+
+        return None
+
+    def touch(self, task):
+        """ Resets the age of a claimed task so that it isn't requeued
+        (see :meth:`requeue`).
+
+        Returns
+        -------
+        owned : bool
+            False if the task has been requeued (and maybe claimed by
+            another worker) in the meantime.
+
+        """
+
+        if self.owner(task) != task['worker']:
+            return False
+
+        try:
+            os.utime(os.path.join(self.folder('claimed'), task['name']), None)
+        except OSError:
+            return False
+        return True
+
+    def _release(self, task):
+        # move the claim out of the way first, so that it can't be
+        # requeued (or claimed by another worker) while it's checked
+        claimed = os.path.join(self.folder('claimed'), task['name'])
+        released = os.path.join(self.folder('claimed'),
+                                '.{}.{}.released'.format(task['name'], task['worker']))
+        try:
+            os.rename(claimed, released)
+        except OSError:
+            return False
+
+        with open(released, 'r') as taskfile:
+            owner = json.load(taskfile).get('worker')
+        if owner != task['worker']:
+            os.rename(released, claimed)
+            return False
+
+        os.remove(released)
+        return True
+
+    def complete(self, task, result):
+        """ Records the ``result`` of a claimed task.
+
+        Returns
+        -------
+        completed : bool
+            False (and nothing is recorded) if the task isn't claimed
+            by the task's worker anymore, e.g., after it was requeued.
+
+        """
+
+        if not self._release(task):
+            return False
+        self._write('done', dict(task, result=result))
+        return True
+
+    def fail(self, task, message):
+        """ Records the error ``message`` of a claimed task.
+
+        Returns
+        -------
+        failed : bool
+            See :meth:`complete`.
+
+        """
+
+        if not self._release(task):
+            return False
+        self._write('failed', dict(task, error=message))
+        return True
+
+    def requeue(self, older_than):
+        """ Moves tasks whose claims haven't been touched (see
+        :meth:`touch`) for more than ``older_than`` seconds (e.g.,
+        because their worker died) back to the pending tasks.
+
+        Returns
+        -------
+        names : list of str
+            The requeued tasks.
+
+        """
+
+        now = time.time()
+        requeued = []
+        for name in self.names('claimed'):
+            src = os.path.join(self.folder('claimed'), name)
+            try:
+                if now - os.path.getmtime(src) > older_than:
+                    os.rename(src, os.path.join(self.folder('pending'), name))
+                    requeued.append(name)
+            except OSError:
+                # finished (or requeued by someone else) in the meantime
+                continue
+        return requeued
+
+    def results(self):
+        """ The finished tasks, sorted by name. """
+        return [self._read('done', name) for name in self.names('done')]
+
+    def failures(self):
+        """ The failed tasks, sorted by name. """
+        return [self._read('failed', name) for name in self.names('failed')]
+
+
+class _Heartbeat(object):
+    """ Touches a claimed task every ``interval`` seconds (in a
+    background thread) while the context is active.
+
+    """
+
+    def __init__(self, queue, task, interval=HEARTBEAT):
+        self.queue = queue
+        self.task = task
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            if not self.queue.touch(self.task):
+                break
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def _absolute(workspace, path):
+    if path is None:
+        return None
+    return os.path.abspath(os.path.join(workspace, path))
+
+
+def _jsonable(scenario):
+    # numpy scalars (e.g., the sea level rise) -> python scalars
+    return dict((k, getattr(v, 'item', lambda: v)()) for k, v in scenario.items())
+
+
+def zone_groups(zones_array, ngroups):
+    """ Divides the zones of influence into groups of consecutive IDs
+    and finds the rows and columns that contain each group.
+
+    Parameters
+    ----------
+    zones_array : numpy.ndarray
+        Array of zone IDs (IDs <= 0 are outside of the zones).
+    ngroups : int
+        Maximum number of groups.
+
+    Returns
+    -------
+    groups : list of (list of int, tuple)
+        The zone IDs of each group and the bounding window,
+        ``(row_start, row_stop, col_start, col_stop)``, of those zones.
+
+    """
+
+    ids = numpy.unique(zones_array[zones_array > 0])
+    groups = []
+    for group in numpy.array_split(ids, min(ngroups, ids.size) or 1):
+        if group.size == 0:
+            continue
+        rows, cols = numpy.nonzero(numpy.in1d(zones_array, group).reshape(zones_array.shape))
+        window = (int(rows.min()), int(rows.max()) + 1, int(cols.min()), int(cols.max()) + 1)
+        groups.append(([int(i) for i in group], window))
+    return groups
+
+
+def _subset(topo_array, zones_array, template, zone_ids, window):
+    """ Crops the arrays to a group of zones. Zones outside of the
+    group are set to 0.
+
+    """
+
+    r0, r1, c0, c1 = window
+    if template.shape is None:
+        template = template.with_shape(*zones_array.shape)
+
+    topo = topo_array[r0:r1, c0:c1]
+    zones = zones_array[r0:r1, c0:c1].copy()
+    zones[~numpy.in1d(zones, zone_ids).reshape(zones.shape)] = 0
+
+    return topo, zones, template.subset(window)
+
+
+def prepare(shared, split='scenario', ngroups=1, cache=None, prefilter=False, **params):
+    """ Writes the input bundle and task descriptors of a run to a
+    shared directory.
+
+    Parameters
+    ----------
+    shared : str
+        Directory shared by the coordinator and all of the workers.
+    split : str, optional ('scenario')
+        Either "scenario" for one task per scenario or "zones" for one
+        task per scenario and group of zones of influence.
+    ngroups : int, optional (1)
+        Number of groups of zones when ``split`` is "zones".
+    cache : str, optional
+        Folder in which the DEM and zones are cached as arrays (see
+        :func:`tidegates.analysis.process_dem_and_zones`).
+    prefilter : bool, optional (False)
+        Only intersect the floods with the wetlands and buildings that
+        the run's largest flood intersects (see
+        :func:`tidegates.analysis.prefilter_assets`). The polygons of
+        that flood are saved in the shared directory, and each worker
+        selects the assets once.
+    **params : keyword arguments
+        Parameters of the run, as passed to
+        :meth:`tidegates.toolbox.StandardScenarios.main_execute`.
+
+    Returns
+    -------
+    queue : WorkQueue
+
+    """
+
+    if split not in ('scenario', 'zones'):
+        raise ValueError('`split` must be "scenario" or "zones", not {}'.format(split))
+
+    if not os.path.exists(os.path.join(shared, OUTPUTS)):
+        os.makedirs(os.path.join(shared, OUTPUTS))
+
+    tbx = toolbox.StandardScenarios()
+    scenarios = tbx.make_scenarios(**params)
+    with utils.WorkSpace(params['workspace']), utils.OverwriteState(True):
+        topo_array, zones_array, template = tidegates.process_dem_and_zones(
+            dem=params['dem'],
+            zones=params['zones'],
+            ID_column=params['ID_column'],
+            cache=cache,
+        )
+        extent = None
+        if prefilter:
+            extent = tbx._prefilter_assets(topo_array, zones_array, template, scenarios,
+                                           filename=os.path.join(os.path.abspath(shared), EXTENT),
+                                           **params)
+
+    for name, array in zip(BUNDLE_ARRAYS, (topo_array, zones_array)):
+        numpy.save(os.path.join(shared, name + '.npy'), array)
+    numpy.savez(os.path.join(shared, BUNDLE), georef=template.georef, crs=template.crs or '')
+
+    # workers don't run in the workspace, so they need full paths
+    worker_params = {
+        'ID_column': params['ID_column'],
+        'flood_output': os.path.basename(params['flood_output']),
+        'wetlands': _absolute(params['workspace'], params.get('wetlands')),
+        'buildings': _absolute(params['workspace'], params.get('buildings')),
+        'prefilter_extent': extent,
+    }
+
+    if split == 'zones':
+        groups = zone_groups(zones_array, ngroups)
+    else:
+        groups = [(None, None)]
+
+    manifest = {
+        'params': params,
+        'worker_params': worker_params,
+        'split': split,
+        'created': time.time(),
+    }
+    with open(os.path.join(shared, MANIFEST), 'w') as mf:
+        json.dump(manifest, mf, indent=2)
+
+    queue = WorkQueue(shared)
+    num = 0
+    for scenario in scenarios:
+        for zone_ids, window in groups:
+            task = {
+                'name': 'task_{:06d}.json'.format(num),
+                'num': num,
+                'scenario': _jsonable(scenario),
+                'zones': zone_ids,
+                'window': window,
+            }
+            queue.put(task)
+            num += 1
+
+    return queue
+
+
+def _load_bundle(shared):
+    # read-only maps: workers on the same machine share the pages
+    topo_array, zones_array = (
+        utils.SharedArrays.attach(os.path.join(shared, name + '.npy'))
+        for name in BUNDLE_ARRAYS
+    )
+    with numpy.load(os.path.join(shared, BUNDLE)) as bundle:
+        template = utils.RasterTemplate.from_georef(bundle['georef'], crs=str(bundle['crs']),
+                                                    shape=zones_array.shape)
+    return topo_array, zones_array, template
+
+
+def run_task(task, arrays, worker_params, outputs):
+    """ Analyzes a single task.
+
+    Parameters
+    ----------
+    task : dict
+        The task descriptor.
+    arrays : tuple
+        The topo and zones arrays and their raster template.
+    worker_params : dict
+        The parameters of the run from the manifest.
+    outputs : str
+        Folder in which the partial outputs will be saved.
+
+    Returns
+    -------
+    paths : list
+        Paths to the task's floods, flooded wetlands, and flooded
+        buildings (or None).
+
+    """
+
+    topo_array, zones_array, template = arrays
+    if task['zones'] is not None:
+        topo_array, zones_array, template = _subset(
+            topo_array, zones_array, template, task['zones'], task['window']
+        )
+
+    params = dict((k, v) for k, v in worker_params.items() if v is not None)
+    tbx = toolbox.StandardScenarios()
+    # the worker deletes its own intermediates; the scenario's outputs
+    # are left for the coordinator to merge
+    with utils.AnalysisSession(outputs, scratch=False):
+        paths = tbx._analyze_scenario(topo_array, zones_array, template,
+                                      num=task['num'], scenario=task['scenario'],
+                                      **params)
+
+    return [_absolute(outputs, p) for p in paths]
+
+
+def work(shared, worker_id=None, max_tasks=None, poll=None, heartbeat=HEARTBEAT):
+    """ Claims and analyzes tasks until none are left.
+
+    Parameters
+    ----------
+    shared : str
+        Directory prepared by :func:`prepare`.
+    worker_id : str, optional
+        Identifies the worker in the task descriptors. Defaults to
+        "<hostname>-<pid>".
+    max_tasks : int, optional
+        Stop after analyzing this many tasks.
+    poll : float, optional
+        When provided, wait this many seconds for more tasks (instead
+        of stopping) while other workers still have claimed tasks.
+    heartbeat : float, optional
+        Seconds between the touches of the claimed task while it's
+        analyzed (see :meth:`WorkQueue.touch`).
+
+    Returns
+    -------
+    count : int
+        Number of tasks analyzed by this worker.
+
+    """
+
+    if worker_id is None:
+        worker_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+
+    with open(os.path.join(shared, MANIFEST), 'r') as mf:
+        manifest = json.load(mf)
+
+    queue = WorkQueue(shared)
+    outputs = os.path.join(shared, OUTPUTS)
+    arrays = None
+    count = 0
+    while max_tasks is None or count < max_tasks:
+        task = queue.claim(worker_id)
+        if task is None:
+            if poll is not None and queue.counts()['claimed'] > 0:
+                time.sleep(poll)
+                continue
+            break
+
+        # only load the bundle once there's something to do
+        if arrays is None:
+            arrays = _load_bundle(shared)
+
+        try:
+            with _Heartbeat(queue, task, interval=heartbeat):
+                result = run_task(task, arrays, manifest['worker_params'], outputs)
+        except Exception as e:
+            traceback.print_exc()
+            queue.fail(task, '{}: {}'.format(type(e).__name__, e))
+        else:
+            # when the task was requeued and claimed by another worker,
+            # that worker's result is recorded instead
+            queue.complete(task, result)
+        count += 1
+
+    # the extent is deleted once the run is merged
+    toolbox._release_candidates(manifest['worker_params'].get('prefilter_extent'))
+    return count
+
+
+def wait(shared, poll=5, requeue_after=None):
+    """ Blocks until no tasks are pending or claimed.
+
+    Parameters
+    ----------
+    shared : str
+        Directory prepared by :func:`prepare`.
+    poll : float, optional (5)
+        Seconds between checks of the queue.
+    requeue_after : float, optional
+        Return tasks whose claims haven't been touched for more than
+        this many seconds (e.g., when a worker dies) to the queue. It
+        must be longer than the workers' ``heartbeat``.
+
+    Returns
+    -------
+    counts : dict
+        The number of tasks in each state.
+
+    """
+
+    queue = WorkQueue(shared)
+    while True:
+        if requeue_after is not None:
+            queue.requeue(requeue_after)
+
+        counts = queue.counts()
+        if counts['pending'] == 0 and counts['claimed'] == 0:
+            return counts
+        time.sleep(poll)
+
+
+def merge(shared):
+    """ Merges (and then removes) the partial outputs of the finished
+    tasks into the final outputs of the run.
+
+    Parameters
+    ----------
+    shared : str
+        Directory prepared by :func:`prepare`.
+
+    Returns
+    -------
+    None
+
+    """
+
+    with open(os.path.join(shared, MANIFEST), 'r') as mf:
+        manifest = json.load(mf)
+
+    queue = WorkQueue(shared)
+    counts = queue.counts()
+    if counts['failed'] > 0:
+        errors = ['{}: {}'.format(t['name'], t['error']) for t in queue.failures()]
+        raise RuntimeError('{} tasks failed:\n{}'.format(counts['failed'], '\n'.join(errors)))
+    elif counts['pending'] > 0 or counts['claimed'] > 0:
+        raise RuntimeError('{pending} tasks are pending and {claimed} are claimed'.format(**counts))
+
+    results = [tuple(task['result']) for task in queue.results()]
+    params = manifest['params']
+    with utils.WorkSpace(params['workspace']), utils.OverwriteState(True):
+        toolbox.StandardScenarios().merge_results(results, **params)
+
+        extent = manifest['worker_params'].get('prefilter_extent')
+        if extent is not None:
+            utils.cleanup_temp_results(extent)
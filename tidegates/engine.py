@@ -0,0 +1,737 @@
+""" Batched flood-statistics engine for python-tidegates.
+
+:func:`tidegates.analysis.flood_area` answers one flood elevation at a
+time with a raster-to-polygon round trip through the geoprocessing
+backend. That is the right tool to make the output datasets, but far
+too slow to evaluate thousands of elevations (or thousands of
+perturbed DEMs). The :class:`ZoneIndex` in this module precomputes,
+once, everything that doesn't depend on the water level: the zone of
+each cell, the cells and building footprints of each zone, and the
+cells of the wetlands. Flooded areas and impacted assets for any
+number of water levels then cost a single binning pass over the cells.
+
+Statistics are cell-based, so the wetland areas and building counts
+are the raster approximations of the vector overlays done by
+:func:`tidegates.analysis.assess_impact`: a building is impacted by a
+flood when any of its cells in a zone is flooded.
+
+All elevations are in the units of the DEM (i.e., meters).
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import re
+from collections import OrderedDict
+
+import numpy
+
+
+# approximate number of float64 values held in memory per batch
+BATCH_VALUES = 2 ** 24
+
+
+def _as_levels(levels):
+    """ Sorts the water levels and returns them along with the
+    positions needed to restore the original order.
+
+    """
+
+    levels = numpy.asarray(levels, dtype=float).ravel()
+    order = numpy.argsort(levels, kind='mergesort')
+    return levels[order], numpy.argsort(order, kind='mergesort')
+
+
+def _flooded_counts(elevations, codes, ngroups, sorted_levels):
+    """ Counts the cells of each group flooded by each level.
+
+    Each cell is binned by the number of (sorted) levels that are
+    below it. A cell is flooded by level ``s`` when ``s`` is at or
+    above its bin, so the counts are the cumulative sums of a 2D
+    histogram of groups and bins.
+
+    Parameters
+    ----------
+    elevations : numpy.ndarray
+        Elevations of the cells, shaped ``(N,)`` or ``(B, N)`` for a
+        batch of ``B`` realizations of the same cells.
+    codes : numpy.ndarray
+        Group (e.g., zone) code, from 0 to ``ngroups - 1``, of each of
+        the ``N`` cells.
+    ngroups : int
+        Number of groups.
+    sorted_levels : numpy.ndarray
+        Water levels in ascending order.
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        Integer counts shaped ``(S, ngroups)`` (or ``(B, S, ngroups)``)
+        for the ``S`` levels.
+
+    """
+
+    nlevels = sorted_levels.shape[0]
+    elevations = numpy.atleast_2d(elevations)
+    nbatch = elevations.shape[0]
+
+    bins = numpy.searchsorted(sorted_levels, elevations, side='left')
+    keys = codes[None, :] * (nlevels + 1) + bins
+    keys += (numpy.arange(nbatch) * ngroups * (nlevels + 1))[:, None]
+
+    hist = numpy.bincount(keys.ravel(), minlength=nbatch * ngroups * (nlevels + 1))
+    hist = hist.reshape(nbatch, ngroups, nlevels + 1)
+    counts = hist.cumsum(axis=2)[:, :, :nlevels].transpose(0, 2, 1)
+    return counts if nbatch > 1 else counts[0]
+
+
+class ZoneIndex(object):
+    """ Level-independent precomputations for the flood statistics of
+    each zone of influence.
+
+    Parameters
+    ----------
+    topo_array, zones_array : numpy.ndarray
+        The DEM and zones of influence, as returned by
+        :func:`tidegates.analysis.process_dem_and_zones`. Zone IDs
+        less than or equal to 0 are outside of the zones. Like in
+        :func:`tidegates.utils.flood_zones`, cells of the zones with
+        missing elevations (NaN or -999) are always flooded.
+    cellsize : float, optional (1)
+        Width of the cells (e.g., ``template.meanCellWidth``). Areas
+        are returned in the squared units of ``cellsize``.
+    wetlands_array : numpy.ndarray of bool, optional
+        Cells that are wetlands.
+    buildings_array : numpy.ndarray of int, optional
+        ID of the building footprint in each cell (0 for no building).
+
+    Attributes
+    ----------
+    zone_ids : numpy.ndarray
+        The IDs of the zones, in the order of the columns of the
+        statistics.
+    elevations, codes, rows, cols : numpy.ndarray
+        The elevation, zone code (index in ``zone_ids``), and position
+        of each cell within the zones.
+
+    Examples
+    --------
+    >>> import tidegates
+    >>> from tidegates import engine
+    >>> topo, zones, template = tidegates.process_dem_and_zones(
+    ...     'dem.tif', 'zones.shp', 'GeoID')
+    >>> index = engine.ZoneIndex(topo, zones, template.meanCellWidth)
+    >>> stats = index.impacts([1.2, 2.4, 3.6])
+    >>> stats['area'].shape  # (levels, zones)
+    (3, 42)
+
+    """
+
+    def __init__(self, topo_array, zones_array, cellsize=1.0,
+                 wetlands_array=None, buildings_array=None):
+        topo_array = numpy.asarray(topo_array)
+        zones_array = numpy.asarray(zones_array)
+        if topo_array.shape != zones_array.shape:
+            raise ValueError('topo_array and zones_array must have the same shape')
+
+        self.shape = zones_array.shape
+        self.cellsize = cellsize
+        self.cell_area = float(cellsize) ** 2
+
+        rows, cols = numpy.nonzero(zones_array > 0)
+        self.rows = rows.astype(numpy.int32)
+        self.cols = cols.astype(numpy.int32)
+
+        self.zone_ids, codes = numpy.unique(zones_array[rows, cols], return_inverse=True)
+        self.codes = codes.astype(numpy.int32)
+
+        elevations = topo_array[rows, cols].astype(float)
+        elevations[numpy.isnan(elevations) | (elevations == -999)] = -numpy.inf
+        self.elevations = elevations
+
+        self.wetland_cells = None
+        if wetlands_array is not None:
+            self.wetland_cells = numpy.nonzero(numpy.asarray(wetlands_array)[rows, cols])[0]
+
+        self.building_cells = None
+        if buildings_array is not None:
+            bldg = numpy.asarray(buildings_array)[rows, cols]
+            cells = numpy.nonzero(bldg > 0)[0]
+
+            # a building is counted in each zone that it touches, so
+            # the units are (building, zone) pairs
+            keys = bldg[cells].astype(numpy.int64) * self.zone_ids.shape[0] + self.codes[cells]
+            order = numpy.argsort(keys, kind='mergesort')
+            pairs, starts = numpy.unique(keys[order], return_index=True)
+
+            self.building_cells = cells[order]
+            self.building_starts = starts
+            self.building_codes = (pairs % self.zone_ids.shape[0]).astype(numpy.int32)
+            self.building_ids = pairs // self.zone_ids.shape[0]
+
+    @property
+    def nzones(self):
+        return self.zone_ids.shape[0]
+
+    @property
+    def ncells(self):
+        return self.elevations.shape[0]
+
+    @property
+    def zone_minimums(self):
+        """ The lowest elevation of each zone (i.e., the level at which
+        it starts to flood).
+
+        """
+
+        if getattr(self, '_zone_minimums', None) is None:
+            order = numpy.argsort(self.codes, kind='mergesort')
+            starts = numpy.searchsorted(self.codes[order], numpy.arange(self.nzones))
+            self._zone_minimums = numpy.minimum.reduceat(self.elevations[order], starts)
+        return self._zone_minimums
+
+    def _building_elevations(self, elevations):
+        # lowest (i.e., first flooded) cell of each building in a zone
+        return numpy.minimum.reduceat(
+            elevations[..., self.building_cells],
+            self.building_starts,
+            axis=-1
+        )
+
+    def impacts(self, levels, offsets=None):
+        """ Flooded areas and impacted assets of each zone for a set of
+        water levels.
+
+        Parameters
+        ----------
+        levels : array-like of floats
+            The water levels (in the units of the DEM).
+        offsets : numpy.ndarray, optional
+            Perturbations added to :attr:`elevations`, shaped ``(N,)``
+            or ``(B, N)`` for a batch of ``B`` realizations of the DEM
+            (see :class:`CorrelatedNoise`).
+
+        Returns
+        -------
+        stats : OrderedDict of numpy.ndarray
+            Arrays shaped ``(levels, zones)`` (or ``(B, levels,
+            zones)``) of the flooded area ("area") and, when provided
+            to the index, the flooded area of wetlands ("wetlands") and
+            number of impacted buildings ("buildings").
+
+        """
+
+        sorted_levels, unsort = _as_levels(levels)
+
+        elevations = self.elevations
+        if offsets is not None:
+            elevations = elevations + offsets
+
+        stats = OrderedDict()
+        counts = _flooded_counts(elevations, self.codes, self.nzones, sorted_levels)
+        stats['area'] = counts[..., unsort, :] * self.cell_area
+
+        if self.wetland_cells is not None:
+            counts = _flooded_counts(
+                elevations[..., self.wetland_cells],
+                self.codes[self.wetland_cells],
+                self.nzones,
+                sorted_levels
+            )
+            stats['wetlands'] = counts[..., unsort, :] * self.cell_area
+
+        if self.building_cells is not None:
+            if self.building_cells.shape[0] > 0:
+                counts = _flooded_counts(
+                    self._building_elevations(elevations),
+                    self.building_codes,
+                    self.nzones,
+                    sorted_levels
+                )
+            else:
+                counts = numpy.zeros(elevations.shape[:-1] + (sorted_levels.shape[0], self.nzones), dtype=int)
+            stats['buildings'] = counts[..., unsort, :]
+
+        return stats
+
+
+class CorrelatedNoise(object):
+    """ Spatially correlated, zero-mean Gaussian perturbations of the
+    cells of a :class:`ZoneIndex`.
+
+    Independent standard normal values on a coarse lattice (one node
+    every ``correlation_length``) are interpolated bilinearly to the
+    cells. Bilinear interpolation shrinks the variance between the
+    nodes, so each cell is rescaled to have a standard deviation of
+    exactly ``sigma``. The lattice coordinates and weights only depend
+    on the cells, so they are computed once and each realization only
+    costs the random lattice and a weighted sum.
+
+    Parameters
+    ----------
+    index : ZoneIndex
+    sigma : float, optional (0.15)
+        Standard deviation of the vertical error (units of the DEM).
+    correlation_length : float, optional
+        Distance (units of ``index.cellsize``) between the lattice
+        nodes. Defaults to 10 cells. Use 0 for uncorrelated noise.
+    seed : int, optional (0)
+        Seed of the random number generator.
+
+    """
+
+    def __init__(self, index, sigma=0.15, correlation_length=None, seed=0):
+        self.sigma = sigma
+        self.ncells = index.ncells
+        self.random = numpy.random.RandomState(seed)
+
+        if correlation_length is None:
+            correlation_length = 10 * index.cellsize
+
+        spacing = float(correlation_length) / index.cellsize
+        if spacing <= 1:
+            self.nodes = None
+            return
+
+        y = index.rows / spacing
+        x = index.cols / spacing
+        y0 = numpy.floor(y).astype(numpy.int64)
+        x0 = numpy.floor(x).astype(numpy.int64)
+        fy = y - y0
+        fx = x - x0
+
+        self.lattice_shape = (int(index.shape[0] / spacing) + 2, int(index.shape[1] / spacing) + 2)
+        ncols = self.lattice_shape[1]
+        self.nodes = numpy.vstack([
+            y0 * ncols + x0,
+            y0 * ncols + x0 + 1,
+            (y0 + 1) * ncols + x0,
+            (y0 + 1) * ncols + x0 + 1,
+        ])
+        weights = numpy.vstack([
+            (1 - fy) * (1 - fx),
+            (1 - fy) * fx,
+            fy * (1 - fx),
+            fy * fx,
+        ])
+        self.weights = weights * (sigma / numpy.sqrt((weights ** 2).sum(axis=0)))
+
+    def sample(self, size):
+        """ Draws ``size`` realizations of the noise.
+
+        Returns
+        -------
+        noise : numpy.ndarray
+            Array shaped ``(size, N)`` for the ``N`` cells of the index.
+
+        """
+
+        if self.nodes is None:
+            return self.random.normal(0, self.sigma, size=(size, self.ncells))
+
+        nnodes = self.lattice_shape[0] * self.lattice_shape[1]
+        lattice = self.random.standard_normal((size, nnodes))
+        noise = numpy.zeros((size, self.ncells))
+        for nodes, weights in zip(self.nodes, self.weights):
+            noise += lattice[:, nodes] * weights
+        return noise
+
+
+class EnsembleResult(object):
+    """ Per-realization summaries of a Monte Carlo ensemble.
+
+    Attributes
+    ----------
+    levels : numpy.ndarray
+        The water levels of the ensemble.
+    zone_ids : numpy.ndarray
+        The IDs of the zones.
+    summaries : OrderedDict of numpy.ndarray
+        For each statistic (see :meth:`ZoneIndex.impacts`), an array
+        shaped ``(realizations, levels, zones)``.
+
+    """
+
+    def __init__(self, levels, zone_ids, summaries):
+        self.levels = levels
+        self.zone_ids = zone_ids
+        self.summaries = summaries
+
+    @property
+    def realizations(self):
+        return next(iter(self.summaries.values())).shape[0]
+
+    def percentiles(self, q=(5, 50, 95)):
+        """ Percentiles of the statistics of each zone and level.
+
+        Returns
+        -------
+        bands : OrderedDict of numpy.ndarray
+            Arrays shaped ``(len(q), levels, zones)``.
+
+        """
+
+        return OrderedDict(
+            (name, numpy.percentile(values, q, axis=0))
+            for name, values in self.summaries.items()
+        )
+
+    def totals(self, q=(5, 50, 95)):
+        """ Percentiles of the statistics summed over all of the zones.
+
+        Returns
+        -------
+        bands : OrderedDict of numpy.ndarray
+            Arrays shaped ``(len(q), levels)``.
+
+        """
+
+        return OrderedDict(
+            (name, numpy.percentile(values.sum(axis=2), q, axis=0))
+            for name, values in self.summaries.items()
+        )
+
+
+def ensemble(index, levels, realizations=100, sigma=0.15,
+             correlation_length=None, batch_size=None, seed=0,
+             callback=None):
+    """ Monte Carlo ensemble of the flood statistics under DEM vertical
+    uncertainty.
+
+    The elevations of the cells are perturbed with
+    :class:`CorrelatedNoise` and the statistics of all of the
+    ``levels`` are computed for each realization. Realizations are
+    processed in batches and only their summaries (not the perturbed
+    DEMs) are kept.
+
+    Parameters
+    ----------
+    index : ZoneIndex
+    levels : array-like of floats
+        Water levels (units of the DEM) of the scenarios.
+    realizations : int, optional (100)
+        Number of perturbed DEMs.
+    sigma, correlation_length, seed
+        See :class:`CorrelatedNoise`.
+    batch_size : int, optional
+        Realizations per batch. Defaults to the number that keeps
+        roughly :data:`BATCH_VALUES` values in memory.
+    callback : callable, optional
+        Called with the partial :class:`EnsembleResult` after each
+        batch (e.g., to report the percentiles as they converge).
+
+    Returns
+    -------
+    result : EnsembleResult
+
+    Examples
+    --------
+    >>> levels = numpy.array([4.0, 8.0, 9.6, 10.5]) * 0.3048
+    >>> result = engine.ensemble(index, levels, realizations=500)
+    >>> low, median, high = result.totals()['buildings']
+
+    """
+
+    levels = numpy.asarray(levels, dtype=float).ravel()
+    noise = CorrelatedNoise(index, sigma=sigma, correlation_length=correlation_length, seed=seed)
+
+    if batch_size is None:
+        batch_size = max(1, BATCH_VALUES // max(index.ncells, 1))
+
+    summaries = OrderedDict()
+    done = 0
+    while done < realizations:
+        size = min(batch_size, realizations - done)
+        stats = index.impacts(levels, offsets=noise.sample(size))
+        for name, values in stats.items():
+            if name not in summaries:
+                summaries[name] = numpy.empty((realizations, levels.shape[0], index.nzones), dtype=numpy.float32)
+            summaries[name][done:done + size] = values.reshape(size, levels.shape[0], index.nzones)
+        done += size
+
+        if callback is not None:
+            partial = OrderedDict((name, values[:done]) for name, values in summaries.items())
+            callback(EnsembleResult(levels, index.zone_ids, partial))
+
+    return EnsembleResult(levels, index.zone_ids, summaries)
+
+
+class TimeSeriesResult(object):
+    """ Flooding statistics of each zone over a water-level record.
+
+    Attributes
+    ----------
+    zone_ids : numpy.ndarray
+        The IDs of the zones.
+    hours_flooded : numpy.ndarray
+        Time during which any part of each zone was flooded.
+    events : numpy.ndarray
+        Number of times each zone started to flood (i.e., the
+        water-level rose to its lowest cell). A record that starts
+        (or resumes after missing readings) above that cell counts as
+        an event.
+    mean : OrderedDict of numpy.ndarray
+        Time-averaged statistics (see :meth:`ZoneIndex.impacts`) of
+        each zone, e.g., the average flooded area.
+    exceedance : numpy.ndarray
+        Fractions of the time of the exceedance statistics.
+    exceedance_levels : numpy.ndarray
+        Water levels exceeded that fraction of the time.
+    exceeded : OrderedDict of numpy.ndarray
+        Statistics of each zone at the exceedance levels, shaped
+        ``(exceedance, zones)``. Since the statistics never decrease
+        as the water rises, these values are also exceeded that
+        fraction of the time.
+
+    """
+
+    def __init__(self, zone_ids, hours_flooded, events, mean,
+                 exceedance, exceedance_levels, exceeded):
+        self.zone_ids = zone_ids
+        self.hours_flooded = hours_flooded
+        self.events = events
+        self.mean = mean
+        self.exceedance = exceedance
+        self.exceedance_levels = exceedance_levels
+        self.exceeded = exceeded
+
+
+def _exceedance_fraction(sorted_levels, elevations):
+    # fraction of the levels at or above each elevation
+    below = numpy.searchsorted(sorted_levels, elevations, side='left')
+    return 1 - below / float(sorted_levels.shape[0])
+
+
+def time_series(index, levels, timestep=1.0,
+                exceedance=(0.5, 0.1, 0.01, 0.001)):
+    """ Flooded duration, frequency, and exceedance statistics of each
+    zone over a (long) record of water levels.
+
+    Nothing here loops over the record: every statistic is a lookup of
+    the cells' (or zones') elevations against the sorted water levels,
+    so decades of hourly readings take about as long as sorting them.
+
+    Parameters
+    ----------
+    index : ZoneIndex
+    levels : array-like of floats
+        The water-level record (units of the DEM), in chronological
+        order at a constant interval. Missing readings are NaN.
+    timestep : float, optional (1.0)
+        Time between readings, in hours.
+    exceedance : sequence of floats, optional
+        Fractions of the time for the exceedance statistics.
+
+    Returns
+    -------
+    result : TimeSeriesResult
+
+    Examples
+    --------
+    >>> gauge = numpy.loadtxt('gauge.csv', delimiter=',', usecols=(1,))
+    >>> result = engine.time_series(index, gauge * 0.3048)
+    >>> result.hours_flooded / 24.  # days flooded in each zone
+
+    """
+
+    levels = numpy.asarray(levels, dtype=float).ravel()
+    valid = ~numpy.isnan(levels)
+    sorted_levels = numpy.sort(levels[valid])
+    if sorted_levels.shape[0] == 0:
+        raise ValueError('the record has no valid water levels')
+
+    thresholds = index.zone_minimums
+    below = numpy.searchsorted(sorted_levels, thresholds, side='left')
+    hours_flooded = (sorted_levels.shape[0] - below) * float(timestep)
+
+    # A zone starts to flood whenever the water crosses its threshold
+    # on the way up, i.e., when the threshold is in (previous, current]
+    # for a rising pair of readings. The pairs containing a threshold
+    # are those that start below it minus those that end below it.
+    previous, current = levels[:-1], levels[1:]
+    with numpy.errstate(invalid='ignore'):
+        rising = valid[:-1] & valid[1:] & (current > previous)
+    starts = numpy.sort(numpy.hstack([
+        levels[:1][valid[:1]],
+        current[valid[1:] & ~valid[:-1]],
+    ]))
+    events = (
+        numpy.searchsorted(numpy.sort(previous[rising]), thresholds, side='left') -
+        numpy.searchsorted(numpy.sort(current[rising]), thresholds, side='left') +
+        starts.shape[0] - numpy.searchsorted(starts, thresholds, side='left')
+    )
+
+    mean = OrderedDict()
+    fraction = _exceedance_fraction(sorted_levels, index.elevations)
+    mean['area'] = numpy.bincount(index.codes, fraction, minlength=index.nzones) * index.cell_area
+    if index.wetland_cells is not None:
+        mean['wetlands'] = numpy.bincount(
+            index.codes[index.wetland_cells],
+            fraction[index.wetland_cells],
+            minlength=index.nzones
+        ) * index.cell_area
+    if index.building_cells is not None:
+        if index.building_cells.shape[0] > 0:
+            fraction = _exceedance_fraction(sorted_levels, index._building_elevations(index.elevations))
+            mean['buildings'] = numpy.bincount(index.building_codes, fraction, minlength=index.nzones)
+        else:
+            mean['buildings'] = numpy.zeros(index.nzones)
+
+    exceedance = numpy.asarray(exceedance, dtype=float)
+    exceedance_levels = numpy.percentile(sorted_levels, 100 * (1 - exceedance))
+    exceeded = index.impacts(exceedance_levels)
+
+    return TimeSeriesResult(index.zone_ids, hours_flooded, events, mean,
+                            exceedance, exceedance_levels, exceeded)
+
+
+def standard_events():
+    """ The return-period events and sea level rise of the standard
+    scenarios (:data:`tidegates.toolbox.SURGES` and
+    :data:`tidegates.toolbox.SEALEVELRISE`), converted to meters.
+
+    Returns
+    -------
+    events : OrderedDict
+        Surge elevation keyed by return period (in years). Surges that
+        aren't return-period events (e.g., MHHW) are left out.
+    sea_level_rise : numpy.ndarray
+
+    """
+
+    from tidegates import toolbox
+    from tidegates.analysis import METERS_PER_FOOT
+
+    events = OrderedDict()
+    for name, elevation in toolbox.SURGES.items():
+        match = re.match(r'^(\d+(?:\.\d+)?)yr$', name)
+        if match:
+            events[float(match.group(1))] = elevation * METERS_PER_FOOT
+
+    return events, numpy.asarray(toolbox.SEALEVELRISE, dtype=float) * METERS_PER_FOOT
+
+
+class EADResult(object):
+    """ Expected annual damages of each zone.
+
+    Attributes
+    ----------
+    zone_ids : numpy.ndarray
+        The IDs of the zones.
+    sea_level_rise : numpy.ndarray
+        The sea level rise of each row of the results.
+    probabilities : numpy.ndarray
+        Annual exceedance probabilities of the integration grid, in
+        ascending order.
+    levels : numpy.ndarray
+        Water level at each probability for each sea level rise,
+        shaped ``(sea_level_rise, probabilities)``.
+    curves : OrderedDict of numpy.ndarray
+        Statistics (see :meth:`ZoneIndex.impacts`) along the grid,
+        shaped ``(sea_level_rise, probabilities, zones)``.
+    ead : OrderedDict of numpy.ndarray
+        Expected annual values of the statistics (e.g., flooded area
+        per year), shaped ``(sea_level_rise, zones)``.
+
+    """
+
+    def __init__(self, zone_ids, sea_level_rise, probabilities, levels, curves, ead):
+        self.zone_ids = zone_ids
+        self.sea_level_rise = sea_level_rise
+        self.probabilities = probabilities
+        self.levels = levels
+        self.curves = curves
+        self.ead = ead
+
+    def totals(self):
+        """ Expected annual values summed over all of the zones, shaped
+        ``(sea_level_rise,)``.
+
+        """
+
+        return OrderedDict((name, values.sum(axis=-1)) for name, values in self.ead.items())
+
+
+def expected_annual_damage(index, events=None, sea_level_rise=None,
+                           points=50, tail=True):
+    """ Integrates the flood statistics of each zone over the annual
+    exceedance probability of the surges.
+
+    Water levels between the return-period events are interpolated
+    linearly in the logarithm of the return period, and the statistics
+    of the whole grid (for every sea level rise) are computed in a
+    single pass of the :class:`ZoneIndex`.
+
+    Parameters
+    ----------
+    index : ZoneIndex
+    events : mapping, optional
+        Surge elevation (units of the DEM) keyed by return period in
+        years. At least two events are required. Defaults to the
+        events of :func:`standard_events`.
+    sea_level_rise : array-like of floats, optional
+        Added to the surge elevations. Defaults to the values of
+        :func:`standard_events` if ``events`` is also omitted, else 0.
+    points : int, optional (50)
+        Number of grid points between consecutive events.
+    tail : bool, optional (True)
+        When True, events rarer than the rarest event are assumed to do
+        as much damage as the rarest event. Events more frequent than
+        the most frequent event are always assumed to do no damage.
+
+    Returns
+    -------
+    result : EADResult
+
+    Examples
+    --------
+    >>> result = engine.expected_annual_damage(index)
+    >>> result.totals()['buildings']  # buildings flooded per year
+
+    """
+
+    if events is None:
+        events, default_slr = standard_events()
+        if sea_level_rise is None:
+            sea_level_rise = default_slr
+
+    if sea_level_rise is None:
+        sea_level_rise = [0.0]
+
+    periods = numpy.array(sorted(events), dtype=float)
+    if periods.shape[0] < 2:
+        raise ValueError('at least two return-period events are required')
+    elevations = numpy.array([events[p] for p in periods], dtype=float)
+
+    log_periods = numpy.log(periods)
+    grid = numpy.hstack([
+        numpy.linspace(log_periods[n], log_periods[n + 1], points, endpoint=False)
+        for n in range(periods.shape[0] - 1)
+    ] + [log_periods[-1:]])
+    surges = numpy.interp(grid, log_periods, elevations)
+
+    # ascending probabilities, i.e., rarest event first
+    probabilities = numpy.exp(-grid)[::-1]
+    surges = surges[::-1]
+
+    sea_level_rise = numpy.asarray(sea_level_rise, dtype=float).ravel()
+    levels = sea_level_rise[:, None] + surges[None, :]
+
+    stats = index.impacts(levels.ravel())
+    curves = OrderedDict()
+    ead = OrderedDict()
+    widths = numpy.diff(probabilities)[None, :, None]
+    for name, values in stats.items():
+        curve = values.reshape(levels.shape + (index.nzones,)).astype(float)
+        total = (0.5 * (curve[:, 1:] + curve[:, :-1]) * widths).sum(axis=1)
+        if tail:
+            total += curve[:, 0] * probabilities[0]
+        curves[name] = curve
+        ead[name] = total
+
+    return EADResult(index.zone_ids, sea_level_rise, probabilities, levels, curves, ead)
@@ -0,0 +1,197 @@
+""" Staged, multi-threaded execution for python-tidegates.
+
+Each scenario of a run goes through the same sequence of steps:
+flooding the zones (numpy, CPU-bound), writing the flooded raster
+(disk-bound), converting it to polygons and writing attributes, and
+intersecting the floods with the assets (geoprocessing). Run strictly
+in sequence, the CPU idles while the disk works and vice versa.
+
+A :class:`Pipeline` runs each :class:`Stage` in its own worker
+thread(s), connected by bounded queues, so different stages of
+different scenarios are in flight at the same time (e.g., scenario
+*N + 1* is being flooded while the raster of scenario *N* is being
+written). The bounded queues provide backpressure: a fast stage can
+never get more than ``maxsize`` items ahead of the next one, which
+keeps the memory held by in-flight arrays bounded. The stages run in
+the :class:`tidegates.backends.ExecutionContext` (if any) and the
+:class:`tidegates.utils.AnalysisSession` (temporary namespace,
+registry, and cache) of the thread that calls :meth:`Pipeline.run`.
+
+Geoprocessing tools and ``arcpy.env`` are not thread-safe, so all of
+the steps that use them belong in a single stage with one worker.
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import threading
+
+try:
+    import Queue as queue
+except ImportError: # pragma: no cover
+    import queue
+
+from . import profiling
+from . import backends
+from . import utils
+
+
+# marks the end of the items on a queue
+_DONE = object()
+
+
+class Stage(object):
+    """ A step of a :class:`Pipeline`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage (used to name its threads and profiling
+        spans).
+    func : callable
+        Called with each item, returns the item passed to the next
+        stage.
+    workers : int, optional (1)
+        Number of threads running the stage. Items may finish the
+        stage out of order when there are several workers.
+
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = int(workers)
+
+
+class _Failure(object):
+    """ Stands in for an item whose processing raised an error. """
+
+    def __init__(self, stage, error):
+        self.stage = stage
+        self.error = error
+
+
+class Pipeline(object):
+    """ Runs items through a sequence of stages, each in its own
+    thread(s), connected by bounded queues.
+
+    Parameters
+    ----------
+    stages : list of Stage
+    maxsize : int, optional (1)
+        Maximum number of items waiting between two stages.
+
+    Examples
+    --------
+    >>> from tidegates.pipeline import Pipeline, Stage
+    >>> pipe = Pipeline([
+    ...     Stage('flood', lambda elev: utils.flood_zones(zones, topo, elev)),
+    ...     Stage('write', lambda array: utils.array_to_raster(array, template)),
+    ... ])
+    >>> rasters = pipe.run([1.2, 2.4, 3.6])
+
+    """
+
+    def __init__(self, stages, maxsize=1):
+        self.stages = list(stages)
+        self.maxsize = maxsize
+        self._failed = threading.Event()
+
+    def _work(self, stage, inbox, outbox, remaining, lock, nextworkers, context, state):
+        with backends.activate(context), utils._inherit(state):
+            self._process(stage, inbox, outbox, remaining, lock, nextworkers)
+
+    def _process(self, stage, inbox, outbox, remaining, lock, nextworkers):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    for _ in range(nextworkers):
+                        outbox.put(_DONE)
+                return
+
+            index, value = item
+            if not isinstance(value, _Failure):
+                try:
+                    with profiling.span(stage.name, category='pipeline', item=index):
+                        value = stage.func(value)
+                except Exception as e:
+                    self._failed.set()
+                    value = _Failure(stage.name, e)
+            outbox.put((index, value))
+
+    def run(self, items):
+        """ Runs the items through all of the stages.
+
+        Once any item fails, no new items are started, and the items
+        already in flight are finished.
+
+        Parameters
+        ----------
+        items : iterable
+
+        Returns
+        -------
+        results : list
+            The output of the last stage for each item, in the order of
+            ``items``.
+
+        Raises
+        ------
+        Exception
+            The error raised by the first item (in the order of
+            ``items``) that failed.
+
+        """
+
+        self._failed.clear()
+        queues = [queue.Queue(maxsize=self.maxsize) for _ in self.stages]
+        queues.append(queue.Queue())
+
+        context = backends.current_context()
+        state = utils._thread_state()
+        threads = []
+        for n, stage in enumerate(self.stages):
+            nextworkers = self.stages[n + 1].workers if n + 1 < len(self.stages) else 1
+            args = (stage, queues[n], queues[n + 1], [stage.workers], threading.Lock(),
+                    nextworkers, context, state)
+            for w in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=args,
+                                          name='{}-{}'.format(stage.name, w))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for index, item in enumerate(items):
+                if self._failed.is_set():
+                    break
+                queues[0].put((index, item))
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+
+        finished = {}
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            index, value = item
+            finished[index] = value
+
+        for thread in threads:
+            thread.join()
+
+        results = [finished[index] for index in sorted(finished)]
+        for value in results:
+            if isinstance(value, _Failure):
+                raise value.error
+        return results
@@ -0,0 +1,319 @@
+""" Span profiling for python-tidegates.
+
+This contains a small, dependency-free profiler that records nested,
+timed spans around the functions in :mod:`tidegates.analysis`,
+:mod:`tidegates.utils`, and :mod:`tidegates.toolbox`. The spans are
+written as Chrome trace events (JSON) so that a full run (e.g., all
+of the standard scenarios) can be opened in ``chrome://tracing`` or
+Perfetto to look for serialization gaps, I/O stalls, and idle
+workers.
+
+Profiling is off by default and costs a single list lookup per call
+when disabled. It can be switched on in two ways:
+
+  1. Set the ``TIDEGATES_TRACE`` environment variable to the path of
+     the JSON file that should be written when the interpreter exits.
+     A ``{pid}`` placeholder in the path is replaced with the process
+     ID so that worker processes don't clobber each other's traces.
+  2. Wrap the code in a :class:`Tracer` context manager.
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+
+TRACE_ENV_VAR = 'TIDEGATES_TRACE'
+
+# stack of the tracers that are currently recording. This is a plain
+# list (not thread-local) so that spans from worker threads are
+# recorded by the tracer that the main thread started.
+_active_tracers = []
+
+
+def _describe(value):
+    """ Compact, JSON-friendly description of a function argument.
+    Arrays are summarized by their shape and dtype, long sequences by
+    their length, and everything else by its type name.
+
+    """
+
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+
+    if isinstance(value, (type(b''), type(u''))):
+        return value if len(value) <= 256 else value[:253] + '...'
+
+    shape = getattr(value, 'shape', None)
+    dtype = getattr(value, 'dtype', None)
+    if shape == () and hasattr(value, 'item'):
+        return value.item()
+    elif shape is not None and dtype is not None:
+        return 'array<{} {}>'.format('x'.join(map(str, shape)), dtype)
+
+    if isinstance(value, (list, tuple)):
+        return '{}[{}]'.format(type(value).__name__, len(value))
+
+    if isinstance(value, dict):
+        return 'dict[{}]'.format(len(value))
+
+    return type(value).__name__
+
+
+def _describe_call(func, args, kwargs):
+    """ Maps the arguments of a call to their names and describes
+    each of them with :func:`_describe`.
+
+    """
+
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        names = code.co_varnames[:code.co_argcount]
+    else: # pragma: no cover
+        names = ()
+
+    described = {}
+    for n, value in enumerate(args):
+        name = names[n] if n < len(names) else 'arg{}'.format(n)
+        if name not in ('self', 'cls'):
+            described[name] = _describe(value)
+
+    for name, value in kwargs.items():
+        described[name] = _describe(value)
+
+    return described
+
+
+class Tracer(object):
+    """ Records spans as Chrome trace events.
+
+    Parameters
+    ----------
+    filename : str, optional
+        Path to the JSON file to which the trace will be written when
+        the context manager exits. A ``{pid}`` placeholder will be
+        replaced by the process ID. If not provided, the events are
+        only kept in memory (see :attr:`events`).
+
+    Attributes
+    ----------
+    events : list of dict
+        The recorded complete events (``"ph": "X"``) with start
+        times and durations in microseconds.
+
+    Examples
+    --------
+    >>> from tidegates import profiling, toolbox
+    >>> tbx = toolbox.StandardScenarios()
+    >>> with profiling.Tracer('std_scenarios_trace.json'):
+    ...     tbx.main_execute(**params)
+
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.events = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        start(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        stop(self)
+        if self.filename is not None:
+            self.save()
+
+    def record(self, name, category, begin, end, args=None):
+        """ Adds a complete span to the trace.
+
+        Parameters
+        ----------
+        name, category : str
+            The name and category ("cat") of the span.
+        begin, end : float
+            Start and end times of the span as seconds since the epoch
+            (i.e., from ``time.time()``).
+        args : dict, optional
+            Additional information about the span.
+
+        """
+
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(begin * 1e6),
+            'dur': int(max(end - begin, 0) * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': args or {},
+        }
+
+        with self._lock:
+            self.events.append(event)
+
+    def save(self, filename=None):
+        """ Writes the trace to disk in the Chrome trace event (JSON)
+        format.
+
+        Parameters
+        ----------
+        filename : str, optional
+            Overrides the filename given to the constructor.
+
+        Returns
+        -------
+        filename : str
+            The path to the saved trace.
+
+        """
+
+        filename = (filename or self.filename).replace('{pid}', str(os.getpid()))
+
+        with self._lock:
+            events = list(self.events)
+
+        thread_names = {}
+        for thread in threading.enumerate():
+            thread_names[thread.ident] = thread.name
+
+        metadata = [
+            {
+                'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                'tid': tid, 'args': {'name': thread_names[tid]},
+            }
+            for tid in sorted(set(e['tid'] for e in events))
+            if tid in thread_names
+        ]
+
+        with open(filename, 'w') as tracefile:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, tracefile)
+
+        return filename
+
+
+def start(tracer=None):
+    """ Starts recording spans.
+
+    Parameters
+    ----------
+    tracer : Tracer, optional
+        The tracer that will receive the spans. If not provided, a new,
+        in-memory tracer is created.
+
+    Returns
+    -------
+    tracer : Tracer
+
+    """
+
+    if tracer is None:
+        tracer = Tracer()
+    _active_tracers.append(tracer)
+    return tracer
+
+
+def stop(tracer=None):
+    """ Stops recording spans to ``tracer`` (the most recently started
+    tracer by default).
+
+    """
+
+    if tracer is None:
+        tracer = _active_tracers[-1]
+    if tracer in _active_tracers:
+        _active_tracers.remove(tracer)
+    return tracer
+
+
+def is_active():
+    """ True when at least one tracer is recording spans. """
+    return len(_active_tracers) > 0
+
+
+@contextmanager
+def span(name, category='tidegates', **args):
+    """ Context manager that records a single, named span with all of
+    the active tracers.
+
+    Examples
+    --------
+    >>> from tidegates import profiling
+    >>> with profiling.span('merge results', scenarios=28):
+    ...     # do things
+
+    """
+
+    with _record_span(name, category, args):
+        yield
+
+
+@contextmanager
+def _record_span(name, category, args):
+    if not _active_tracers:
+        yield
+        return
+
+    begin = time.time()
+    try:
+        yield
+    finally:
+        end = time.time()
+        for tracer in list(_active_tracers):
+            tracer.record(name, category, begin, end, args)
+
+
+def traced(name=None, category=None):
+    """ Decorator that records each call to the function as a span.
+
+    The span's arguments include the function's arguments, with arrays
+    reduced to their shapes and dtypes. When no tracer is active, the
+    function is called directly.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the span. Defaults to the function's name.
+    category : str, optional
+        Category of the span. Defaults to the last part of the name of
+        the function's module (e.g., "utils").
+
+    """
+
+    def decorate(func):
+        spanname = name or func.__name__
+        spancat = category or func.__module__.split('.')[-1]
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active_tracers:
+                return func(*args, **kwargs)
+
+            with _record_span(spanname, spancat, _describe_call(func, args, kwargs)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _start_from_environment():
+    filename = os.environ.get(TRACE_ENV_VAR)
+    if filename:
+        tracer = start(Tracer(filename))
+        atexit.register(tracer.save)
+        return tracer
+
+
+_start_from_environment()
@@ -0,0 +1,493 @@
+""" Synthetic study areas for large-scale testing of python-tidegates.
+
+The fixtures under ``tidegates/testing`` are tiny, hand-made datasets.
+This module generates realistic-looking input data of any size so that
+scaling problems can be reproduced without sharing client data:
+
+  - a coastal DEM (in meters) made from a slope rising inland from the
+    coast plus fractal (multi-octave value) noise;
+  - Voronoi-style zones of influence behind the coast, numbered from 1
+    (the ``GeoID`` column when saved to disk);
+  - low-lying wetlands; and
+  - rectangular building footprints (the ``STRUCT_ID`` column when
+    saved to disk).
+
+Everything is deterministic given the ``seed`` and is computed in
+blocks of rows, so that very large rasters never need more than a few
+full-size arrays in memory. The data can be saved to a ``.npz`` file
+with numpy or written to a workspace as a GeoTIFF and shapefiles with
+the functions in :mod:`tidegates.utils`.
+
+(c) Geosyntec Consultants, 2015.
+
+Released under the BSD 3-clause license (see LICENSE file for more info)
+
+Written by Paul Hobson (phobson@geosyntec.com)
+
+"""
+
+
+import os
+
+import numpy
+
+
+CHUNK_ROWS = 256
+
+
+def _rows_in_chunks(nrows, chunk_rows=CHUNK_ROWS):
+    for start in range(0, nrows, chunk_rows):
+        yield numpy.arange(start, min(start + chunk_rows, nrows))
+
+
+def _interpolate_lattice(lattice, y, x):
+    """ Smoothly interpolates a lattice of random values at the
+    (fractional) lattice coordinates ``y`` (rows) and ``x`` (columns).
+
+    """
+
+    y0 = numpy.floor(y).astype(int)
+    x0 = numpy.floor(x).astype(int)
+    fy = y - y0
+    fx = x - x0
+
+    # smoothstep to avoid visible lattice artifacts
+    fy = (fy * fy * (3 - 2 * fy))[:, None]
+    fx = (fx * fx * (3 - 2 * fx))[None, :]
+
+    r0, r1 = y0[:, None], y0[:, None] + 1
+    c0, c1 = x0[None, :], x0[None, :] + 1
+    top = lattice[r0, c0] * (1 - fx) + lattice[r0, c1] * fx
+    bottom = lattice[r1, c0] * (1 - fx) + lattice[r1, c1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def fractal_noise(nrows, ncols, seed=0, octaves=6, persistence=0.5,
+                  scale=None, dtype=numpy.float32, out=None):
+    """ Multi-octave (fractal) value noise with zero mean and roughly
+    unit variance.
+
+    Parameters
+    ----------
+    nrows, ncols : int
+        Shape of the output array.
+    seed : int, optional (0)
+        Seed of the random number generator.
+    octaves : int, optional (6)
+        Number of layers of noise. Each octave has half of the feature
+        size of the previous one.
+    persistence : float, optional (0.5)
+        Ratio of the amplitudes of successive octaves. Larger values
+        make rougher surfaces.
+    scale : float, optional
+        Feature size, in cells, of the first octave. Defaults to a
+        quarter of the largest dimension of the array.
+    dtype : numpy dtype, optional (float32)
+    out : numpy.ndarray, optional
+        Pre-allocated (e.g., memory-mapped) array that will be filled
+        with the noise.
+
+    Returns
+    -------
+    noise : numpy.ndarray
+
+    """
+
+    random = numpy.random.RandomState(seed)
+    if scale is None:
+        scale = max(nrows, ncols) / 4.0
+
+    layers = []
+    for octave in range(octaves):
+        spacing = max(scale / 2.0 ** octave, 1.0)
+        shape = (int(nrows / spacing) + 2, int(ncols / spacing) + 2)
+        layers.append((spacing, persistence ** octave, random.standard_normal(shape)))
+
+    norm = numpy.sqrt(sum(amplitude ** 2 for _, amplitude, _ in layers))
+
+    if out is None:
+        out = numpy.empty((nrows, ncols), dtype=dtype)
+
+    cols = numpy.arange(ncols, dtype=float)
+    for rows in _rows_in_chunks(nrows):
+        block = numpy.zeros((rows.shape[0], ncols))
+        for spacing, amplitude, lattice in layers:
+            block += amplitude * _interpolate_lattice(lattice, rows / spacing, cols / spacing)
+        out[rows[0]:rows[-1] + 1] = block / norm
+
+    return out
+
+
+def coastal_dem(nrows, ncols=None, seed=0, min_elevation=-1.0,
+                max_elevation=10.0, relief=1.0, dtype=numpy.float32):
+    """ Synthetic coastal digital elevation model.
+
+    The coast is along the first row of the array (the north edge).
+    Elevations rise linearly inland from ``min_elevation`` to
+    ``max_elevation`` with fractal noise added on top.
+
+    Parameters
+    ----------
+    nrows, ncols : int
+        Shape of the DEM. ``ncols`` defaults to ``nrows``.
+    seed : int, optional (0)
+        Seed of the random number generator.
+    min_elevation, max_elevation : float, optional (-1 and 10)
+        Elevations (meters) of the trend at the coast and at the inland
+        edge of the DEM.
+    relief : float, optional (1.0)
+        Standard deviation (meters) of the noise.
+    dtype : numpy dtype, optional (float32)
+
+    Returns
+    -------
+    dem : numpy.ndarray
+
+    """
+
+    ncols = nrows if ncols is None else ncols
+    dem = fractal_noise(nrows, ncols, seed=seed, dtype=dtype)
+    trend = numpy.linspace(min_elevation, max_elevation, nrows)
+    for rows in _rows_in_chunks(nrows):
+        block = dem[rows[0]:rows[-1] + 1]
+        block *= relief
+        block += trend[rows, None].astype(dtype)
+
+    return dem
+
+
+def zones_of_influence(nrows, ncols=None, nzones=10, seed=0,
+                       coastal_fraction=0.6, dtype=numpy.int32):
+    """ Synthetic Voronoi-style zones of influence.
+
+    The zones cover the band of rows nearest to the coast (the first
+    rows of the array). Each zone is the set of cells closest to a
+    randomly jittered point on a regular grid, which gives irregular but
+    compact zones. The nearest point is searched only among the 3 x 3
+    neighboring grid tiles, so the cost per cell does not depend on the
+    number of zones.
+
+    Parameters
+    ----------
+    nrows, ncols : int
+        Shape of the array. ``ncols`` defaults to ``nrows``.
+    nzones : int, optional (10)
+        Number of zones of influence.
+    seed : int, optional (0)
+        Seed of the random number generator.
+    coastal_fraction : float, optional (0.6)
+        Fraction of the rows covered by the zones.
+    dtype : numpy dtype, optional (int32)
+
+    Returns
+    -------
+    zones : numpy.ndarray
+        Zone IDs from 1 to ``nzones``. Cells outside of the zones are 0.
+
+    .. note ::
+       When there are more zones than there are cells in the coastal
+       band, some zones will not contain any cells.
+
+    """
+
+    ncols = nrows if ncols is None else ncols
+    random = numpy.random.RandomState(seed)
+
+    band = max(int(numpy.ceil(nrows * coastal_fraction)), 1)
+    tile_rows = max(int(round(numpy.sqrt(nzones * band / float(ncols)))), 1)
+    tile_cols = int(numpy.ceil(nzones / float(tile_rows)))
+    tile_h = band / float(tile_rows)
+    tile_w = ncols / float(tile_cols)
+
+    seeds_y = (numpy.arange(tile_rows)[:, None] + random.uniform(0.1, 0.9, (tile_rows, tile_cols))) * tile_h
+    seeds_x = (numpy.arange(tile_cols)[None, :] + random.uniform(0.1, 0.9, (tile_rows, tile_cols))) * tile_w
+    ids = numpy.arange(1, tile_rows * tile_cols + 1).reshape(tile_rows, tile_cols)
+    ids[ids > nzones] = 0
+
+    zones = numpy.zeros((nrows, ncols), dtype=dtype)
+    x = numpy.arange(ncols) + 0.5
+    tx = numpy.minimum((x / tile_w).astype(int), tile_cols - 1)
+    for rows in _rows_in_chunks(band):
+        y = rows + 0.5
+        ty = numpy.minimum((y / tile_h).astype(int), tile_rows - 1)
+
+        best_dist = numpy.full((y.shape[0], ncols), numpy.inf)
+        best_id = numpy.zeros((y.shape[0], ncols), dtype=dtype)
+        for dy in (-1, 0, 1):
+            ny = numpy.clip(ty + dy, 0, tile_rows - 1)[:, None]
+            for dx in (-1, 0, 1):
+                nx = numpy.clip(tx + dx, 0, tile_cols - 1)[None, :]
+                dist = (seeds_y[ny, nx] - y[:, None]) ** 2 + (seeds_x[ny, nx] - x[None, :]) ** 2
+                closer = dist < best_dist
+                best_dist[closer] = dist[closer]
+                best_id[closer] = ids[ny, nx][closer]
+
+        zones[rows[0]:rows[-1] + 1] = best_id
+
+    return zones
+
+
+def wetlands(dem, seed=0, max_elevation=1.5, coverage=0.5):
+    """ Synthetic wetlands in the low-lying portions of a DEM.
+
+    Parameters
+    ----------
+    dem : numpy.ndarray
+        Elevations in meters (e.g., from :func:`coastal_dem`).
+    seed : int, optional (0)
+        Seed of the random number generator.
+    max_elevation : float, optional (1.5)
+        Wetlands only occur at or below this elevation.
+    coverage : float, optional (0.5)
+        Approximate fraction of the low-lying cells that are wetlands.
+
+    Returns
+    -------
+    wetlands : numpy.ndarray of bool
+
+    """
+
+    nrows, ncols = dem.shape
+    noise = fractal_noise(nrows, ncols, seed=seed + 1, octaves=4,
+                          scale=max(nrows, ncols) / 16.0)
+    lowlands = (dem <= max_elevation) & (dem >= 0)
+    threshold = numpy.percentile(noise[lowlands], 100 * (1 - coverage)) if lowlands.any() else 0
+    return lowlands & (noise >= threshold)
+
+
+def buildings(dem, nbuildings=100, seed=0, min_elevation=0.5,
+              min_size=2, max_size=6, dtype=numpy.int32):
+    """ Synthetic, non-overlapping rectangular building footprints on
+    dry-ish land.
+
+    Parameters
+    ----------
+    dem : numpy.ndarray
+        Elevations in meters (e.g., from :func:`coastal_dem`).
+    nbuildings : int, optional (100)
+        Number of buildings to *try* to place. Buildings that would
+        overlap an existing building are skipped.
+    seed : int, optional (0)
+        Seed of the random number generator.
+    min_elevation : float, optional (0.5)
+        Buildings are only placed where the DEM is above this value.
+    min_size, max_size : int, optional (2 and 6)
+        Range of the width and height (in cells) of the buildings.
+    dtype : numpy dtype, optional (int32)
+
+    Returns
+    -------
+    buildings : numpy.ndarray
+        Building IDs from 1 to (at most) ``nbuildings``. Cells without a
+        building are 0.
+
+    """
+
+    nrows, ncols = dem.shape
+    random = numpy.random.RandomState(seed + 2)
+    footprints = numpy.zeros((nrows, ncols), dtype=dtype)
+
+    rows = random.randint(0, max(nrows - max_size, 1), size=nbuildings)
+    cols = random.randint(0, max(ncols - max_size, 1), size=nbuildings)
+    heights = random.randint(min_size, max_size + 1, size=nbuildings)
+    widths = random.randint(min_size, max_size + 1, size=nbuildings)
+
+    struct_id = 0
+    for r, c, h, w in zip(rows, cols, heights, widths):
+        window = (slice(r, r + h), slice(c, c + w))
+        if dem[r, c] > min_elevation and not footprints[window].any():
+            struct_id += 1
+            footprints[window] = struct_id
+
+    return footprints
+
+
+class StudyArea(object):
+    """ A complete, synthetic set of inputs for python-tidegates.
+
+    Use :func:`generate` to create a study area.
+
+    Attributes
+    ----------
+    dem : numpy.ndarray
+        Topography in meters.
+    zones : numpy.ndarray
+        Zones of influence (IDs from 1, 0 outside of the zones).
+    wetlands : numpy.ndarray of bool
+        Where the wetlands are.
+    buildings : numpy.ndarray
+        Building IDs (from 1, 0 where there are no buildings).
+    cellsize : float
+        The width and height of the cells.
+    xmin, ymin : float
+        Coordinates of the lower left corner of the rasters.
+    seed : int
+        The seed used to generate the data.
+
+    """
+
+    def __init__(self, dem, zones, wetlands, buildings, cellsize=4,
+                 xmin=0.0, ymin=0.0, seed=None):
+        self.dem = dem
+        self.zones = zones
+        self.wetlands = wetlands
+        self.buildings = buildings
+        self.cellsize = cellsize
+        self.xmin = xmin
+        self.ymin = ymin
+        self.seed = seed
+
+    @property
+    def shape(self):
+        return self.dem.shape
+
+    @property
+    def template(self):
+        """ A :class:`tidegates.utils.RasterTemplate` to georeference
+        the arrays.
+
+        """
+        from . import utils
+        nrows, ncols = self.shape
+        return utils.RasterTemplate(self.cellsize, self.xmin, self.ymin,
+                                    nrows=nrows, ncols=ncols)
+
+    def save(self, filename):
+        """ Saves the arrays and georeferencing info to a ``.npz`` file.
+
+        """
+
+        numpy.savez(
+            filename,
+            dem=self.dem,
+            zones=self.zones,
+            wetlands=self.wetlands,
+            buildings=self.buildings,
+            georef=numpy.array([self.cellsize, self.xmin, self.ymin]),
+            seed=numpy.array(-1 if self.seed is None else self.seed),
+        )
+
+    @classmethod
+    def load(cls, filename):
+        """ Loads a study area saved by :meth:`save`. """
+
+        with numpy.load(filename) as data:
+            cellsize, xmin, ymin = data['georef']
+            seed = int(data['seed'])
+            return cls(
+                data['dem'], data['zones'], data['wetlands'], data['buildings'],
+                cellsize=cellsize, xmin=xmin, ymin=ymin,
+                seed=None if seed < 0 else seed,
+            )
+
+    def to_workspace(self, workspace, prefix='synthetic_', ID_column='GeoID',
+                     bldg_idcol='STRUCT_ID'):
+        """ Writes the study area to disk as a GeoTIFF DEM and
+        shapefiles of the zones, wetlands, and buildings.
+
+        Relies on :func:`tidegates.utils.array_to_raster`,
+        :func:`tidegates.utils.raster_to_polygons` and
+        :func:`tidegates.utils.aggregate_polygons`.
+
+        Parameters
+        ----------
+        workspace : str
+            Folder in which the files will be saved.
+        prefix : str, optional ('synthetic_')
+            Prefix of all of the filenames.
+        ID_column, bldg_idcol : str, optional ('GeoID', 'STRUCT_ID')
+            Names of the fields that identify the zones and buildings.
+
+        Returns
+        -------
+        paths : dict
+            Paths to the *dem*, *zones*, *wetlands*, and *buildings*.
+
+        """
+
+        from . import utils
+
+        def path(name, ext):
+            return os.path.join(workspace, prefix + name + ext)
+
+        paths = {
+            'dem': path('dem', '.tif'),
+            'zones': path('zones', '.shp'),
+            'wetlands': path('wetlands', '.shp'),
+            'buildings': path('buildings', '.shp'),
+        }
+
+        template = self.template
+        with utils.WorkSpace(workspace), utils.OverwriteState(True):
+            utils.array_to_raster(self.dem, template, outfile=paths['dem'], nodata=-999)
+
+            zones_raster = utils.array_to_raster(self.zones, template, outfile=path('_zones', '.tif'))
+            raw_zones = utils.raster_to_polygons(zones_raster, path('_zones', '.shp'), newfield=ID_column)
+            utils.aggregate_polygons(raw_zones, ID_column, paths['zones'])
+
+            wetlands_raster = utils.array_to_raster(self.wetlands.astype(numpy.uint8), template,
+                                                    outfile=path('_wetlands', '.tif'))
+            utils.raster_to_polygons(wetlands_raster, paths['wetlands'])
+
+            bldg_raster = utils.array_to_raster(self.buildings, template, outfile=path('_buildings', '.tif'))
+            utils.raster_to_polygons(bldg_raster, paths['buildings'], newfield=bldg_idcol)
+
+            utils.cleanup_temp_results(
+                path('_zones', '.tif'), path('_zones', '.shp'),
+                path('_wetlands', '.tif'), path('_buildings', '.tif'),
+            )
+
+        return paths
+
+
+def generate(nrows, ncols=None, nzones=10, nbuildings=None, cellsize=4,
+             xmin=0.0, ymin=0.0, seed=0, **dem_options):
+    """ Generates a complete synthetic study area.
+
+    Parameters
+    ----------
+    nrows, ncols : int
+        Shape of the rasters. ``ncols`` defaults to ``nrows``.
+    nzones : int, optional (10)
+        Number of zones of influence.
+    nbuildings : int, optional
+        Number of buildings to try to place. Defaults to one per 2,500
+        cells.
+    cellsize : float, optional (4)
+        Width and height of the cells.
+    xmin, ymin : float, optional (0, 0)
+        Coordinates of the lower left corner of the rasters.
+    seed : int, optional (0)
+        Seed of the random number generators.
+    **dem_options : keyword arguments
+        Passed on to :func:`coastal_dem`.
+
+    Returns
+    -------
+    study_area : StudyArea
+
+    Examples
+    --------
+    >>> from tidegates import synthetic
+    >>> area = synthetic.generate(2000, nzones=100, seed=42)
+    >>> area.save('study_area_2000.npz')
+    >>> paths = area.to_workspace('C:/scratch/synthetic')
+
+    """
+
+    ncols = nrows if ncols is None else ncols
+    if nbuildings is None:
+        nbuildings = max(nrows * ncols // 2500, 1)
+
+    dem = coastal_dem(nrows, ncols, seed=seed, **dem_options)
+    zones = zones_of_influence(nrows, ncols, nzones=nzones, seed=seed)
+    return StudyArea(
+        dem=dem,
+        zones=zones,
+        wetlands=wetlands(dem, seed=seed),
+        buildings=buildings(dem, nbuildings=nbuildings, seed=seed),
+        cellsize=cellsize,
+        xmin=xmin,
+        ymin=ymin,
+        seed=seed,
+    )
@@ -1,12 +1,18 @@
 import nose.tools as nt
 from numpy import errstate, hstack, array
 import numpy.testing as nptest
-import arcpy
 
 from warnings import simplefilter
 import sys
 import os
 
+try:
+    import arcpy
+    has_arcpy = True
+except ImportError:
+    arcpy = None
+    has_arcpy = False
+
 try:
     import fiona
     has_fiona = True
@@ -14,8 +20,15 @@ except ImportError:
     fiona = None
     has_fiona = False
 
+try:
+    from osgeo import gdal
+    has_gdal = True
+except ImportError:
+    gdal = None
+    has_gdal = False
+
 # Check for availability of ArcGIS Spatial Analyst (required to run certain tests)
-if arcpy.CheckExtension("Spatial") == u'Available':
+if has_arcpy and arcpy.CheckExtension("Spatial") == u'Available':
     has_spatial = True
 else:
     has_spatial = False
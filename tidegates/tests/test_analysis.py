@@ -2,6 +2,7 @@ import os
 from pkg_resources import resource_filename
 import shutil
 import glob
+import tempfile
 
 import numpy
 
@@ -9,11 +10,12 @@ import nose.tools as nt
 from nose import with_setup
 import numpy.testing as nptest
 import tidegates.testing as tgtest
+import mock
 
 import arcpy
 
 import tidegates
-from tidegates import utils
+from tidegates import utils, analysis
 
 
 def test_process_dem_and_zones():
@@ -55,6 +57,60 @@ def test_process_dem_and_zones():
     nt.assert_equal(template.extent.lowerLeft.Y, known_Y)
 
 
+def test_process_dem_and_zones_cache():
+    cache = tempfile.mkdtemp()
+    topo = numpy.arange(12, dtype=float).reshape(3, 4)
+    zones = numpy.ones((3, 4), dtype=int)
+    ws = resource_filename('tidegates.testing', 'process_dem_and_zones')
+    try:
+        with utils.WorkSpace(ws):
+            cachedir = analysis._dem_and_zones_cache(cache, 'topo.tif', 'zones.shp', 'GeoID')
+            analysis._save_cache(cachedir, topo=topo, zones=zones, georef=[8, 4, 22], crs='')
+            with mock.patch.object(utils, 'rasters_to_arrays') as r2a:
+                ta, za, template = tidegates.process_dem_and_zones(
+                    dem='topo.tif',
+                    zones='zones.shp',
+                    ID_column='GeoID',
+                    cache=cache,
+                    memmap=True,
+                )
+                nt.assert_false(r2a.called)
+
+            nt.assert_true(isinstance(ta, numpy.memmap))
+            nt.assert_equal(ta.filename, os.path.join(cachedir, 'topo.npy'))
+            nt.assert_false(ta.flags.writeable)
+
+            other = analysis._dem_and_zones_cache(cache, 'topo.tif', 'zones.shp', 'OtherID')
+            nt.assert_not_equal(cachedir, other)
+
+            nptest.assert_array_equal(ta, topo)
+            nptest.assert_array_equal(za, zones)
+            del ta, za
+    finally:
+        shutil.rmtree(cache)
+
+    nt.assert_equal(template.meanCellWidth, 8)
+    nt.assert_equal(template.extent.lowerLeft.X, 4)
+    nt.assert_equal(template.extent.lowerLeft.Y, 22)
+
+
+def test__save_cache():
+    cache = tempfile.mkdtemp()
+    cachedir = os.path.join(cache, 'sub', 'dem_and_zones_abc')
+    try:
+        with mock.patch.object(numpy, 'save', side_effect=IOError('disk full')):
+            nt.assert_raises(IOError, analysis._save_cache, cachedir, topo=numpy.ones(3))
+        nt.assert_list_equal(os.listdir(os.path.dirname(cachedir)), [])
+
+        analysis._save_cache(cachedir, topo=numpy.ones(3), zones=numpy.zeros(3))
+        nt.assert_list_equal(os.listdir(os.path.dirname(cachedir)), ['dem_and_zones_abc'])
+        nt.assert_list_equal(sorted(os.listdir(cachedir)), ['topo.npy', 'zones.npy'])
+        nptest.assert_array_equal(numpy.load(os.path.join(cachedir, 'topo.npy'), mmap_mode='r'),
+                                  numpy.ones(3))
+    finally:
+        shutil.rmtree(cache)
+
+
 @nptest.dec.skipif(not tgtest.has_fiona)
 def test_flood_area():
     topo = numpy.mgrid[:8, :8].sum(axis=0) * tidegates.METERS_PER_FOOT
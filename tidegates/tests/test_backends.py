@@ -0,0 +1,325 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+from pkg_resources import resource_filename
+
+import numpy
+
+import nose.tools as nt
+from nose import SkipTest
+import numpy.testing as nptest
+import tidegates.testing as tgtest
+
+from tidegates import backends, utils, analysis
+
+
+@backends.register
+class _RecordingBackend(backends.Backend):
+    name = '_recording'
+
+    def __init__(self):
+        super(_RecordingBackend, self).__init__()
+        self.calls = []
+
+    def load_data(self, datapath, datatype, greedyRasters=True):
+        self.calls.append((datapath, datatype))
+        return 'loaded'
+
+
+class Test_registry(object):
+    def teardown(self):
+        backends.set_backend('arcpy')
+
+    def test_available(self):
+        nt.assert_true(set(['arcpy', 'gdal', '_recording']).issubset(set(backends.available())))
+
+    def test_default(self):
+        nt.assert_equal(backends.get_backend().name, 'arcpy')
+
+    @nt.raises(ValueError)
+    def test_unknown(self):
+        backends.set_backend('junk')
+
+    def test_use(self):
+        with backends.use('_recording') as backend:
+            nt.assert_equal(backends.get_backend().name, '_recording')
+            nt.assert_true(backends.env() is backend.env)
+        nt.assert_equal(backends.get_backend().name, 'arcpy')
+
+    def test_dispatch(self):
+        with backends.use('_recording') as backend:
+            nt.assert_equal(utils.load_data('zones.shp', 'shape'), 'loaded')
+            nt.assert_list_equal(backend.calls[-1:], [('zones.shp', 'shape')])
+
+    def test_dispatch_fallback(self):
+        # no implementation -> the numpy/arcpy function in utils
+        zones = numpy.array([[0, 1], [1, 2]])
+        topo = numpy.array([[1.0, 2.0], [3.0, 4.0]])
+        with backends.use('_recording'):
+            flooded = utils.flood_zones(zones, topo, 3.0)
+        nptest.assert_array_equal(flooded, [[0, 1], [1, 0]])
+
+    @nptest.dec.skipif(not tgtest.has_arcpy)
+    def test_WorkSpace(self):
+        import arcpy
+
+        orig = arcpy.env.workspace
+        with backends.use('_recording') as backend:
+            with utils.WorkSpace('elsewhere'):
+                nt.assert_equal(backend.env.workspace, 'elsewhere')
+                nt.assert_equal(arcpy.env.workspace, orig)
+                nt.assert_equal(utils.create_temp_filename('test', filetype='shape'),
+                                os.path.join('elsewhere', '_temp_test.shp'))
+            nt.assert_true(backend.env.workspace is None)
+
+
+class Test_ExecutionContext(object):
+    def setup(self):
+        self.recording = backends.get_backend('_recording')
+        self.recording.env.workspace = 'global'
+        self.recording.env.overwriteOutput = False
+
+    def teardown(self):
+        self.recording.env = backends.Environment()
+
+    def test_fallback(self):
+        with backends.use('_recording'):
+            with backends.ExecutionContext(workspace='task') as context:
+                nt.assert_true(backends.current_context() is context)
+                nt.assert_true(backends.env() is context)
+                nt.assert_equal(backends.env().workspace, 'task')
+                nt.assert_false(backends.env().overwriteOutput)
+
+                with backends.ExecutionContext(overwriteOutput=True):
+                    nt.assert_equal(backends.env().workspace, 'task')
+                    nt.assert_true(backends.env().overwriteOutput)
+
+            nt.assert_true(backends.current_context() is None)
+            nt.assert_true(backends.env() is self.recording.env)
+
+    def test_backend(self):
+        with backends.ExecutionContext(backend='_recording'):
+            nt.assert_equal(backends.get_backend().name, '_recording')
+            nt.assert_equal(backends.env().workspace, 'global')
+            nt.assert_equal(utils.load_data('zones.shp', 'shape'), 'loaded')
+        nt.assert_equal(backends.get_backend().name, 'arcpy')
+
+    def test_workspace_only_in_thread(self):
+        seen = {}
+        ready = threading.Event()
+        done = threading.Event()
+
+        def task(name):
+            with backends.ExecutionContext(backend='_recording'), utils.WorkSpace(name):
+                ready.wait(5)
+                seen[name] = utils.create_temp_filename('test', filetype='raster')
+                done.wait(5)
+
+        threads = [threading.Thread(target=task, args=(name,)) for name in ('ws1', 'ws2')]
+        for thread in threads:
+            thread.start()
+
+        ready.set()
+        time.sleep(0.1)
+        done.set()
+        for thread in threads:
+            thread.join()
+
+        nt.assert_equal(seen['ws1'], os.path.join('ws1', '_temp_test.tif'))
+        nt.assert_equal(seen['ws2'], os.path.join('ws2', '_temp_test.tif'))
+        nt.assert_equal(self.recording.env.workspace, 'global')
+
+    def test_restored_after_error(self):
+        with backends.use('_recording'):
+            with nt.assert_raises(ZeroDivisionError):
+                with utils.WorkSpace('other'), utils.OverwriteState(True):
+                    1 / 0
+
+            nt.assert_equal(backends.env().workspace, 'global')
+            nt.assert_false(backends.env().overwriteOutput)
+
+            with nt.assert_raises(ZeroDivisionError):
+                with backends.ExecutionContext(workspace='task'):
+                    1 / 0
+            nt.assert_true(backends.current_context() is None)
+
+    def test_contextual(self):
+        @backends.contextual
+        def workspace():
+            return backends.env().workspace
+
+        with backends.use('_recording'):
+            nt.assert_equal(workspace(), 'global')
+            nt.assert_equal(workspace(context=backends.ExecutionContext(workspace='task')), 'task')
+
+    def test_propagates_to_pipeline(self):
+        from tidegates import pipeline
+
+        pipe = pipeline.Pipeline([pipeline.Stage('ws', lambda x: backends.env().workspace)])
+        with backends.ExecutionContext(workspace='task', backend='_recording'):
+            nt.assert_list_equal(pipe.run([1, 2]), ['task', 'task'])
+
+    def test_session_propagates_to_pipeline(self):
+        from tidegates import pipeline
+
+        def name(num):
+            return utils.create_temp_filename('test', filetype='raster', num=num)
+
+        pipe = pipeline.Pipeline([pipeline.Stage('name', name)])
+        with backends.ExecutionContext(workspace='task', backend='_recording'), \
+             utils.TempNamespace('run1'):
+            nt.assert_list_equal(pipe.run([1]), [os.path.join('task', '_temp_test_1_run1.tif')])
+
+    def test_applied_to_arcpy_env(self):
+        @backends.dispatch
+        def _tool():
+            arcpy_env = backends.get_backend('arcpy').env
+            return arcpy_env.workspace, arcpy_env.overwriteOutput
+
+        orig = _tool()
+        with backends.ExecutionContext(workspace='task', backend='arcpy'):
+            with utils.OverwriteState(not orig[1]):
+                nt.assert_equal(_tool(), ('task', not orig[1]))
+        nt.assert_equal(_tool(), orig)
+
+    @nt.raises(AttributeError)
+    def test_unknown_setting(self):
+        backends.ExecutionContext().scratchFolder = 'junk'
+
+
+class Test_GDALBackend(object):
+    def setup(self):
+        if not tgtest.has_gdal:
+            raise SkipTest('GDAL is not installed')
+
+        self.workspace = tempfile.mkdtemp()
+        self.zones = numpy.array([
+            [0, 1, 1, 0],
+            [0, 1, 2, 2],
+            [3, 3, 2, 2],
+        ], dtype=numpy.int32)
+
+    def teardown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_array_round_trip(self):
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 100, 200)
+            raster = utils.array_to_raster(self.zones, template, outfile='zones.tif')
+            array = utils.rasters_to_arrays(raster, squeeze=True)
+
+        nt.assert_equal(raster.meanCellWidth, 4)
+        nt.assert_equal(raster.extent.lowerLeft.X, 100)
+        nt.assert_equal(raster.extent.lowerLeft.Y, 200)
+        nptest.assert_array_equal(array, numpy.where(self.zones == 0, -999, self.zones))
+
+    def test_windowed_read(self):
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 100, 200, nrows=3, ncols=4)
+            raster = utils.array_to_raster(self.zones, template, outfile='zones.tif')
+            array = utils.rasters_to_arrays(raster, squeeze=True, window=(1, 3, 2, 4))
+
+        expected = self.zones[1:3, 2:4]
+        nptest.assert_array_equal(array, numpy.where(expected == 0, -999, expected))
+
+    def test_polygons(self):
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 0, 0)
+            raster = utils.array_to_raster(self.zones, template, outfile='zones.tif')
+            polygons = utils.raster_to_polygons(raster, 'polygons.shp', newfield='GeoID')
+            dissolved = utils.aggregate_polygons(polygons, 'GeoID', 'dissolved.shp')
+            areas = utils.groupby_and_aggregate(
+                input_path=dissolved,
+                groupfield='GeoID',
+                valuefield='SHAPE@AREA',
+                aggfxn=lambda group: sum([row[1] for row in group])
+            )
+            zones = utils.polygons_to_raster(dissolved, 'GeoID', cellsize=4, outfile='rasterized.tif')
+            array = utils.rasters_to_arrays(zones, squeeze=True)
+
+        nt.assert_dict_equal(areas, {1: 48.0, 2: 64.0, 3: 32.0})
+        nt.assert_tuple_equal(array.shape, (3, 4))
+        nt.assert_equal((array == 2).sum(), 4)
+
+    def test_fields(self):
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 0, 0)
+            raster = utils.array_to_raster(self.zones, template, outfile='zones.tif')
+            polygons = utils.raster_to_polygons(raster, 'polygons.shp')
+            utils.add_field_with_value(polygons, 'surge', '100yr', field_length=10)
+            utils.add_field_with_value(polygons, 'area', field_type='DOUBLE')
+            utils.populate_field(polygons, lambda row: row[0] * 2, 'area', 'SHAPE@AREA')
+            counts = utils.groupby_and_aggregate(polygons, 'surge', 'gridcode')
+
+        nt.assert_dict_equal(counts, {'100yr': 3})
+
+    def test_rasterize_assets(self):
+        assets = numpy.where(self.zones == 2, 5, 0).astype(numpy.int32)
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 100, 200)
+            raster = utils.array_to_raster(assets, template, outfile='assets.tif')
+            utils.raster_to_polygons(raster, 'assets.shp')
+            numbered = analysis.rasterize_assets(self.zones, template, 'assets.shp')
+
+        # on the grid of the zones, not just the extent of the assets
+        nptest.assert_array_equal(numbered, numpy.where(self.zones == 2, 1, 0))
+
+    def test_select_intersecting(self):
+        corner = numpy.zeros_like(self.zones)
+        corner[0, 0] = 1
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 0, 0)
+            zones = utils.array_to_raster(self.zones, template, outfile='zones.tif')
+            polygons = utils.raster_to_polygons(zones, 'polygons.shp')
+            boundary = utils.array_to_raster(corner, template, outfile='corner.tif')
+            boundary = utils.raster_to_polygons(boundary, 'corner.shp')
+
+            others = utils.raster_to_polygons(zones, 'others.shp')
+
+            layer = utils.select_intersecting(polygons, boundary)
+            overlap = utils.intersect_polygon_layers('overlap.shp', layer, others)
+            counts = utils.groupby_and_aggregate(overlap, 'gridcode', 'gridcode')
+
+        nt.assert_equal(len(layer.selection), 1)
+        nt.assert_dict_equal(counts, {1: 1})
+
+    def test_keyed_join(self):
+        floods = numpy.where(self.zones > 0, 1, 0).astype(numpy.int32)
+        floods[:, 3] = 0
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            template = utils.RasterTemplate(4, 0, 0)
+            zones = utils.array_to_raster(self.zones, template, outfile='zones.tif')
+            assets = utils.raster_to_polygons(zones, 'assets.shp')
+            flooded = utils.array_to_raster(floods, template, outfile='floods.tif')
+            flooded = utils.raster_to_polygons(flooded, 'floods.shp', newfield='GeoID')
+
+            pieces = utils.intersect_polygon_layers('pieces.shp', flooded, assets)
+            idfield = utils.source_id_field(pieces, assets)
+            dissolved = utils.aggregate_polygons(pieces, ['GeoID', idfield], 'dissolved.shp')
+            joined = utils.join_results_to_baseline('joined.shp', dissolved, assets)
+
+            codes = utils.groupby_and_aggregate(pieces, idfield, 'gridcode',
+                                                aggfxn=lambda group: group[0][1])
+            nzones = utils.groupby_and_aggregate(dissolved, idfield, 'GeoID')
+            joined_codes = utils.groupby_and_aggregate(joined, idfield, 'gridcode',
+                                                       aggfxn=lambda group: [row[1] for row in group])
+
+        nt.assert_equal(idfield, 'FID_assets')
+        nt.assert_equal(len(joined_codes), 3)
+        for source, values in joined_codes.items():
+            nt.assert_list_equal(values, [codes[source]] * nzones[source])
+
+    def test_join_on_source_ids(self):
+        folder = resource_filename('tidegates.testing', 'join_results')
+        with backends.use('gdal'), utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+            joined = utils.join_results_to_baseline(
+                'joined.shp',
+                os.path.join(folder, 'merge_join_keyed.shp'),
+                os.path.join(folder, 'merge_baseline.shp'),
+            )
+            pairs = utils.groupby_and_aggregate(joined, 'bldg', 'bldg_1',
+                                                aggfxn=lambda group: [row[1] for row in group])
+
+        nt.assert_dict_equal(pairs, {'AA1': ['AA1'], 'BB1': ['BB1']})
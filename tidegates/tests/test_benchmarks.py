@@ -0,0 +1,81 @@
+import os
+import json
+import shutil
+import tempfile
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from tidegates import benchmarks
+
+
+def test_Case_arrays():
+    case = benchmarks.Case(24, 4, '.')
+    topo, zones = case.arrays
+    nt.assert_tuple_equal(topo.shape, (24, 24))
+    nt.assert_tuple_equal(zones.shape, (24, 24))
+    nt.assert_true(set(numpy.unique(zones)).issubset(set(range(5))))
+    nt.assert_true(case.arrays[0] is topo)
+
+
+class Test_run(object):
+    def setup(self):
+        self.workspace = tempfile.mkdtemp()
+        self.report = benchmarks.run(
+            names=['flood_zones'],
+            sizes=[16, 32],
+            zone_counts=[4],
+            repeat=2,
+            workspace=self.workspace
+        )
+
+    def teardown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_schema(self):
+        nt.assert_equal(self.report['schema'], benchmarks.SCHEMA)
+        nt.assert_list_equal(
+            list(self.report.keys()),
+            ['schema', 'created', 'environment', 'results']
+        )
+
+    def test_results(self):
+        results = self.report['results']
+        nt.assert_equal(len(results), 2)
+        for result, size in zip(results, [16, 32]):
+            nt.assert_equal(result['name'], 'flood_zones')
+            nt.assert_equal(result['status'], 'ok')
+            nt.assert_equal(result['params']['size'], size)
+            nt.assert_equal(result['params']['nzones'], 4)
+            nt.assert_equal(len(result['times_s']), 2)
+            nt.assert_equal(result['min_s'], min(result['times_s']))
+
+    def test_save(self):
+        filename = os.path.join(self.workspace, 'bench.json')
+        benchmarks.save(self.report, filename)
+        with open(filename, 'r') as output:
+            loaded = json.load(output)
+        nt.assert_equal(loaded['results'][0]['name'], 'flood_zones')
+
+
+@nt.raises(ValueError)
+def test_run_unknown_benchmark():
+    benchmarks.run(names=['junk'], sizes=[8], zone_counts=[2])
+
+
+def test_run_case_error():
+    @benchmarks.benchmark('_broken', requires_arcpy=False)
+    def broken(case):
+        def timed():
+            raise RuntimeError('nope')
+        return timed
+
+    try:
+        result = benchmarks.run_case('_broken', benchmarks.Case(8, 2, '.'), repeat=1)
+    finally:
+        benchmarks.BENCHMARKS.pop('_broken')
+
+    nt.assert_equal(result['status'], 'error')
+    nt.assert_equal(result['message'], 'RuntimeError: nope')
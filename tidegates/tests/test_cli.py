@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+import tempfile
+
+import nose.tools as nt
+import mock
+
+from tidegates import cli, toolbox, profiling
+
+
+class Test_config(object):
+    def setup(self):
+        self.folder = tempfile.mkdtemp()
+        self.config = {
+            'workspace': 'tidegates.gdb',
+            'dem': 'dem_x08',
+            'zones': 'ZOI',
+            'ID_column': 'GeoID',
+            'assets': {'wetlands': 'wetlands', 'buildings': 'buildings'},
+            'outputs': {'floods': 'floods.shp', 'wetlands': 'flooded_wetlands'},
+        }
+
+        self.configfile = os.path.join(self.folder, 'config.json')
+        with open(self.configfile, 'w') as configfile:
+            json.dump(self.config, configfile)
+
+        self.scenariofile = os.path.join(self.folder, 'scenarios.csv')
+        with open(self.scenariofile, 'w') as csvfile:
+            csvfile.write('name,elevation\nlow,4.5\nhigh,9\n')
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def test_load_config(self):
+        nt.assert_dict_equal(cli.load_config(self.configfile), self.config)
+
+    @nt.raises(cli.ConfigError)
+    def test_load_config_missing(self):
+        cli.load_config(os.path.join(self.folder, 'nope.json'))
+
+    @nt.raises(cli.ConfigError)
+    def test_load_config_invalid(self):
+        with open(self.configfile, 'w') as configfile:
+            configfile.write('{"workspace": ')
+        cli.load_config(self.configfile)
+
+    def test_read_scenarios_standard(self):
+        nt.assert_true(cli.read_scenarios(None) is None)
+        nt.assert_true(cli.read_scenarios('standard') is None)
+
+    def test_read_scenarios_list(self):
+        nt.assert_list_equal(cli.read_scenarios([1, '2.5']), [1.0, 2.5])
+
+    def test_read_scenarios_csv(self):
+        elevations = cli.read_scenarios('scenarios.csv', basedir=self.folder)
+        nt.assert_list_equal(elevations, [4.5, 9.0])
+
+    @nt.raises(cli.ConfigError)
+    def test_read_scenarios_empty(self):
+        cli.read_scenarios([])
+
+    def test_make_params_standard(self):
+        toolclass, params = cli.make_params(self.config, basedir=self.folder)
+        nt.assert_equal(toolclass, toolbox.StandardScenarios)
+        expected = {
+            'workspace': os.path.join(self.folder, 'tidegates.gdb'),
+            'dem': 'dem_x08',
+            'zones': 'ZOI',
+            'ID_column': 'GeoID',
+            'flood_output': 'floods.shp',
+            'wetlands': 'wetlands',
+            'wetland_output': 'flooded_wetlands',
+            'buildings': 'buildings',
+        }
+        nt.assert_dict_equal(params, expected)
+
+    def test_make_params_custom(self):
+        self.config['scenarios'] = [5, 6]
+        toolclass, params = cli.make_params(self.config)
+        nt.assert_equal(toolclass, toolbox.Flooder)
+        nt.assert_list_equal(params['elevation'], [5.0, 6.0])
+
+    def test_make_params_output_format(self):
+        toolclass, params = cli.make_params(self.config, output_format='featureclass')
+        nt.assert_equal(params['flood_output'], 'floods')
+
+        toolclass, params = cli.make_params(self.config, output_format='shapefile')
+        nt.assert_equal(params['flood_output'], 'floods.shp')
+        nt.assert_equal(params['wetland_output'], 'flooded_wetlands.shp')
+
+    @nt.raises(cli.ConfigError)
+    def test_make_params_missing(self):
+        self.config.pop('zones')
+        cli.make_params(self.config)
+
+    def test_main_config_error(self):
+        self.config.pop('outputs')
+        with open(self.configfile, 'w') as configfile:
+            json.dump(self.config, configfile)
+        nt.assert_equal(cli.main(['run', self.configfile]), cli.EXIT_CONFIG_ERROR)
+
+    def test_main(self):
+        reportfile = os.path.join(self.folder, 'report.json')
+        with mock.patch.object(toolbox.StandardScenarios, 'main_execute') as me:
+            status = cli.main(['run', self.configfile, '--jobs', '3', '--report', reportfile])
+            nt.assert_equal(me.call_args[1]['jobs'], 3)
+            nt.assert_false(me.call_args[1]['memmap'])
+            nt.assert_false(me.call_args[1]['pipelined'])
+            nt.assert_false(me.call_args[1]['prefilter'])
+
+            cli.main(['run', self.configfile, '--memmap', '--report', reportfile])
+            nt.assert_true(me.call_args[1]['memmap'] is True)
+
+            cli.main(['run', self.configfile, '--compact', '--report', reportfile])
+            nt.assert_true(me.call_args[1]['compact'])
+
+            cli.main(['run', self.configfile, '--pipeline', '--report', reportfile])
+            nt.assert_true(me.call_args[1]['pipelined'])
+
+            cli.main(['run', self.configfile, '--prefilter', '--report', reportfile])
+            nt.assert_true(me.call_args[1]['prefilter'])
+
+        nt.assert_equal(status, cli.EXIT_SUCCESS)
+        with open(reportfile, 'r') as rf:
+            report = json.load(rf)
+        nt.assert_equal(report['status'], 'success')
+
+    def test_main_stats(self):
+        reportfile = os.path.join(self.folder, 'report.json')
+        statsfile = os.path.join(self.folder, 'stats.json')
+        results = {'scenarios': [{'elevation': 4.0, 'buildings': 3}]}
+        with mock.patch.object(toolbox.StandardScenarios, 'zone_statistics',
+                               return_value=results) as zs:
+            status = cli.main(['stats', self.configfile, '--realizations', '50', '--ead',
+                               '--output', statsfile, '--report', reportfile])
+
+        nt.assert_equal(status, cli.EXIT_SUCCESS)
+        nt.assert_equal(zs.call_args[1]['realizations'], 50)
+        nt.assert_true(zs.call_args[1]['ead'])
+        nt.assert_equal(zs.call_args[1]['buildings'], 'buildings')
+        with open(statsfile, 'r') as sf:
+            nt.assert_dict_equal(json.load(sf), results)
+
+    def test_main_failure(self):
+        reportfile = os.path.join(self.folder, 'report.json')
+        with mock.patch.object(toolbox.StandardScenarios, 'main_execute', side_effect=RuntimeError('boom')):
+            status = cli.main(['run', self.configfile, '--report', reportfile])
+
+        nt.assert_equal(status, cli.EXIT_FAILURE)
+        with open(reportfile, 'r') as rf:
+            report = json.load(rf)
+        nt.assert_equal(report['status'], 'error')
+        nt.assert_equal(report['message'], 'RuntimeError: boom')
+
+
+def test_timing_report():
+    tracer = profiling.Tracer()
+    tracer.record('flood_area', 'analysis', 0, 2)
+    tracer.record('flood_area', 'analysis', 2, 3)
+    tracer.record('analyze', 'toolbox', 0, 4)
+
+    report = cli.timing_report(tracer, 5)
+    nt.assert_equal(report['total_s'], 5)
+    nt.assert_list_equal(list(report['spans'].keys()), ['analyze', 'flood_area'])
+    nt.assert_equal(report['spans']['flood_area']['calls'], 2)
+    nt.assert_equal(report['spans']['flood_area']['total_s'], 3)
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+import mock
+
+import tidegates
+from tidegates import distributed, utils, toolbox
+
+
+class Test_WorkQueue(object):
+    def setup(self):
+        self.shared = tempfile.mkdtemp()
+        self.queue = distributed.WorkQueue(self.shared)
+        for num in range(3):
+            self.queue.put({'name': 'task_{:06d}.json'.format(num), 'num': num})
+
+    def teardown(self):
+        shutil.rmtree(self.shared)
+
+    def test_counts(self):
+        expected = {'pending': 3, 'claimed': 0, 'done': 0, 'failed': 0}
+        nt.assert_dict_equal(self.queue.counts(), expected)
+
+    def test_claim(self):
+        task = self.queue.claim('w1')
+        nt.assert_equal(task['num'], 0)
+        nt.assert_equal(task['worker'], 'w1')
+        nt.assert_equal(self.queue.claim('w2')['num'], 1)
+        nt.assert_equal(self.queue.counts()['claimed'], 2)
+
+    def test_claim_race(self):
+        # a second queue object on the same directory (i.e., another
+        # worker) can't claim the same task
+        other = distributed.WorkQueue(self.shared)
+        names = [self.queue.claim('w1')['name'], other.claim('w2')['name']]
+        nt.assert_equal(len(set(names)), 2)
+
+    def test_claim_empty(self):
+        for _ in range(3):
+            self.queue.claim('w1')
+        nt.assert_true(self.queue.claim('w1') is None)
+
+    def test_complete_and_fail(self):
+        self.queue.complete(self.queue.claim('w1'), ['floods.shp', None, None])
+        self.queue.fail(self.queue.claim('w1'), 'RuntimeError: boom')
+
+        expected = {'pending': 1, 'claimed': 0, 'done': 1, 'failed': 1}
+        nt.assert_dict_equal(self.queue.counts(), expected)
+        nt.assert_list_equal(self.queue.results()[0]['result'], ['floods.shp', None, None])
+        nt.assert_equal(self.queue.failures()[0]['error'], 'RuntimeError: boom')
+
+    def test_claim_owner(self):
+        task = self.queue.claim('w1')
+        nt.assert_equal(task['worker'], 'w1')
+        nt.assert_equal(self.queue.owner(task), 'w1')
+        nt.assert_true(self.queue.owner({'name': 'task_000002.json'}) is None)
+
+    def test_touch(self):
+        task = self.queue.claim('w1')
+        claimed = os.path.join(self.queue.folder('claimed'), task['name'])
+        an_hour_ago = time.time() - 3600
+        os.utime(claimed, (an_hour_ago, an_hour_ago))
+
+        nt.assert_true(self.queue.touch(task))
+        nt.assert_list_equal(self.queue.requeue(60), [])
+
+    def test_complete_after_requeue(self):
+        # w1 is slow, so its task is requeued and claimed by w2
+        slow = self.queue.claim('w1')
+        claimed = os.path.join(self.queue.folder('claimed'), slow['name'])
+        an_hour_ago = time.time() - 3600
+        os.utime(claimed, (an_hour_ago, an_hour_ago))
+        self.queue.requeue(60)
+        other = distributed.WorkQueue(self.shared)
+        fast = other.claim('w2')
+        nt.assert_equal(fast['name'], slow['name'])
+
+        # w1 can't complete, touch, or fail w2's claim...
+        nt.assert_false(self.queue.complete(slow, ['slow.shp', None, None]))
+        nt.assert_false(self.queue.touch(slow))
+        nt.assert_false(self.queue.fail(slow, 'RuntimeError: late'))
+        nt.assert_equal(self.queue.owner(fast), 'w2')
+
+        # ...but w2 can
+        nt.assert_true(other.complete(fast, ['fast.shp', None, None]))
+        nt.assert_false(other.complete(fast, ['fast.shp', None, None]))
+        nt.assert_list_equal(self.queue.results()[0]['result'], ['fast.shp', None, None])
+        nt.assert_equal(self.queue.counts()['claimed'], 0)
+
+    def test_requeue(self):
+        self.queue.claim('w1')
+        nt.assert_list_equal(self.queue.requeue(60), [])
+
+        claimed = os.path.join(self.queue.folder('claimed'), 'task_000000.json')
+        an_hour_ago = time.time() - 3600
+        os.utime(claimed, (an_hour_ago, an_hour_ago))
+        nt.assert_list_equal(self.queue.requeue(60), ['task_000000.json'])
+        nt.assert_equal(self.queue.counts()['pending'], 3)
+
+
+def test_zone_groups():
+    zones = numpy.array([
+        [0, 1, 1, 0],
+        [0, 2, 0, 0],
+        [3, 3, 0, 4],
+    ])
+    groups = distributed.zone_groups(zones, 2)
+    nt.assert_list_equal(groups, [([1, 2], (0, 2, 1, 3)), ([3, 4], (2, 3, 0, 4))])
+
+    nt.assert_equal(len(distributed.zone_groups(zones, 10)), 4)
+
+
+def test__subset():
+    topo = numpy.arange(12, dtype=float).reshape(3, 4)
+    zones = numpy.array([
+        [0, 1, 1, 0],
+        [0, 2, 0, 0],
+        [3, 3, 0, 4],
+    ])
+    template = utils.RasterTemplate(8, 100, 200)
+    t, z, tmpl = distributed._subset(topo, zones, template, [1, 2], (0, 2, 1, 3))
+
+    nptest.assert_array_equal(t, topo[:2, 1:3])
+    nptest.assert_array_equal(z, [[1, 1], [2, 0]])
+    nt.assert_equal(tmpl.meanCellWidth, 8)
+    nt.assert_equal(tmpl.xmin, 108)
+    nt.assert_equal(tmpl.ymin, 208)
+
+
+class Test_prepare_and_work(object):
+    def setup(self):
+        self.shared = tempfile.mkdtemp()
+        self.topo = numpy.arange(12, dtype=float).reshape(3, 4)
+        self.zones = numpy.array([
+            [0, 1, 1, 0],
+            [0, 2, 0, 0],
+            [3, 3, 0, 4],
+        ])
+        self.template = utils.RasterTemplate(8, 100, 200)
+        self.params = {
+            'workspace': self.shared,
+            'dem': 'dem.tif',
+            'zones': 'zones.shp',
+            'ID_column': 'GeoID',
+            'flood_output': 'floods.shp',
+            'wetlands': 'wetlands.shp',
+            'elevation': [4, 5],
+        }
+
+        pdz = mock.patch.object(tidegates, 'process_dem_and_zones',
+                                return_value=(self.topo, self.zones, self.template))
+        pfa = mock.patch.object(toolbox.StandardScenarios, '_prefilter_assets',
+                                return_value='extent.shp')
+        with pdz, pfa as self.prefilter:
+            self.queue = distributed.prepare(self.shared, split='zones', ngroups=2,
+                                             prefilter=True, **self.params)
+
+    def teardown(self):
+        shutil.rmtree(self.shared)
+
+    def test_tasks(self):
+        nt.assert_equal(self.queue.counts()['pending'], 4)
+        task = self.queue.claim('w1')
+        nt.assert_equal(task['scenario']['elev'], 4.0)
+        nt.assert_list_equal(task['zones'], [1, 2])
+
+    def test_bundle(self):
+        topo, zones, template = distributed._load_bundle(self.shared)
+        nt.assert_true(isinstance(topo, numpy.memmap))
+        nt.assert_false(zones.flags.writeable)
+        nptest.assert_array_equal(topo, self.topo)
+        nptest.assert_array_equal(zones, self.zones)
+        nt.assert_equal(template, self.template.with_shape(3, 4))
+        del topo, zones
+
+    def test_manifest(self):
+        with open(os.path.join(self.shared, distributed.MANIFEST), 'r') as mf:
+            manifest = json.load(mf)
+
+        nt.assert_equal(manifest['worker_params']['flood_output'], 'floods.shp')
+        nt.assert_equal(manifest['worker_params']['wetlands'],
+                        os.path.join(os.path.abspath(self.shared), 'wetlands.shp'))
+        nt.assert_true(manifest['worker_params']['buildings'] is None)
+        nt.assert_equal(manifest['worker_params']['prefilter_extent'], 'extent.shp')
+        nt.assert_equal(self.prefilter.call_args[1]['filename'],
+                        os.path.join(os.path.abspath(self.shared), distributed.EXTENT))
+
+    def test_work(self):
+        results = [['floods{}.shp'.format(n), None, None] for n in range(4)]
+        with mock.patch.object(distributed, 'run_task', side_effect=results) as rt:
+            count = distributed.work(self.shared, worker_id='w1')
+
+        nt.assert_equal(count, 4)
+        nt.assert_equal(rt.call_count, 4)
+        nt.assert_equal(self.queue.counts()['done'], 4)
+
+        with mock.patch.object(toolbox.StandardScenarios, 'merge_results') as mr, \
+             mock.patch.object(utils, 'cleanup_temp_results') as ctr:
+            distributed.merge(self.shared)
+            nt.assert_list_equal(mr.call_args[0][0], [tuple(r) for r in results])
+            ctr.assert_called_once_with('extent.shp')
+
+    def test_work_heartbeat(self):
+        def slow_task(task, *args):
+            time.sleep(0.05)
+            return ['floods.shp', None, None]
+
+        with mock.patch.object(distributed, 'run_task', side_effect=slow_task), \
+             mock.patch.object(distributed.WorkQueue, 'touch', return_value=True) as touch:
+            distributed.work(self.shared, worker_id='w1', max_tasks=1, heartbeat=0.01)
+
+        nt.assert_true(touch.call_count > 0)
+        nt.assert_equal(touch.call_args[0][0]['worker'], 'w1')
+
+    def test_work_failure(self):
+        with mock.patch.object(distributed, 'run_task', side_effect=RuntimeError('boom')):
+            count = distributed.work(self.shared, max_tasks=1)
+
+        nt.assert_equal(count, 1)
+        nt.assert_equal(self.queue.counts()['failed'], 1)
+
+    @nt.raises(RuntimeError)
+    def test_merge_unfinished(self):
+        distributed.merge(self.shared)
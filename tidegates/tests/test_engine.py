@@ -0,0 +1,229 @@
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from tidegates import engine, synthetic, utils
+
+
+class Test_ZoneIndex(object):
+    def setup(self):
+        self.zones = numpy.array([
+            [0, 1, 1, 2],
+            [1, 1, 2, 2],
+            [3, 3, 2, 2],
+        ])
+        self.topo = numpy.array([
+            [0.0, 1.0, 2.0, 3.0],
+            [4.0, numpy.nan, 1.0, 2.0],
+            [3.0, 4.0, -999, 6.0],
+        ])
+        self.wetlands = numpy.array([
+            [1, 1, 0, 0],
+            [0, 0, 1, 1],
+            [1, 0, 0, 0],
+        ], dtype=bool)
+        self.buildings = numpy.array([
+            [0, 0, 1, 1],
+            [0, 0, 1, 1],
+            [2, 2, 0, 0],
+        ])
+        self.index = engine.ZoneIndex(self.topo, self.zones, cellsize=2,
+                                      wetlands_array=self.wetlands,
+                                      buildings_array=self.buildings)
+
+    def test_attributes(self):
+        nptest.assert_array_equal(self.index.zone_ids, [1, 2, 3])
+        nt.assert_equal(self.index.ncells, 11)
+        nt.assert_equal(self.index.cell_area, 4)
+
+    def test_area_matches_flood_zones(self):
+        levels = [0.5, 2.0, 3.0, 5.0]
+        stats = self.index.impacts(levels)
+        for n, level in enumerate(levels):
+            flooded = utils.flood_zones(self.zones.copy(), self.topo.copy(), level)
+            expected = [(flooded == z).sum() * 4 for z in [1, 2, 3]]
+            nptest.assert_array_equal(stats['area'][n], expected)
+
+    def test_unsorted_levels(self):
+        sorted_stats = self.index.impacts([1.0, 2.0, 3.0])
+        stats = self.index.impacts([3.0, 1.0, 2.0])
+        nptest.assert_array_equal(stats['area'], sorted_stats['area'][[2, 0, 1]])
+
+    def test_wetlands(self):
+        stats = self.index.impacts([1.0, 2.0])
+        nptest.assert_array_equal(stats['wetlands'], [[4, 4, 0], [4, 8, 0]])
+
+    def test_buildings(self):
+        # building 1 is in zones 1 (lowest cell: 2.0) and 2 (1.0),
+        # building 2 is in zone 3 (3.0)
+        stats = self.index.impacts([0.5, 1.0, 2.0, 3.0])
+        nptest.assert_array_equal(stats['buildings'], [
+            [0, 0, 0],
+            [0, 1, 0],
+            [1, 1, 0],
+            [1, 1, 1],
+        ])
+
+    def test_offsets(self):
+        offsets = numpy.zeros((2, self.index.ncells))
+        offsets[1] += 10
+        stats = self.index.impacts([3.0], offsets=offsets)
+        nt.assert_tuple_equal(stats['area'].shape, (2, 1, 3))
+        nptest.assert_array_equal(stats['area'][0], self.index.impacts([3.0])['area'])
+
+        # missing elevations are flooded no matter what
+        nptest.assert_array_equal(stats['area'][1], [[4, 4, 0]])
+
+
+class Test_CorrelatedNoise(object):
+    def setup(self):
+        shape = (120, 150)
+        self.index = engine.ZoneIndex(numpy.zeros(shape), numpy.ones(shape), cellsize=4)
+
+    def test_sigma(self):
+        noise = engine.CorrelatedNoise(self.index, sigma=0.2, correlation_length=40)
+        sample = noise.sample(200)
+        nt.assert_tuple_equal(sample.shape, (200, self.index.ncells))
+        nptest.assert_allclose(sample.std(axis=0).mean(), 0.2, rtol=0.05)
+        nt.assert_true(abs(sample.mean()) < 0.02)
+
+    def test_correlated(self):
+        noise = engine.CorrelatedNoise(self.index, sigma=1, correlation_length=80).sample(1)
+        field = noise.reshape(self.index.shape)
+        nt.assert_true(numpy.abs(numpy.diff(field, axis=1)).mean() < 0.3)
+
+    def test_uncorrelated(self):
+        noise = engine.CorrelatedNoise(self.index, sigma=1, correlation_length=0).sample(1)
+        field = noise.reshape(self.index.shape)
+        nt.assert_true(numpy.abs(numpy.diff(field, axis=1)).mean() > 0.8)
+
+    def test_deterministic(self):
+        nptest.assert_array_equal(
+            engine.CorrelatedNoise(self.index, seed=3).sample(2),
+            engine.CorrelatedNoise(self.index, seed=3).sample(2),
+        )
+
+
+class Test_ensemble(object):
+    def setup(self):
+        area = synthetic.generate(80, nzones=4, nbuildings=40, seed=1)
+        self.index = engine.ZoneIndex(area.dem, area.zones, area.cellsize,
+                                      wetlands_array=area.wetlands,
+                                      buildings_array=area.buildings)
+        self.levels = [0.5, 1.0, 2.0]
+
+    def test_shapes(self):
+        result = engine.ensemble(self.index, self.levels, realizations=7, batch_size=3)
+        nt.assert_equal(result.realizations, 7)
+        nt.assert_list_equal(list(result.summaries), ['area', 'wetlands', 'buildings'])
+        bands = result.percentiles()
+        nt.assert_tuple_equal(bands['area'].shape, (3, 3, self.index.nzones))
+        nt.assert_tuple_equal(result.totals((50,))['buildings'].shape, (1, 3))
+
+    def test_no_noise(self):
+        result = engine.ensemble(self.index, self.levels, realizations=3, sigma=0)
+        expected = self.index.impacts(self.levels)
+        for name, band in result.percentiles().items():
+            for values in band:
+                nptest.assert_allclose(values, expected[name])
+
+    def test_batches_are_independent_of_size(self):
+        one = engine.ensemble(self.index, self.levels, realizations=5, batch_size=1, seed=2)
+        two = engine.ensemble(self.index, self.levels, realizations=5, batch_size=5, seed=2)
+        nt.assert_false(numpy.allclose(one.summaries['area'][0], one.summaries['area'][1]))
+        nptest.assert_array_equal(one.summaries['area'].shape, two.summaries['area'].shape)
+
+    def test_callback(self):
+        seen = []
+        engine.ensemble(self.index, self.levels, realizations=5, batch_size=2,
+                        callback=lambda result: seen.append(result.realizations))
+        nt.assert_list_equal(seen, [2, 4, 5])
+
+
+class Test_time_series(object):
+    def setup(self):
+        area = synthetic.generate(60, nzones=5, nbuildings=30, seed=4)
+        self.area = area
+        self.index = engine.ZoneIndex(area.dem, area.zones, area.cellsize,
+                                      wetlands_array=area.wetlands,
+                                      buildings_array=area.buildings)
+        random = numpy.random.RandomState(0)
+        hours = numpy.arange(24 * 60)
+        self.levels = 1.5 * numpy.sin(hours * 2 * numpy.pi / 12.42) + random.normal(0, 0.2, hours.shape)
+        self.levels[100:110] = numpy.nan
+        self.result = engine.time_series(self.index, self.levels, timestep=0.5)
+
+    def test_zone_minimums(self):
+        for code, zone in enumerate(self.index.zone_ids):
+            expected = self.area.dem[self.area.zones == zone].min()
+            nptest.assert_allclose(self.index.zone_minimums[code], expected)
+
+    def test_hours_and_events(self):
+        for code, threshold in enumerate(self.index.zone_minimums):
+            with numpy.errstate(invalid='ignore'):
+                flooded = self.levels >= threshold
+            valid = ~numpy.isnan(self.levels)
+            previous = numpy.hstack([[False], flooded[:-1] & valid[:-1]])
+            nt.assert_equal(self.result.hours_flooded[code], 0.5 * flooded.sum())
+            nt.assert_equal(self.result.events[code], (flooded & ~previous).sum())
+        nt.assert_true(self.result.events.max() > 10)
+
+    def test_mean(self):
+        levels = self.levels[~numpy.isnan(self.levels)][::50]
+        result = engine.time_series(self.index, levels)
+        stats = self.index.impacts(levels)
+        for name, values in result.mean.items():
+            nptest.assert_allclose(values, stats[name].mean(axis=0))
+
+    def test_exceedance(self):
+        nptest.assert_array_equal(self.result.exceedance, [0.5, 0.1, 0.01, 0.001])
+        nt.assert_true(numpy.all(numpy.diff(self.result.exceedance_levels) > 0))
+        nt.assert_tuple_equal(self.result.exceeded['buildings'].shape, (4, self.index.nzones))
+        nt.assert_true(numpy.all(numpy.diff(self.result.exceeded['area'], axis=0) >= 0))
+
+    @nt.raises(ValueError)
+    def test_no_valid_levels(self):
+        engine.time_series(self.index, [numpy.nan, numpy.nan])
+
+
+class Test_expected_annual_damage(object):
+    def setup(self):
+        area = synthetic.generate(60, nzones=3, nbuildings=30, seed=5)
+        self.index = engine.ZoneIndex(area.dem, area.zones, area.cellsize,
+                                      wetlands_array=area.wetlands,
+                                      buildings_array=area.buildings)
+
+    def test_standard_events(self):
+        events, slr = engine.standard_events()
+        nt.assert_list_equal(list(events), [10, 50, 100])
+        nptest.assert_allclose(events[100], 10.5 * 0.3048)
+        nptest.assert_allclose(slr, numpy.arange(7) * 0.3048)
+
+    def test_defaults(self):
+        result = engine.expected_annual_damage(self.index, points=10)
+        nt.assert_tuple_equal(result.levels.shape, (7, 21))
+        nt.assert_tuple_equal(result.ead['area'].shape, (7, self.index.nzones))
+        nptest.assert_allclose(result.probabilities[[0, -1]], [0.01, 0.1])
+        nt.assert_true(numpy.all(numpy.diff(result.totals()['area']) >= 0))
+
+    def test_constant_damage(self):
+        # a level that floods everything, always -> EAD = area * p_max
+        events = {10: 100.0, 100: 100.0}
+        result = engine.expected_annual_damage(self.index, events, points=5)
+        total_area = self.index.ncells * self.index.cell_area
+        nptest.assert_allclose(result.totals()['area'], [0.1 * total_area])
+
+        result = engine.expected_annual_damage(self.index, events, points=5, tail=False)
+        nptest.assert_allclose(result.totals()['area'], [0.09 * total_area])
+
+    def test_matches_impacts(self):
+        events = {10: 0.5, 50: 1.0, 100: 2.0}
+        result = engine.expected_annual_damage(self.index, events, sea_level_rise=[0, 0.3])
+        nptest.assert_allclose(result.levels[1, 0], 2.3)
+        nptest.assert_array_equal(result.curves['buildings'][1, 0],
+                                  self.index.impacts([2.3])['buildings'][0])
+
+    @nt.raises(ValueError)
+    def test_one_event(self):
+        engine.expected_annual_damage(self.index, {100: 3.0})
@@ -0,0 +1,66 @@
+import os
+import sys
+import types
+import subprocess
+
+import nose.tools as nt
+
+import tidegates
+from tidegates import _lazy
+
+
+class Test_LazyModule(object):
+    def setup(self):
+        self.name = '_tidegates_lazy_test_module'
+        self.module = types.ModuleType(self.name)
+        self.module.answer = 42
+        self.loaded = []
+        self.lazy = _lazy.LazyModule(self.name)
+        self.lazy.on_load(self.loaded.append)
+
+    def teardown(self):
+        sys.modules.pop(self.name, None)
+
+    def test_not_loaded(self):
+        nt.assert_false(self.lazy.is_loaded)
+        nt.assert_list_equal(self.loaded, [])
+
+    def test_getattr(self):
+        sys.modules[self.name] = self.module
+        nt.assert_equal(self.lazy.answer, 42)
+        nt.assert_true(self.lazy.is_loaded)
+        nt.assert_list_equal(self.loaded, [self.module])
+
+        # callbacks only run once
+        nt.assert_equal(self.lazy.answer, 42)
+        nt.assert_equal(len(self.loaded), 1)
+
+    def test_setattr(self):
+        sys.modules[self.name] = self.module
+        self.lazy.answer = 7
+        nt.assert_equal(self.module.answer, 7)
+
+    def test_sees_patches(self):
+        sys.modules[self.name] = self.module
+        self.lazy.answer
+        self.module.answer = 'patched'
+        nt.assert_equal(self.lazy.answer, 'patched')
+
+    @nt.raises(ImportError)
+    def test_missing_module(self):
+        self.lazy.answer
+
+
+def test_import_does_not_load_arcpy():
+    code = (
+        "import sys; import tidegates; "
+        "from tidegates import utils; "
+        "utils.create_temp_filename('test', filetype='shape'); "
+        "sys.exit(int('arcpy' in sys.modules))"
+    )
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(tidegates.__file__))] +
+        [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    nt.assert_equal(subprocess.call([sys.executable, '-c', code], env=env), 0)
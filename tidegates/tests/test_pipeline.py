@@ -0,0 +1,113 @@
+import time
+import threading
+
+import nose.tools as nt
+
+from tidegates import pipeline
+
+
+class Test_Pipeline(object):
+    def setup(self):
+        self.lock = threading.Lock()
+        self.started = []
+
+    def record(self, name, func):
+        def _record(item):
+            with self.lock:
+                self.started.append((name, item))
+            return func(item)
+        return _record
+
+    def test_results_in_order(self):
+        pipe = pipeline.Pipeline([
+            pipeline.Stage('double', lambda x: x * 2),
+            pipeline.Stage('add', lambda x: x + 1),
+        ])
+        nt.assert_list_equal(pipe.run(range(5)), [1, 3, 5, 7, 9])
+
+    def test_no_items(self):
+        pipe = pipeline.Pipeline([pipeline.Stage('double', lambda x: x * 2)])
+        nt.assert_list_equal(pipe.run([]), [])
+
+    def test_several_workers(self):
+        def slow(x):
+            # later items finish first
+            time.sleep(0.01 * (5 - x))
+            return x
+
+        pipe = pipeline.Pipeline([
+            pipeline.Stage('slow', slow, workers=3),
+            pipeline.Stage('square', lambda x: x ** 2, workers=2),
+        ], maxsize=2)
+        nt.assert_list_equal(pipe.run(range(5)), [0, 1, 4, 9, 16])
+
+    def test_stages_overlap(self):
+        first_done = threading.Event()
+
+        def second(x):
+            # the first stage has to move on to item 1 while item 0
+            # is still in this stage
+            if x == 0:
+                nt.assert_true(first_done.wait(5))
+            return x
+
+        def first(x):
+            if x == 1:
+                first_done.set()
+            return x
+
+        pipe = pipeline.Pipeline([
+            pipeline.Stage('first', first),
+            pipeline.Stage('second', second),
+        ])
+        nt.assert_list_equal(pipe.run(range(3)), [0, 1, 2])
+
+    def test_backpressure(self):
+        release = threading.Event()
+
+        def blocked(x):
+            release.wait(5)
+            return x
+
+        pipe = pipeline.Pipeline([
+            pipeline.Stage('fast', self.record('fast', lambda x: x)),
+            pipeline.Stage('blocked', blocked),
+        ], maxsize=1)
+
+        runner = threading.Thread(target=pipe.run, args=(range(10),))
+        runner.start()
+        time.sleep(0.2)
+
+        # one item in `blocked`, one waiting for it, one waiting
+        # to be put on the queue
+        with self.lock:
+            nt.assert_less_equal(len(self.started), 3)
+
+        release.set()
+        runner.join(5)
+        nt.assert_equal(len(self.started), 10)
+
+    @nt.raises(ZeroDivisionError)
+    def test_error_propagates(self):
+        pipe = pipeline.Pipeline([
+            pipeline.Stage('divide', lambda x: 1. / (x - 2)),
+            pipeline.Stage('add', lambda x: x + 1),
+        ])
+        pipe.run(range(5))
+
+    def test_stops_after_error(self):
+        def fail(x):
+            if x == 1:
+                raise ValueError(x)
+            return x
+
+        pipe = pipeline.Pipeline([
+            pipeline.Stage('fail', self.record('fail', fail)),
+            pipeline.Stage('next', self.record('next', lambda x: x)),
+        ])
+
+        with nt.assert_raises(ValueError):
+            pipe.run(range(50))
+
+        nt.assert_not_in(('next', 1), self.started)
+        nt.assert_less(len([s for s in self.started if s[0] == 'fail']), 50)
@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+
+import numpy
+
+import nose.tools as nt
+
+from tidegates import profiling
+
+
+@profiling.traced()
+def _traced_fxn(array, elevation, num=0):
+    return array.sum() + elevation + num
+
+
+@profiling.traced(name='outer')
+def _outer_fxn(array):
+    return _traced_fxn(array, 1.5, num=3)
+
+
+class Test_Tracer(object):
+    def setup(self):
+        self.folder = tempfile.mkdtemp()
+        self.tracefile = os.path.join(self.folder, 'trace_{pid}.json')
+        self.array = numpy.ones((4, 5))
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def test_inactive_records_nothing(self):
+        nt.assert_false(profiling.is_active())
+        tracer = profiling.Tracer()
+        _traced_fxn(self.array, 1.0)
+        nt.assert_list_equal(tracer.events, [])
+
+    def test_records_spans_and_args(self):
+        with profiling.Tracer() as tracer:
+            nt.assert_true(profiling.is_active())
+            result = _traced_fxn(self.array, 1.0, num=7)
+
+        nt.assert_false(profiling.is_active())
+        nt.assert_equal(result, 28.0)
+        nt.assert_equal(len(tracer.events), 1)
+
+        event = tracer.events[0]
+        nt.assert_equal(event['name'], '_traced_fxn')
+        nt.assert_equal(event['cat'], 'test_profiling')
+        nt.assert_equal(event['ph'], 'X')
+        nt.assert_equal(event['pid'], os.getpid())
+        nt.assert_equal(event['tid'], threading.current_thread().ident)
+        nt.assert_dict_equal(event['args'], {
+            'array': 'array<4x5 float64>',
+            'elevation': 1.0,
+            'num': 7,
+        })
+
+    def test_nested_spans(self):
+        with profiling.Tracer() as tracer:
+            _outer_fxn(self.array)
+
+        inner, outer = tracer.events
+        nt.assert_equal(outer['name'], 'outer')
+        nt.assert_equal(inner['name'], '_traced_fxn')
+        nt.assert_true(outer['ts'] <= inner['ts'])
+        nt.assert_true(inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'])
+
+    def test_span_records_on_exception(self):
+        with profiling.Tracer() as tracer:
+            with nt.assert_raises(ValueError):
+                with profiling.span('failing', scenario=4):
+                    raise ValueError('boom')
+
+        nt.assert_equal(tracer.events[0]['name'], 'failing')
+        nt.assert_dict_equal(tracer.events[0]['args'], {'scenario': 4})
+
+    def test_save_chrome_trace(self):
+        with profiling.Tracer(self.tracefile):
+            _traced_fxn(self.array, 2.0)
+
+        expected = self.tracefile.replace('{pid}', str(os.getpid()))
+        nt.assert_true(os.path.exists(expected))
+        with open(expected, 'r') as tracefile:
+            trace = json.load(tracefile)
+
+        phases = [event['ph'] for event in trace['traceEvents']]
+        nt.assert_list_equal(phases, ['M', 'X'])
+        nt.assert_equal(trace['traceEvents'][1]['name'], '_traced_fxn')
+
+
+def test__describe():
+    nt.assert_equal(profiling._describe(numpy.zeros((2, 3), dtype=int)).split(' ')[0], 'array<2x3')
+    nt.assert_equal(profiling._describe([1, 2, 3]), 'list[3]')
+    nt.assert_equal(profiling._describe({'a': 1}), 'dict[1]')
+    nt.assert_equal(profiling._describe('ZOI.shp'), 'ZOI.shp')
+    nt.assert_equal(profiling._describe(None), None)
+    nt.assert_equal(profiling._describe(numpy.float32(2.5)), 2.5)
+    nt.assert_equal(profiling._describe(object()), 'object')
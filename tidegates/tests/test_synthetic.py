@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+
+import numpy
+
+import nose.tools as nt
+import numpy.testing as nptest
+
+from tidegates import synthetic
+
+
+def test_fractal_noise():
+    noise = synthetic.fractal_noise(300, 200, seed=1)
+    nt.assert_tuple_equal(noise.shape, (300, 200))
+    nt.assert_equal(noise.dtype, numpy.float32)
+    nt.assert_true(abs(noise.mean()) < 0.5)
+    nt.assert_true(0.1 < noise.std() < 2)
+
+    # spatially correlated: neighbors are much closer than random cells
+    neighbor_diff = numpy.abs(numpy.diff(noise, axis=1)).mean()
+    nt.assert_true(neighbor_diff < 0.5 * noise.std())
+
+
+def test_fractal_noise_deterministic():
+    nptest.assert_array_equal(
+        synthetic.fractal_noise(50, 60, seed=7),
+        synthetic.fractal_noise(50, 60, seed=7)
+    )
+    nt.assert_false(numpy.allclose(
+        synthetic.fractal_noise(50, 60, seed=7),
+        synthetic.fractal_noise(50, 60, seed=8)
+    ))
+
+
+def test_fractal_noise_out():
+    out = numpy.zeros((40, 30), dtype=numpy.float64)
+    noise = synthetic.fractal_noise(40, 30, seed=2, out=out)
+    nt.assert_true(noise is out)
+    nt.assert_true(numpy.abs(out).sum() > 0)
+
+
+def test_coastal_dem():
+    dem = synthetic.coastal_dem(400, 100, seed=3, min_elevation=-1, max_elevation=10, relief=0.5)
+    nt.assert_tuple_equal(dem.shape, (400, 100))
+    nt.assert_true(dem[:20].mean() < 0)
+    nt.assert_true(dem[-20:].mean() > 9)
+    nt.assert_true(numpy.all(numpy.diff(dem.mean(axis=1)[::50]) > 0))
+
+
+class Test_zones_of_influence(object):
+    def setup(self):
+        self.zones = synthetic.zones_of_influence(200, 150, nzones=12, seed=4, coastal_fraction=0.5)
+
+    def test_shape_and_dtype(self):
+        nt.assert_tuple_equal(self.zones.shape, (200, 150))
+        nt.assert_equal(self.zones.dtype, numpy.int32)
+
+    def test_ids(self):
+        nptest.assert_array_equal(numpy.unique(self.zones), numpy.arange(13))
+
+    def test_coastal_band(self):
+        nt.assert_true(numpy.all(self.zones[:100] > 0))
+        nt.assert_true(numpy.all(self.zones[100:] == 0))
+
+    def test_deterministic(self):
+        again = synthetic.zones_of_influence(200, 150, nzones=12, seed=4, coastal_fraction=0.5)
+        nptest.assert_array_equal(again, self.zones)
+
+
+def test_many_zones():
+    zones = synthetic.zones_of_influence(100, nzones=1000, seed=0)
+    nt.assert_true(zones.max() <= 1000)
+    nt.assert_true(numpy.unique(zones).shape[0] > 900)
+
+
+def test_wetlands():
+    dem = synthetic.coastal_dem(200, seed=5)
+    wl = synthetic.wetlands(dem, seed=5, max_elevation=1.5, coverage=0.5)
+    nt.assert_equal(wl.dtype, bool)
+    nt.assert_true(wl.any())
+    nt.assert_true(numpy.all(dem[wl] <= 1.5))
+    nt.assert_true(numpy.all(dem[wl] >= 0))
+    lowlands = (dem <= 1.5) & (dem >= 0)
+    nt.assert_almost_equal(wl.sum() / float(lowlands.sum()), 0.5, delta=0.05)
+
+
+def test_buildings():
+    dem = synthetic.coastal_dem(200, seed=6)
+    bldgs = synthetic.buildings(dem, nbuildings=50, seed=6, min_size=2, max_size=4)
+    ids = numpy.unique(bldgs)
+    nt.assert_equal(ids[0], 0)
+    nptest.assert_array_equal(ids[1:], numpy.arange(1, ids.max() + 1))
+    nt.assert_true(ids.max() > 10)
+
+    sizes = numpy.bincount(bldgs.flat)[1:]
+    nt.assert_true(numpy.all(sizes >= 4))
+    nt.assert_true(numpy.all(sizes <= 16))
+
+
+class Test_StudyArea(object):
+    def setup(self):
+        self.folder = tempfile.mkdtemp()
+        self.area = synthetic.generate(120, 80, nzones=6, nbuildings=30, cellsize=8,
+                                       xmin=100, ymin=200, seed=11)
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def test_generate(self):
+        nt.assert_tuple_equal(self.area.shape, (120, 80))
+        for array in [self.area.zones, self.area.wetlands, self.area.buildings]:
+            nt.assert_tuple_equal(array.shape, (120, 80))
+        nt.assert_equal(self.area.zones.max(), 6)
+        nt.assert_equal(self.area.seed, 11)
+
+    def test_deterministic(self):
+        again = synthetic.generate(120, 80, nzones=6, nbuildings=30, seed=11)
+        for name in ['dem', 'zones', 'wetlands', 'buildings']:
+            nptest.assert_array_equal(getattr(again, name), getattr(self.area, name))
+
+    def test_save_load(self):
+        filename = os.path.join(self.folder, 'area.npz')
+        self.area.save(filename)
+        loaded = synthetic.StudyArea.load(filename)
+        for name in ['dem', 'zones', 'wetlands', 'buildings']:
+            nptest.assert_array_equal(getattr(loaded, name), getattr(self.area, name))
+        nt.assert_equal(loaded.cellsize, 8)
+        nt.assert_equal(loaded.xmin, 100)
+        nt.assert_equal(loaded.ymin, 200)
+        nt.assert_equal(loaded.seed, 11)
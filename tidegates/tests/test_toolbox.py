@@ -1,4 +1,6 @@
 import os
+import threading
+from collections import OrderedDict
 from pkg_resources import resource_filename
 
 import arcpy
@@ -10,7 +12,7 @@ import tidegates.testing as tgtest
 import mock
 
 import tidegates
-from tidegates import utils, toolbox
+from tidegates import utils, toolbox, engine
 
 
 @nt.nottest
@@ -102,6 +104,12 @@ class CheckToolbox_Mixin(object):
             nt.assert_true(isinstance(ezmd, utils.EasyMapDoc))
             add_layer.assert_called_once_with(self.simple_shp)
 
+    def test_add_results(self):
+        with mock.patch.object(utils.EasyMapDoc, 'add_layers') as add_layers:
+            ezmd = self.tbx._add_to_map([self.simple_shp, self.simple_shp], mxd=self.mxd)
+            nt.assert_true(isinstance(ezmd, utils.EasyMapDoc))
+            add_layers.assert_called_once_with([self.simple_shp, self.simple_shp])
+
     def test__add_scenario_columns_elev(self):
         with mock.patch.object(utils, 'add_field_with_value') as afwv:
             self.tbx._add_scenario_columns(MockResult, elev=5.0)
@@ -401,6 +409,141 @@ class CheckToolbox_Mixin(object):
             resource_filename(testdir, self.known_flood_output_no_opts)
         )
 
+    def test__analyze_sequentially(self):
+        scenarios = [dict(elev=elev, surge_name=None, slr=None) for elev in (1.0, 2.0)]
+
+        def analyze_scenario(topo, zones, template, num, scenario, **params):
+            return ('floods{}'.format(num), None, params['flood_output'])
+
+        with mock.patch.object(self.tbx, '_analyze_scenario', side_effect=analyze_scenario):
+            results = self.tbx._analyze_sequentially('topo', 'zones', 'template', scenarios,
+                                                     flood_output='flood.shp')
+
+        nt.assert_list_equal(results, [('floods0', None, 'flood.shp'),
+                                       ('floods1', None, 'flood.shp')])
+
+    def test__analyze_sequentially_registers_outputs(self):
+        scenarios = [dict(elev=1.0, surge_name=None, slr=None)]
+        registry = mock.Mock()
+        with mock.patch.object(self.tbx, '_analyze_scenario',
+                               return_value=('floods0', None, 'buildings0')), \
+             mock.patch.object(utils.TempRegistry, 'active', return_value=registry):
+            self.tbx._analyze_sequentially('topo', 'zones', 'template', scenarios,
+                                           flood_output='flood.shp')
+
+        nt.assert_list_equal(registry.add.call_args_list,
+                             [mock.call('floods0'), mock.call('buildings0')])
+
+    def test__analyze_pipelined(self):
+        scenarios = [dict(elev=elev, surge_name=None, slr=None) for elev in (1.0, 2.0, 3.0)]
+        # threads in which geoprocessing happened
+        threads = set()
+
+        def flood_array(topo, zones, elev, **kwargs):
+            return numpy.ones((2, 2)) * elev
+
+        def array_to_raster(array, template, outfile, **kwargs):
+            threads.add(threading.current_thread().name)
+            nt.assert_true(kwargs['tiled'])
+            return 'raster{}'.format(array.max())
+
+        def flood_scenario(topo, zones, template, elev, surge, slr, num, floods_path, **params):
+            threads.add(threading.current_thread().name)
+            nt.assert_equal(params['flooded_raster'], 'raster{}'.format(elev))
+
+        def assess_scenario(floods_path, elev, surge, slr, num, **params):
+            threads.add(threading.current_thread().name)
+            return mock.Mock(dataSource=floods_path), None, None
+
+        with mock.patch.object(tidegates, 'flood_array', side_effect=flood_array), \
+             mock.patch.object(utils, 'array_to_raster', side_effect=array_to_raster), \
+             mock.patch.object(self.tbx, '_show_header'), \
+             mock.patch.object(self.tbx, '_flood_scenario', side_effect=flood_scenario) as fs, \
+             mock.patch.object(self.tbx, '_assess_scenario', side_effect=assess_scenario):
+            results = self.tbx._analyze_pipelined('topo', 'zones', 'template', scenarios,
+                                                  flood_output='flood.shp')
+
+        nt.assert_equal(fs.call_count, 3)
+        nt.assert_equal(len(threads), 1)
+        nt.assert_list_equal(
+            [(os.path.basename(fld), wl, bl) for fld, wl, bl in results],
+            [('flood1_0_0.shp', None, None),
+             ('flood2_0_1.shp', None, None),
+             ('flood3_0_2.shp', None, None)]
+        )
+
+    @mock.patch('tidegates.toolbox.SURGES', {'MHHW': 4.0, '10yr': 8.0})
+    def test__prefilter_assets(self):
+        scenarios = [
+            dict(elev=None, surge_name='MHHW', slr=1),
+            dict(elev=None, surge_name='10yr', slr=2),
+            dict(elev=None, surge_name='10yr', slr=0),
+        ]
+        extent = mock.Mock(dataSource='extent.shp')
+        with mock.patch.object(tidegates, 'prefilter_assets',
+                               return_value=(extent, ['candidates'])) as pfa:
+            prefiltered = self.tbx._prefilter_assets('topo', 'zones', 'template', scenarios,
+                                                     filename='extent.shp',
+                                                     wetlands='wetlands.shp', buildings=None)
+
+        nt.assert_equal(prefiltered, 'extent.shp')
+        nt.assert_equal(pfa.call_args[0][3], 10.0)
+        nt.assert_list_equal(pfa.call_args[0][4], ['wetlands.shp'])
+        nt.assert_equal(pfa.call_args[1]['filename'], 'extent.shp')
+        nt.assert_equal(toolbox._candidates('wetlands.shp', 'extent.shp'), 'candidates')
+
+        toolbox._release_candidates('extent.shp')
+        nt.assert_dict_equal(toolbox._candidate_layers, {})
+        nt.assert_true(self.tbx._prefilter_assets('topo', 'zones', 'template', scenarios) is None)
+
+    def test__assess_scenario_prefiltered(self):
+        layers = (mock.Mock(dataSource='floods.shp'), None, None)
+        with mock.patch.object(tidegates, 'assess_impact', return_value=layers) as ai, \
+             mock.patch.object(utils, 'select_intersecting', return_value='selected') as si:
+            for num in range(2):
+                self.tbx._assess_scenario('floods.shp', 4.0, None, None, num, ID_column='GeoID',
+                                          wetlands='wetlands.shp', buildings='buildings.shp',
+                                          prefilter_extent='extent.shp')
+            toolbox._release_candidates('extent.shp')
+
+        # the candidates are selected once per process
+        nt.assert_equal(si.call_count, 2)
+        si.assert_any_call('wetlands.shp', 'extent.shp')
+        si.assert_any_call('buildings.shp', 'extent.shp')
+        nt.assert_equal(ai.call_args[1]['wetlands_path'], 'selected')
+        nt.assert_equal(ai.call_args[1]['buildings_path'], 'selected')
+
+    @mock.patch('tidegates.toolbox.SEALEVELRISE', [0, 1])
+    @mock.patch('tidegates.toolbox.SURGES', OrderedDict([('10yr', 8.0), ('100yr', 10.5)]))
+    def test_zone_statistics(self):
+        topo = numpy.array([[1.0, 2.0], [3.0, 4.0]])
+        zones = numpy.array([[1, 1], [2, 2]])
+        template = utils.RasterTemplate(2, 0, 0)
+        index = engine.ZoneIndex(topo, zones, cellsize=2,
+                                 buildings_array=numpy.array([[1, 0], [0, 2]]))
+
+        with mock.patch.object(utils, 'AnalysisSession'), \
+             mock.patch.object(tidegates, 'process_dem_and_zones',
+                               return_value=(topo, zones, template)), \
+             mock.patch.object(tidegates, 'zone_index', return_value=index) as zi:
+            stats = self.tbx.zone_statistics(realizations=20, sigma=0.01, ead=True,
+                                             workspace='ws', dem='dem.tif', zones='zones.shp',
+                                             ID_column='GeoID', buildings='buildings.shp',
+                                             elevation=[5, 10])
+
+        nt.assert_equal(zi.call_args[1]['buildings'], 'buildings.shp')
+        nt.assert_true(zi.call_args[1]['wetlands'] is None)
+
+        # 5 ft = 1.52 m and 10 ft = 3.05 m
+        low, high = stats['scenarios']
+        nt.assert_equal(low['elevation'], 5)
+        nt.assert_equal((low['area'], low['buildings']), (4, 1))
+        nt.assert_equal((high['area'], high['buildings']), (12, 1))
+        nptest.assert_allclose(high['area_percentiles'], [12, 12, 12])
+
+        nt.assert_list_equal([row['slr'] for row in stats['ead']], [0, 1])
+        nt.assert_true(stats['ead'][1]['area'] > stats['ead'][0]['area'])
+
     @mock.patch('tidegates.toolbox.SEALEVELRISE', [0, 1])
     @mock.patch('tidegates.toolbox.SURGES', {'MHHW': 4.0, '10yr': 8.0})
     def test_main_execute(self):
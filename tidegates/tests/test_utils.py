@@ -1,4 +1,7 @@
 import os
+import shutil
+import tempfile
+import threading
 from pkg_resources import resource_filename
 import time
 
@@ -11,7 +14,7 @@ import tidegates.testing as tgtest
 import mock
 
 import tidegates
-from tidegates import utils
+from tidegates import utils, _lazy
 
 
 @nt.nottest
@@ -40,6 +43,93 @@ def test_RasterTemplate_from_raster():
     nt.assert_equal(template.meanCellHeight, raster.meanCellHeight)
     nt.assert_equal(template.extent.lowerLeft.X, raster.extent.lowerLeft.X)
     nt.assert_equal(template.extent.lowerLeft.Y, raster.extent.lowerLeft.Y)
+    nt.assert_tuple_equal(template.shape, (raster.height, raster.width))
+
+
+class Test_RasterTemplate(object):
+    def setup(self):
+        # 30 rows x 40 columns of 10 x 5 cells
+        self.template = utils.RasterTemplate(10, 1000, 2000, nrows=30, ncols=40,
+                                             cellheight=5, crs='PROJCS["test"]')
+
+    def test_attributes(self):
+        nt.assert_equal(self.template.meanCellWidth, 10)
+        nt.assert_equal(self.template.meanCellHeight, 5)
+        nt.assert_tuple_equal(self.template.shape, (30, 40))
+        nt.assert_equal(self.template.xmax, 1400)
+        nt.assert_equal(self.template.ymax, 2150)
+        nt.assert_tuple_equal(self.template.geotransform, (1000, 10, 0, 2150, 0, -5))
+
+    def test_extent(self):
+        with mock.patch.object(utils.backends, 'get_backend') as get_backend:
+            get_backend.return_value.name = 'gdal'
+            extent = self.template.extent
+        nt.assert_equal(extent.lowerLeft.X, 1000)
+        nt.assert_equal(extent.lowerLeft.Y, 2000)
+        nt.assert_equal(extent.XMax, 1400)
+        nt.assert_equal(extent.YMax, 2150)
+
+    def test_extent_without_arcpy(self):
+        missing = _lazy.LazyModule('_tidegates_missing_module')
+        with mock.patch.object(utils, 'arcpy', missing):
+            extent = self.template.extent
+            nt.assert_true(isinstance(extent, utils.backends.Extent))
+            nt.assert_equal(extent.lowerLeft.X, 1000)
+            nt.assert_equal(self.template.spatialReference, self.template.crs)
+
+    def test_no_shape(self):
+        template = utils.RasterTemplate(8, 1, 2)
+        nt.assert_true(template.shape is None)
+        nt.assert_true(numpy.isnan(template.xmax))
+        nt.assert_raises(ValueError, template.window, 0, 0, 1, 1)
+        nt.assert_tuple_equal(template.with_shape(3, 4).shape, (3, 4))
+
+    @nt.raises(AttributeError)
+    def test_immutable(self):
+        self.template.cellwidth = 2
+
+    def test_pickle(self):
+        import pickle
+        template = pickle.loads(pickle.dumps(self.template, pickle.HIGHEST_PROTOCOL))
+        nt.assert_equal(template, self.template)
+        nt.assert_equal(template.crs, 'PROJCS["test"]')
+
+    def test_georef(self):
+        template = utils.RasterTemplate(8, 4, 22, nrows=3, ncols=4)
+        nt.assert_equal(utils.RasterTemplate.from_georef(template.georef), template)
+
+        # caches written before the shape was saved
+        nt.assert_equal(utils.RasterTemplate.from_georef([8, 4, 22], shape=(3, 4)), template)
+        nt.assert_true(utils.RasterTemplate.from_georef([8, 4, 22]).shape is None)
+
+    def test_index(self):
+        nt.assert_tuple_equal(self.template.index(1005, 2149), (0, 0))
+        nt.assert_tuple_equal(self.template.index(1395, 2001), (29, 39))
+        rows, cols = self.template.index(numpy.array([1015, 1025]), numpy.array([2140, 2130]))
+        nptest.assert_array_equal(rows, [2, 4])
+        nptest.assert_array_equal(cols, [1, 2])
+
+    def test_xy(self):
+        nt.assert_tuple_equal(self.template.xy(0, 0), (1005, 2147.5))
+        nt.assert_tuple_equal(self.template.index(*self.template.xy(12, 7)), (12, 7))
+
+    def test_window(self):
+        nt.assert_tuple_equal(self.template.window(1015, 2100, 1042, 2140), (2, 10, 1, 5))
+        nt.assert_tuple_equal(self.template.window(0, 0, 9999, 9999), (0, 30, 0, 40))
+
+    def test_subset(self):
+        sub = self.template.subset((2, 10, 1, 5))
+        nt.assert_equal(sub, utils.RasterTemplate(10, 1010, 2100, nrows=8, ncols=4,
+                                                  cellheight=5, crs='PROJCS["test"]'))
+        nt.assert_tuple_equal(sub.xy(0, 0), self.template.xy(2, 1))
+
+    def test_tiles(self):
+        tiles = list(self.template.tiles(16))
+        nt.assert_equal(len(tiles), 6)
+        nt.assert_tuple_equal(tiles[0], (0, 16, 0, 16))
+        nt.assert_tuple_equal(tiles[-1], (16, 30, 32, 40))
+        cells = sum((r1 - r0) * (c1 - c0) for r0, r1, c0, c1 in tiles)
+        nt.assert_equal(cells, 30 * 40)
 
 
 class Test_EasyMapDoc(object):
@@ -87,6 +177,73 @@ class Test_EasyMapDoc(object):
         self.ezmd.add_layer(self.add_layer_path, position='junk')
 
 
+class Test_EasyMapDoc_add_layers(object):
+    def setup(self):
+        self.maplayers = []
+        for name in ['ZOI', 'wetlands', 'ZOI']:
+            self.maplayers.append(self.make_layer(name))
+
+        self.mapping = dict(
+            MapDocument=mock.Mock(),
+            ListDataFrames=mock.Mock(return_value=['Main', 'Subset']),
+            ListLayers=mock.Mock(side_effect=lambda mapdoc: list(self.maplayers)),
+            AddLayer=mock.Mock(side_effect=self.add_layer),
+        )
+        self.patches = mock.patch.multiple(arcpy.mapping, **self.mapping)
+        self.patches.start()
+        self.ezmd = utils.EasyMapDoc('CURRENT')
+
+    def teardown(self):
+        self.patches.stop()
+
+    def make_layer(self, name):
+        layer = mock.Mock(isGroupLayer=False)
+        layer.name = name
+        return layer
+
+    def add_layer(self, df, layer, position):
+        copy = self.make_layer(layer.name)
+        if position == 'TOP':
+            self.maplayers.insert(0, copy)
+        else:
+            self.maplayers.append(copy)
+
+    def load(self, path, datatype):
+        return self.make_layer(os.path.splitext(path)[0])
+
+    def test_findLayerByName_lists_once(self):
+        nt.assert_true(self.ezmd.findLayerByName('ZOI') is self.maplayers[0])
+        nt.assert_true(self.ezmd.findLayerByName('wetlands') is self.maplayers[1])
+        nt.assert_true(self.ezmd.findLayerByName('junk') is None)
+        nt.assert_equal(self.mapping['ListLayers'].call_count, 1)
+
+    def test_add_layers(self):
+        with mock.patch.object(utils, 'load_data', side_effect=self.load), \
+             mock.patch.object(arcpy, 'RefreshTOC') as toc, \
+             mock.patch.object(arcpy, 'RefreshActiveView') as view:
+            layers = self.ezmd.add_layers(['floods1.shp', 'floods2.shp', 'floods3.shp'])
+
+        nt.assert_list_equal([lyr.name for lyr in layers], ['floods1', 'floods2', 'floods3'])
+        nt.assert_list_equal([lyr.name for lyr in self.maplayers][:3], ['floods1', 'floods2', 'floods3'])
+        nt.assert_equal(toc.call_count, 1)
+        nt.assert_equal(view.call_count, 1)
+        nt.assert_equal(self.mapping['ListDataFrames'].call_count, 1)
+
+        # the index sees the new layers
+        nt.assert_true(self.ezmd.findLayerByName('floods2') is self.maplayers[1])
+
+    def test_add_layers_bottom(self):
+        with mock.patch.object(utils, 'load_data', side_effect=self.load):
+            self.ezmd.add_layers(['floods1.shp', 'floods2.shp'], position='bottom', refresh=False)
+            self.ezmd.add_layer('floods3.shp', position='bottom')
+
+        nt.assert_list_equal([lyr.name for lyr in self.maplayers][3:], ['floods1', 'floods2', 'floods3'])
+        nt.assert_equal(self.mapping['ListDataFrames'].call_count, 1)
+
+    @nt.raises(ValueError)
+    def test_bad_position(self):
+        self.ezmd.add_layers(['floods1.shp'], position='junk')
+
 class Test_Extension(object):
     def setup(self):
         self.known_available = 'spatial'
@@ -108,6 +265,72 @@ class Test_Extension(object):
         arcpy.CheckExtension(self.known_available)
 
 
+class Test_AnalysisSession(object):
+    def setup(self):
+        self.workspace = tempfile.mkdtemp()
+        self.patches = mock.patch.multiple(
+            arcpy,
+            CheckExtension=mock.Mock(return_value=u'Available'),
+            CheckOutExtension=mock.Mock(return_value=u'CheckedOut'),
+            CheckInExtension=mock.Mock(return_value=u'CheckedIn'),
+        )
+        self.patches.start()
+
+    def teardown(self):
+        self.patches.stop()
+        shutil.rmtree(self.workspace)
+
+    def test_extensions_checked_out_once(self):
+        with utils.AnalysisSession(self.workspace) as session:
+            nt.assert_true(session.has_extension('Spatial'))
+            for _ in range(3):
+                with utils.Extension('spatial') as status:
+                    nt.assert_equal(status, u'CheckedOut')
+
+            nt.assert_equal(arcpy.CheckOutExtension.call_count, 1)
+            nt.assert_equal(arcpy.CheckInExtension.call_count, 0)
+
+        arcpy.CheckInExtension.assert_called_once_with('spatial')
+
+    @nt.raises(RuntimeError)
+    def test_extension_not_available(self):
+        arcpy.CheckExtension.return_value = u'Unavailable'
+        with utils.AnalysisSession(self.workspace):
+            pass
+
+    def test_pins_and_restores_env(self):
+        with utils.WorkSpace('elsewhere'), utils.OverwriteState(False):
+            with utils.AnalysisSession(self.workspace) as session:
+                nt.assert_true(utils.AnalysisSession.active() is session)
+                nt.assert_equal(arcpy.env.workspace, self.workspace)
+                nt.assert_true(arcpy.env.overwriteOutput)
+                with utils.WorkSpace(self.workspace), utils.OverwriteState(True):
+                    nt.assert_equal(arcpy.env.workspace, self.workspace)
+
+            nt.assert_true(utils.AnalysisSession.active() is None)
+            nt.assert_equal(arcpy.env.workspace, 'elsewhere')
+            nt.assert_false(arcpy.env.overwriteOutput)
+
+    def test_owns_caches_and_scratch(self):
+        with utils.AnalysisSession(self.workspace, namespace='run1') as session:
+            nt.assert_true(utils.TempRegistry.active() is session.registry)
+            nt.assert_true(utils.DatasetCache.active() is session.cache)
+            nt.assert_true(utils.create_temp_filename('test', filetype='raster').endswith('_run1.tif'))
+            nt.assert_true(os.path.isdir(session.scratch))
+            scratch = session.scratch
+
+        nt.assert_true(utils.TempRegistry.active() is None)
+        nt.assert_true(utils.DatasetCache.active() is None)
+        nt.assert_false(os.path.exists(scratch))
+
+    def test_without_caches(self):
+        with utils.AnalysisSession(self.workspace, registry=False, cache=False,
+                                   scratch=False, extensions=[]) as session:
+            nt.assert_true(session.registry is None)
+            nt.assert_true(utils.DatasetCache.active() is None)
+            nt.assert_false(session.scratch)
+        nt.assert_equal(arcpy.CheckOutExtension.call_count, 0)
+
 class Test_OverwriteState(object):
     def test_true_true(self):
         arcpy.env.overwriteOutput = True
@@ -293,6 +516,194 @@ class Test_create_temp_filename():
             nt.assert_equal(temp_shape, known_shape)
 
 
+class Test_TempNamespace(object):
+    def setup(self):
+        self.workspace = os.path.join('some', 'folder')
+
+    def test_named(self):
+        with utils.WorkSpace(self.workspace), utils.TempNamespace('run1') as ns:
+            nt.assert_equal(ns, 'run1')
+            temp_raster = utils.create_temp_filename('test', filetype='raster', num=3)
+            nt.assert_equal(temp_raster, os.path.join(self.workspace, '_temp_test_3_run1.tif'))
+
+            temp_shape = utils.create_temp_filename('test', filetype='shape')
+            nt.assert_equal(temp_shape, os.path.join(self.workspace, '_temp_test_run1.shp'))
+
+        with utils.WorkSpace(self.workspace):
+            temp_raster = utils.create_temp_filename('test', filetype='raster', num=3)
+            nt.assert_equal(temp_raster, os.path.join(self.workspace, '_temp_test_3.tif'))
+
+    def test_nested(self):
+        with utils.WorkSpace(self.workspace), utils.TempNamespace('run1'):
+            with utils.TempNamespace('run1_w2'):
+                temp_raster = utils.create_temp_filename('test', filetype='raster', num=3)
+                nt.assert_equal(temp_raster, os.path.join(self.workspace, '_temp_test_3_run1_w2.tif'))
+
+            temp_raster = utils.create_temp_filename('test', filetype='raster', num=3)
+            nt.assert_equal(temp_raster, os.path.join(self.workspace, '_temp_test_3_run1.tif'))
+
+    def test_random_names_differ(self):
+        with utils.WorkSpace(self.workspace):
+            with utils.TempNamespace():
+                first = utils.create_temp_filename('test', filetype='raster', num=1)
+            with utils.TempNamespace():
+                second = utils.create_temp_filename('test', filetype='raster', num=1)
+        nt.assert_not_equal(first, second)
+
+    def test_removed_after_error(self):
+        with nt.assert_raises(ZeroDivisionError):
+            with utils.TempNamespace('run1'):
+                1 / 0
+        nt.assert_list_equal(utils._stack('namespaces'), [])
+
+    def test_only_in_thread(self):
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(list(utils._stack('namespaces'))))
+        with utils.TempNamespace('run1'):
+            thread.start()
+            thread.join()
+        nt.assert_list_equal(seen, [[]])
+
+class Test_TempRegistry(object):
+    def setup(self):
+        self.workspace = tempfile.mkdtemp()
+        self.existing = set()
+        self.locked = set()
+        self.calls = []
+
+    def teardown(self):
+        shutil.rmtree(self.workspace)
+
+    def fake_cleanup(self, *paths):
+        self.calls.append(paths)
+        for path in paths:
+            if path in self.locked:
+                raise IOError('{} is locked'.format(path))
+            self.existing.discard(path)
+
+    def patched(self):
+        return mock.patch.multiple(
+            utils,
+            cleanup_temp_results=mock.Mock(side_effect=self.fake_cleanup),
+            dataset_exists=mock.Mock(side_effect=lambda path: path in self.existing),
+        )
+
+    def manifests(self):
+        return [name for name in os.listdir(self.workspace)
+                if name.startswith(utils.TempRegistry.manifest_prefix)]
+
+    def create(self, name):
+        path = utils.create_temp_filename(name, filetype='raster')
+        self.existing.add(path)
+        return path
+
+    def test_records_temp_names(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            nt.assert_true(utils.TempRegistry.active() is None)
+            with utils.TempRegistry() as registry:
+                nt.assert_true(utils.TempRegistry.active() is registry)
+                path = self.create('test')
+                utils.create_temp_filename('output', filetype='shape', register=False)
+                nt.assert_list_equal(registry.paths, [path])
+
+                with open(registry.manifest) as manifest:
+                    nt.assert_in(path, manifest.read())
+
+            nt.assert_true(utils.TempRegistry.active() is None)
+
+    def test_deletes_leftovers(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            with utils.TempRegistry() as registry:
+                path = self.create('test')
+                self.create('other')
+
+        nt.assert_set_equal(self.existing, set())
+        nt.assert_list_equal(registry.paths, [])
+        nt.assert_list_equal(self.manifests(), [])
+
+    def test_deletes_leftovers_after_error(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            with nt.assert_raises(ZeroDivisionError):
+                with utils.TempRegistry():
+                    self.create('test')
+                    1 / 0
+
+        nt.assert_set_equal(self.existing, set())
+        nt.assert_list_equal(self.manifests(), [])
+
+    def test_deferred_in_batches(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            with utils.TempRegistry(batch_size=2) as registry:
+                paths = [self.create('test{}'.format(n)) for n in range(5)]
+                utils.defer_cleanup(*paths)
+                registry.flush()
+                nt.assert_set_equal(self.existing, set())
+                nt.assert_list_equal(registry.paths, [])
+
+        nt.assert_true(all(len(call) <= 2 for call in self.calls))
+        nt.assert_equal(sum(len(call) for call in self.calls), 5)
+
+    def test_deferred_when_batch_is_full(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            with utils.TempRegistry(batch_size=2) as registry:
+                paths = [self.create('test{}'.format(n)) for n in range(3)]
+                utils.defer_cleanup(paths[0])
+                nt.assert_list_equal(self.calls, [])
+                utils.defer_cleanup(paths[1])
+                nt.assert_list_equal(self.calls, [tuple(paths[:2])])
+                nt.assert_list_equal(registry.paths, paths[2:])
+
+    def test_unwritten_names_kept_until_close(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            with utils.TempRegistry() as registry:
+                unwritten = utils.create_temp_filename('later', filetype='raster')
+                path = self.create('test')
+                utils.defer_cleanup(path)
+                registry.flush()
+                nt.assert_list_equal(registry.paths, [unwritten])
+                with open(registry.manifest) as manifest:
+                    nt.assert_in(unwritten, manifest.read())
+
+                # written after the flush, and deleted on close
+                self.existing.add(unwritten)
+
+        nt.assert_set_equal(self.existing, set())
+        nt.assert_list_equal(registry.paths, [])
+        nt.assert_list_equal(self.manifests(), [])
+
+    def test_defer_cleanup_without_registry(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            utils.defer_cleanup('test.tif')
+        nt.assert_list_equal(self.calls, [('test.tif',)])
+
+    def test_failed_deletion_kept_in_manifest(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            with utils.TempRegistry() as registry:
+                path = self.create('test')
+                self.create('other')
+                self.locked.add(path)
+
+        nt.assert_list_equal(registry.paths, [path])
+        nt.assert_equal(len(registry.errors), 1)
+        nt.assert_list_equal(self.manifests(), [os.path.basename(registry.manifest)])
+
+    def test_sweeps_crashed_runs(self):
+        with self.patched(), utils.WorkSpace(self.workspace):
+            crashed = utils.TempRegistry().open()
+            path = self.create('test')
+            utils._stack('registries').remove(crashed)  # the process "dies"
+
+            with mock.patch.object(utils, '_process_alive', return_value=True):
+                utils.TempRegistry().open().close()
+            nt.assert_in(path, self.existing)
+
+            with mock.patch.object(utils, '_process_alive', return_value=False):
+                utils.TempRegistry().open().close()
+            nt.assert_not_in(path, self.existing)
+
+        nt.assert_list_equal(self.manifests(), [])
+
+
 class Test__check_fields(object):
     table = resource_filename("tidegates.testing.check_fields", "test_file.shp")
 
@@ -403,6 +814,110 @@ class Test_rasters_to_arrays(object):
             nt.assert_true(isinstance(a, numpy.ndarray))
             nptest.assert_array_almost_equal(a, kn)
 
+    def test_memmap(self):
+        folder = tempfile.mkdtemp()
+        try:
+            array = utils.rasters_to_arrays(self.rasterfile3, squeeze=True, memmap=folder)
+            nt.assert_true(isinstance(array, numpy.memmap))
+            nt.assert_equal(os.path.dirname(array.filename), folder)
+            nptest.assert_array_almost_equal(array, self.known_array3)
+            del array
+        finally:
+            shutil.rmtree(folder)
+
+    def test_memmap_tiled(self):
+        folder = tempfile.mkdtemp()
+        try:
+            with mock.patch.object(arcpy, 'RasterToNumPyArray', wraps=arcpy.RasterToNumPyArray) as r2n, \
+                 mock.patch.object(utils, 'TILE_SIZE', 2):
+                array = utils.rasters_to_arrays(self.rasterfile3, squeeze=True, memmap=folder)
+                nt.assert_equal(r2n.call_count, 6)
+            nptest.assert_array_almost_equal(array, self.known_array3)
+            del array
+        finally:
+            shutil.rmtree(folder)
+
+
+class Test_to_memmap(object):
+    def setup(self):
+        self.folder = tempfile.mkdtemp()
+        self.array = numpy.arange(12, dtype=numpy.float32).reshape(3, 4)
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def test_to_memmap(self):
+        memmapped = utils.to_memmap(self.array, folder=self.folder, name='topo')
+        nt.assert_true(isinstance(memmapped, numpy.memmap))
+        nt.assert_false(memmapped.flags.writeable)
+        nt.assert_true(os.path.basename(memmapped.filename).startswith('_temp_topo_'))
+        nptest.assert_array_equal(memmapped, self.array)
+        nptest.assert_array_equal(numpy.load(memmapped.filename), self.array)
+
+    def test_scratch_array(self):
+        array = utils.scratch_array((2, 5), numpy.int16, folder=os.path.join(self.folder, 'new'))
+        array[:] = 7
+        readonly = utils.readonly_memmap(array)
+        nt.assert_equal(readonly.dtype, numpy.int16)
+        nptest.assert_array_equal(readonly, numpy.full((2, 5), 7))
+
+    def test_flood_zones_readonly(self):
+        topo = self.array.copy()
+        topo[0, 0] = numpy.nan
+        topo = utils.to_memmap(topo, folder=self.folder)
+        zones = utils.to_memmap(numpy.ones((3, 4), dtype=numpy.int32), folder=self.folder)
+        flooded = utils.flood_zones(zones, topo, 5)
+        nptest.assert_array_equal(flooded, [[1, 1, 1, 1], [1, 1, 0, 0], [0, 0, 0, 0]])
+        nt.assert_true(numpy.isnan(topo[0, 0]))
+
+
+class Test_SharedArrays(object):
+    def setup(self):
+        self.folder = tempfile.mkdtemp()
+        self.array = numpy.arange(12, dtype=numpy.float32).reshape(3, 4)
+
+    def teardown(self):
+        shutil.rmtree(self.folder)
+
+    def test_publish_and_attach(self):
+        with utils.SharedArrays(folder=self.folder) as shared:
+            handle = shared.publish(self.array, 'topo')
+            nt.assert_true(handle.startswith(shared.folder))
+            attached = utils.SharedArrays.attach(handle)
+            nt.assert_true(isinstance(attached, numpy.memmap))
+            nt.assert_false(attached.flags.writeable)
+            nptest.assert_array_equal(attached, self.array)
+            folder = shared.folder
+            del attached
+
+        nt.assert_false(os.path.exists(folder))
+
+    def test_memmapped_not_copied(self):
+        memmapped = utils.to_memmap(self.array, folder=self.folder)
+        with utils.SharedArrays(folder=self.folder) as shared:
+            nt.assert_equal(shared.publish(memmapped), memmapped.filename)
+            nt.assert_list_equal(os.listdir(shared.folder), [shared.owner_file])
+
+    def test_not_arrays(self):
+        compact = utils.CompactArrays.from_arrays(self.array, numpy.ones((3, 4), dtype=int))
+        with utils.SharedArrays(folder=self.folder) as shared:
+            nt.assert_true(shared.publish(compact) is compact)
+        nt.assert_true(utils.SharedArrays.attach(compact) is compact)
+
+    @nt.raises(ValueError)
+    def test_publish_closed(self):
+        utils.SharedArrays(folder=self.folder).publish(self.array)
+
+    def test_sweep(self):
+        shared = utils.SharedArrays(folder=self.folder).open()
+        shared.publish(self.array)
+        nt.assert_list_equal(utils.SharedArrays.sweep(self.folder), [])
+
+        # pretend the owner crashed
+        with mock.patch.object(utils, '_process_alive', return_value=False):
+            nt.assert_list_equal(utils.SharedArrays.sweep(self.folder), [shared.folder])
+        nt.assert_false(os.path.exists(shared.folder))
+
 
 def test_array_to_raster():
     template_file = resource_filename("tidegates.testing.array_to_raster", 'test_raster2')
@@ -416,6 +931,72 @@ def test_array_to_raster():
     nt.assert_equal(raster.meanCellHeight, template.meanCellHeight)
 
 
+class Test_DatasetCache(object):
+    class FakeLayer(object):
+        isRasterLayer = False
+
+        def __init__(self, path):
+            self.dataSource = path
+
+    def setup(self):
+        self.fields = {'floods.shp': ['FID', 'GeoID']}
+        self.workspace = os.path.abspath(os.path.join('some', 'folder'))
+
+    def list_fields(self, table):
+        fields = []
+        for name in self.fields[os.path.basename(utils._result_path(table))]:
+            field = mock.Mock()
+            field.name = name
+            fields.append(field)
+        return fields
+
+    def add_field(self, in_table, field_name, **options):
+        self.fields[os.path.basename(in_table)].append(field_name)
+
+    def test_load_data(self):
+        with mock.patch.object(arcpy.mapping, 'Layer', self.FakeLayer), \
+             utils.WorkSpace(self.workspace):
+            with utils.DatasetCache() as cache:
+                first = utils.load_data('floods.shp', 'layer')
+                nt.assert_true(utils.load_data('floods.shp', 'layer') is first)
+                nt.assert_true(utils.load_data(os.path.join(self.workspace, 'floods.shp'), 'layer') is first)
+                nt.assert_false(utils.load_data('other.shp', 'layer') is first)
+                nt.assert_equal((cache.hits, cache.misses), (2, 2))
+
+            nt.assert_false(utils.load_data('floods.shp', 'layer') is first)
+
+    def test_check_fields(self):
+        with mock.patch.object(arcpy, 'ListFields', side_effect=self.list_fields) as lf, \
+             utils.DatasetCache():
+            utils._check_fields('floods.shp', 'GeoID', should_exist=True)
+            utils._check_fields('floods.shp', 'GeoID', 'FID', should_exist=True)
+            utils._check_fields(self.FakeLayer('floods.shp'), 'area', should_exist=False)
+            nt.assert_equal(lf.call_count, 1)
+
+    def test_add_field_invalidates(self):
+        with mock.patch.object(arcpy, 'ListFields', side_effect=self.list_fields), \
+             mock.patch.object(arcpy.management, 'AddField', side_effect=self.add_field), \
+             utils.DatasetCache():
+            utils._check_fields('floods.shp', 'area', should_exist=False)
+            utils.add_field_with_value('floods.shp', 'area', field_type='DOUBLE')
+            utils._check_fields('floods.shp', 'area', should_exist=True)
+
+    def test_delete_invalidates(self):
+        with mock.patch.object(arcpy.mapping, 'Layer', self.FakeLayer), \
+             mock.patch.object(arcpy.management, 'Delete'), \
+             utils.WorkSpace(self.workspace), utils.DatasetCache():
+            first = utils.load_data('floods.shp', 'layer')
+            utils.cleanup_temp_results('floods.shp')
+            nt.assert_false(utils.load_data('floods.shp', 'layer') is first)
+
+    def test_writes_invalidate(self):
+        write = utils._writes_output(lambda path: self.FakeLayer(path))
+        with mock.patch.object(arcpy.mapping, 'Layer', self.FakeLayer), \
+             utils.DatasetCache():
+            first = utils.load_data('floods.shp', 'layer')
+            write('floods.shp')
+            nt.assert_false(utils.load_data('floods.shp', 'layer') is first)
+
 class Test_load_data(object):
     rasterpath = resource_filename("tidegates.testing.load_data", 'test_dem.tif')
     vectorpath = resource_filename("tidegates.testing.load_data", 'test_wetlands.shp')
@@ -645,6 +1226,122 @@ def test_mask_array_with_flood():
     nptest.assert_array_almost_equal(flooded, known_flooded)
 
 
+class Test_flood_zones_levels(object):
+    def setup(self):
+        self.zones = numpy.array([
+            [0, 1, 1, 2],
+            [1, 1, 2, 2],
+            [3, 3, 2, 0],
+        ])
+        self.topo = numpy.array([
+            [0., 1., 2., 3.],
+            [1., 2., 3., 4.],
+            [2., 3., 4., 5.],
+        ])
+        self.known = numpy.array([
+            [0, 1, 0, 2],
+            [1, 0, 2, 2],
+            [0, 0, 2, 0],
+        ])
+
+    def test_mapping(self):
+        flooded = utils.flood_zones(self.zones, self.topo, {1: 1.5, 2: 4.0})
+        nptest.assert_array_equal(flooded, self.known)
+
+    def test_vector(self):
+        levels = numpy.array([0, 1.5, 4.0, -1])
+        flooded = utils.flood_zones(self.zones, self.topo, levels)
+        nptest.assert_array_equal(flooded, self.known)
+
+    def test_surface(self):
+        surface = numpy.array([
+            [9., 1.5, 1.5, 4.],
+            [1.5, 1.5, 4., 4.],
+            [0., 0., 4., 9.],
+        ])
+        flooded = utils.flood_zones(self.zones, self.topo, surface)
+        nptest.assert_array_equal(flooded, self.known)
+
+    def test_batch_of_mappings(self):
+        flooded = utils.flood_zones(self.zones, self.topo, [{1: 1.5, 2: 4.0}, {3: 9.0}])
+        nt.assert_tuple_equal(flooded.shape, (2, 3, 4))
+        nptest.assert_array_equal(flooded[0], self.known)
+        nptest.assert_array_equal(flooded[1], numpy.where(self.zones == 3, 3, 0))
+
+    def test_batch_of_vectors(self):
+        levels = numpy.array([[0, 1.5, 4.0, -1], [0, 9, 9, 9]])
+        flooded = utils.flood_zones(self.zones, self.topo, levels)
+        nptest.assert_array_equal(flooded[0], self.known)
+        nptest.assert_array_equal(flooded[1], self.zones)
+
+    def test_batch_matches_scalars(self):
+        levels = numpy.array([[1.0] * 4, [3.0] * 4])
+        flooded = utils.flood_zones(self.zones, self.topo, levels)
+        for n, level in enumerate([1.0, 3.0]):
+            nptest.assert_array_equal(flooded[n], utils.flood_zones(self.zones, self.topo, level))
+
+    @nt.raises(ValueError)
+    def test_short_vector(self):
+        utils.flood_zones(self.zones, self.topo, numpy.array([0, 1.5, 4.0]))
+
+
+class Test_CompactArrays(object):
+    def setup(self):
+        random = numpy.random.RandomState(0)
+        self.topo = random.uniform(-1, 5, size=(30, 40))
+        self.topo[0, :5] = numpy.nan
+        self.topo[1, :5] = -999
+        self.zones = numpy.zeros((30, 40), dtype=numpy.int64)
+        self.zones[:, 5:15] = 12
+        self.zones[:, 15:30] = 300
+        self.zones[:, 30:] = 7
+        self.zones[:2, :5] = 12
+        self.compact = utils.CompactArrays.from_arrays(self.topo, self.zones)
+
+    def test_dtypes(self):
+        nt.assert_equal(self.compact.topo.dtype, numpy.float32)
+        nt.assert_equal(self.compact.codes.dtype, numpy.uint8)
+        nt.assert_equal(self.compact.zone_ids.dtype, numpy.uint16)
+        nptest.assert_array_equal(self.compact.zone_ids, [7, 12, 300])
+        nptest.assert_array_equal(numpy.unique(self.compact.codes), [0, 1, 2, 3])
+        nt.assert_true(self.compact.nbytes * 3 < self.topo.nbytes + self.zones.nbytes)
+
+    def test_valid(self):
+        valid = self.compact.valid
+        nt.assert_equal(valid.dtype, bool)
+        nt.assert_equal((~valid).sum(), 10)
+        nt.assert_false(valid[0, 0] or valid[1, 4])
+
+    def test_to_arrays(self):
+        topo, zones = self.compact.to_arrays()
+        nptest.assert_array_equal(zones, self.zones)
+        expected = numpy.where(numpy.isnan(self.topo), -999, self.topo)
+        nptest.assert_array_almost_equal(topo, expected, decimal=5)
+
+    def _check(self, elevation):
+        known = utils.flood_zones(self.zones, self.topo, elevation)
+        flooded = utils.flood_zones(self.compact, None, elevation)
+        nptest.assert_array_equal(flooded, known)
+        return flooded
+
+    def test_flood_zones_scalar(self):
+        flooded = self._check(2.0)
+        nt.assert_true((flooded[:2, :5] == 12).all())
+
+    def test_flood_zones_mapping(self):
+        self._check({12: 0.5, 300: 3.5})
+
+    def test_flood_zones_batches(self):
+        levels = numpy.zeros((3, 301))
+        levels[:, [7, 12, 300]] = [[1, 2, 3], [3, 2, 1], [4, 4, 4]]
+        flooded = self._check(levels)
+        nt.assert_tuple_equal(flooded.shape, (3, 30, 40))
+        self._check([{7: 1.0}, {300: 2.0}])
+
+    def test_flood_zones_surface(self):
+        self._check(numpy.linspace(0, 4, 40)[None, :].repeat(30, axis=0))
+
+
 class Test_add_field_with_value(object):
     def setup(self):
         self.shapefile = resource_filename("tidegates.testing.add_field_with_value", 'field_adder.shp')
@@ -1020,3 +1717,26 @@ def test_join_results_to_baseline():
 
     utils.cleanup_temp_results(test)
 
+
+@nptest.dec.skipif(not tgtest.has_fiona)
+def test_join_results_to_baseline_keyed():
+    known = resource_filename('tidegates.testing.join_results', 'known_join_keyed.shp')
+    with utils.OverwriteState(True):
+        test = utils.join_results_to_baseline(
+            resource_filename('tidegates.testing.join_results', 'test_join_keyed.shp'),
+            resource_filename('tidegates.testing.join_results', 'merge_join_keyed.shp'),
+            resource_filename('tidegates.testing.join_results', 'merge_baseline.shp')
+        )
+    nt.assert_true(isinstance(test, arcpy.mapping.Layer))
+    tgtest.assert_shapefiles_are_close(test.dataSource, known)
+
+    utils.cleanup_temp_results(test)
+
+
+def test_source_id_field():
+    baseline = resource_filename('tidegates.testing.join_results', 'merge_baseline.shp')
+    keyed = resource_filename('tidegates.testing.join_results', 'merge_join_keyed.shp')
+    results = resource_filename('tidegates.testing.join_results', 'merge_join.shp')
+    nt.assert_equal(utils.source_id_field(keyed, baseline), 'FID_merge_')
+    nt.assert_true(utils.source_id_field(results, baseline) is None)
+
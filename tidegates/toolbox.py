@@ -16,11 +16,15 @@ import os
 from textwrap import dedent
 from collections import OrderedDict
 
-import arcpy
+from tidegates._lazy import arcpy
 import numpy
 
 import tidegates
 from tidegates import utils
+from tidegates import engine
+from tidegates import pipeline
+from tidegates import profiling
+from tidegates import backends
 
 
 # ALL ELEVATIONS IN FEET
@@ -31,6 +35,62 @@ SURGES['50yr'] = 9.6
 SURGES['100yr'] = 10.5
 
 
+def _flood_elevation(elev=None, surge=None, slr=None):
+    """ The flood elevation (in feet) of a custom elevation or of a
+    storm surge and sea level rise.
+
+    """
+
+    if elev is None:
+        return float(slr + SURGES[surge])
+    return float(elev)
+
+
+def _register_outputs(paths):
+    """ Records the outputs of a scenario with the run's
+    :class:`tidegates.utils.TempRegistry` (if any), so that they are
+    deleted if the run fails before they are merged. They're made with
+    ``register=False`` because the worker processes' own registries
+    would delete them before the run merges them.
+
+    """
+
+    registry = utils.TempRegistry.active()
+    if registry is not None:
+        for path in paths:
+            if path is not None:
+                registry.add(path)
+    return paths
+
+
+# selection layers of the assets that intersect the largest flood of a
+# run, by (assets, extent), so that each process selects them once
+_candidate_layers = {}
+
+
+def _candidates(assets, extent):
+    """ The layer of ``assets`` in which the features that intersect
+    ``extent`` are selected (see
+    :func:`tidegates.utils.select_intersecting`).
+
+    """
+
+    key = (assets, extent)
+    if key not in _candidate_layers:
+        _candidate_layers[key] = utils.select_intersecting(assets, extent)
+    return _candidate_layers[key]
+
+
+def _release_candidates(extent):
+    """ Forgets the layers that :func:`_candidates` selected with
+    ``extent``.
+
+    """
+
+    for key in [key for key in _candidate_layers if key[1] == extent]:
+        del _candidate_layers[key]
+
+
 class StandardScenarios(object):
     """ ArcGIS Python toolbox to analyze floods during the standard sea
     level rise and storm surge scenarios.
@@ -236,8 +296,10 @@ class StandardScenarios(object):
 
         Parameters
         ----------
-        layerfile : str
-            Path to the layer or raster that will be added
+        layerfile : str or list of str
+            Path to the layer or raster that will be added. Lists of
+            paths are added all at once (see
+            :meth:`tidegates.utils.EasyMapDoc.add_layers`).
         mxd : str, optional
             Path to an ESRI mapdocument.
 
@@ -251,7 +313,10 @@ class StandardScenarios(object):
             mxd = 'CURRENT'
         ezmd = utils.EasyMapDoc(mxd)
         if ezmd.mapdoc is not None:
-            ezmd.add_layer(layerfile)
+            if isinstance(layerfile, (list, tuple)):
+                ezmd.add_layers(layerfile)
+            else:
+                ezmd.add_layer(layerfile)
 
         return ezmd
 
@@ -373,11 +438,10 @@ class StandardScenarios(object):
             output will be saved.
 
         """
+        elevation = _flood_elevation(elev=elev, surge=surge, slr=slr)
         if elev is None:
-            elevation = float(slr + SURGES[surge])
             title = "Analyzing flood elevation: {} ft ({}, {})".format(elevation, surge, slr)
         else:
-            elevation = float(elev)
             title = "Analyzing flood elevation: {} ft".format(elevation)
 
         if flood_output is None:
@@ -385,7 +449,8 @@ class StandardScenarios(object):
 
         basename, ext = os.path.splitext(flood_output)
         _temp_fname = basename + str(elevation).replace('.', '_') + ext
-        temp_fname = utils.create_temp_filename(_temp_fname, num=num, prefix='', filetype='shape')
+        temp_fname = utils.create_temp_filename(_temp_fname, num=num, prefix='', filetype='shape',
+                                                register=False)
 
         return elevation, title, temp_fname
 
@@ -618,17 +683,20 @@ class StandardScenarios(object):
 
         return scenario_list
 
+    @profiling.traced()
     def analyze(self, topo_array, zones_array, template,
-                elev=None, surge=None, slr=None, num=0, **params):
+                elev=None, surge=None, slr=None, num=0,
+                flooded_raster=None, **params):
         """ Tool-agnostic helper function for :meth:`.main_execute`.
 
         Parameters
         ----------
         topo_array : numpy array
             Floating point array of the digital elevation model.
-        zones_array : numpy array
+        zones_array : numpy array or tidegates.utils.CompactArrays
             Categorical (integer) array of where each non-zero value
-            delineates a tidegate's zone of influence.
+            delineates a tidegate's zone of influence, or the compacted
+            zones and DEM (in which case ``topo_array`` is ignored).
         template : arcpy.Raster or tidegates.utils.RasterTemplate
             A raster or raster-like object that define the spatial
             extent of the analysis area. Required attributes are:
@@ -642,6 +710,9 @@ class StandardScenarios(object):
         surge : str, optional
             The name of the storm surge associated with the scenario
             (e.g., MHHW, 100yr).
+        flooded_raster : arcpy.Raster, optional
+            Raster of the flooded zones made ahead of time with
+            :func:`tidegates.analysis.flood_raster`.
         **params : keyword arguments
             Keyword arguments of analysis parameters generated by
             `self._get_parameter_values`
@@ -667,6 +738,19 @@ class StandardScenarios(object):
         self._show_header(title)
 
         # run the scenario and add its info the output attribute table
+        self._flood_scenario(topo_array, zones_array, template, elev, surge, slr, num,
+                             floods_path, flooded_raster=flooded_raster, **params)
+
+        # asses impacts due to flooding
+        return self._assess_scenario(floods_path, elev, surge, slr, num, **params)
+
+    def _flood_scenario(self, topo_array, zones_array, template, elev, surge,
+                        slr, num, floods_path, flooded_raster=None, **params):
+        """ Saves the flooded zones of a scenario to ``floods_path``
+        and adds the scenario's columns to them.
+
+        """
+
         flooded_zones = tidegates.flood_area(
             topo_array=topo_array,
             zones_array=zones_array,
@@ -675,22 +759,40 @@ class StandardScenarios(object):
             elevation_feet=elev,
             filename=floods_path,
             num=num,
+            flooded_raster=flooded_raster,
             verbose=True,
             asMessage=True
         )
         self._add_scenario_columns(flooded_zones.dataSource, elev=elev, surge=surge, slr=slr)
+        return flooded_zones
+
+    def _assess_scenario(self, floods_path, elev, surge, slr, num, **params):
+        """ Intersects the flooded zones of a scenario with the
+        wetlands and buildings and returns the layers of
+        :meth:`.analyze`.
+
+        """
 
         # setup temporary files for impacted wetlands and buildings
-        wl_path = utils.create_temp_filename(floods_path, prefix="_wetlands_", filetype='shape', num=num)
-        bldg_path = utils.create_temp_filename(floods_path, prefix="_buildings_", filetype='shape', num=num)
+        wl_path = utils.create_temp_filename(floods_path, prefix="_wetlands_", filetype='shape', num=num,
+                                             register=False)
+        bldg_path = utils.create_temp_filename(floods_path, prefix="_buildings_", filetype='shape', num=num,
+                                               register=False)
+
+        # only the assets that the run's largest flood reaches, if known
+        assets = {}
+        extent = params.get('prefilter_extent', None)
+        for name in ('wetlands', 'buildings'):
+            assets[name] = params.get(name, None)
+            if assets[name] is not None and extent is not None:
+                assets[name] = _candidates(assets[name], extent)
 
-        # asses impacts due to flooding
         fldlyr, wtlndlyr, blgdlyr = tidegates.assess_impact(
             floods_path=floods_path,
             flood_idcol=params['ID_column'],
-            wetlands_path=params.get('wetlands', None),
+            wetlands_path=assets['wetlands'],
             wetlands_output=wl_path,
-            buildings_path=params.get('buildings', None),
+            buildings_path=assets['buildings'],
             buildings_output=bldg_path,
             cleanup=False,
             verbose=True,
@@ -716,8 +818,9 @@ class StandardScenarios(object):
             buildings, respectively, that will be merged and deleted.
         sourcename : str, optional
             Path to the original source file of the results. If
-            provided, its attbutes will be spatially joined to the
-            concatenated results.
+            provided, its attbutes will be joined to the concatenated
+            results (see
+            :func:`tidegates.utils.join_results_to_baseline`).
 
         Returns
         -------
@@ -737,14 +840,244 @@ class StandardScenarios(object):
                     utils.load_data(tmp_fname, 'layer'),
                     utils.load_data(sourcename, 'layer')
                 )
-                utils.cleanup_temp_results(tmp_fname)
+                utils.defer_cleanup(tmp_fname)
 
             else:
                 utils.concat_results(outputname, *results)
 
         if cleanup:
-            utils.cleanup_temp_results(*results)
+            utils.defer_cleanup(*results)
+
+    def _prefilter_assets(self, topo_array, zones_array, template, scenarios,
+                          filename=None, **params):
+        """ Selects the wetlands and buildings that the largest flood
+        of the scenarios intersects (see
+        :func:`tidegates.analysis.prefilter_assets`) and returns the
+        path to the polygons of that flood (or None if there are no
+        assets). This goes in the ``prefilter_extent`` parameter of
+        :meth:`._assess_scenario`, which uses the selected layers
+        (selecting them again in other processes).
+
+        """
+
+        names = [name for name in ('wetlands', 'buildings') if params.get(name) is not None]
+        if not names or not scenarios:
+            return None
+
+        elevation = max(
+            _flood_elevation(elev=s['elev'], surge=s['surge_name'], slr=s['slr'])
+            for s in scenarios
+        )
+        extent, candidates = tidegates.prefilter_assets(
+            topo_array, zones_array, template, elevation,
+            [params[name] for name in names],
+            filename=filename,
+            verbose=True,
+            asMessage=True,
+        )
+
+        extent = extent.dataSource
+        for name, layer in zip(names, candidates):
+            _candidate_layers[(params[name], extent)] = layer
+        return extent
+
+    def _analyze_scenario(self, topo_array, zones_array, template, num,
+                          scenario, flooded_raster=None, **params):
+        """ Analyzes a single scenario from :meth:`.make_scenarios` and
+        returns the paths to its floods, flooded wetlands, and flooded
+        buildings (or None).
+
+        """
+
+        layers = self.analyze(
+            topo_array=topo_array,
+            zones_array=zones_array,
+            template=template,
+            elev=scenario['elev'],
+            surge=scenario['surge_name'],
+            slr=scenario['slr'],
+            num=num,
+            flooded_raster=flooded_raster,
+            **params
+        )
+
+        return tuple(None if lyr is None else lyr.dataSource for lyr in layers)
+
+    def _analyze_sequentially(self, topo_array, zones_array, template,
+                              scenarios, **params):
+        """ Analyzes the scenarios one after the other with
+        :meth:`._analyze_scenario`.
+
+        """
+
+        return [
+            _register_outputs(self._analyze_scenario(topo_array, zones_array, template,
+                                                     num, scenario, **params))
+            for num, scenario in enumerate(scenarios)
+        ]
+
+    def _analyze_pipelined(self, topo_array, zones_array, template,
+                           scenarios, **params):
+        """ Analyzes the scenarios with a
+        :class:`tidegates.pipeline.Pipeline` so that the next scenario
+        is flooded (with numpy) while the raster, flood polygons, and
+        impacts of the current one are made.
+
+        Geoprocessing tools (and ``arcpy.env``) aren't thread-safe, so
+        everything but flooding the arrays happens in a single thread,
+        one scenario at a time. The returned paths are in the same
+        order as ``scenarios``.
+
+        """
+
+        def flood(job):
+            elev = _flood_elevation(elev=job['scenario']['elev'], surge=job['surge'],
+                                    slr=job['slr'])
+            job['array'] = tidegates.flood_array(topo_array, zones_array, elev)
+            return job
+
+        def analyze(job):
+            elev, title, floods_path = self._prep_flooder_input(
+                flood_output=params['flood_output'],
+                elev=job['scenario']['elev'],
+                surge=job['surge'],
+                slr=job['slr'],
+                num=job['num'],
+            )
+            self._show_header(title)
+
+            outfile = utils.create_temp_filename('floods_raster', filetype='raster', num=job['num'])
+            raster = utils.array_to_raster(
+                array=job.pop('array'),
+                template=template,
+                outfile=outfile,
+                tiled=True,
+                compress='LZW',
+                msg='Converting flooded array to a raster dataset',
+                verbose=True,
+                asMessage=True
+            )
+            self._flood_scenario(topo_array, zones_array, template, elev, job['surge'],
+                                 job['slr'], job['num'], floods_path,
+                                 flooded_raster=raster, **params)
+            layers = self._assess_scenario(floods_path, elev, job['surge'], job['slr'],
+                                           job['num'], **params)
+            return _register_outputs(tuple(None if lyr is None else lyr.dataSource
+                                            for lyr in layers))
+
+        jobs = [
+            dict(num=num, scenario=scenario, surge=scenario['surge_name'], slr=scenario['slr'])
+            for num, scenario in enumerate(scenarios)
+        ]
+
+        stages = [
+            pipeline.Stage('flood', flood),
+            pipeline.Stage('analyze', analyze),
+        ]
+        return pipeline.Pipeline(stages, maxsize=1).run(jobs)
+
+    def _analyze_in_parallel(self, topo_array, zones_array, template,
+                             scenarios, jobs, **params):
+        """ Divides the scenarios among ``jobs`` worker processes.
+
+        The arrays are published once with :class:`tidegates.utils.SharedArrays`
+        and each worker maps the same files (when it starts) instead of
+        receiving a copy. The workers then run :meth:`._analyze_scenario`
+        in the current workspace. The shared files are deleted once the
+        workers are done. The returned paths are in the same order as
+        ``scenarios``.
+
+        """
+
+        import multiprocessing
+
+        if not isinstance(template, utils.RasterTemplate):
+            template = utils.RasterTemplate.from_raster(template)
+        tasks = [(num, scenario, params) for num, scenario in enumerate(scenarios)]
+
+        with utils.SharedArrays() as shared:
+            initargs = (type(self), shared.publish(topo_array, 'topo'),
+                        shared.publish(zones_array, 'zones'), template,
+                        backends.env().workspace, backends.get_backend().name,
+                        (utils._stack('namespaces') or [None])[-1])
+
+            pool = multiprocessing.Pool(jobs, initializer=_init_worker, initargs=initargs)
+            try:
+                results = [_register_outputs(paths)
+                           for paths in pool.imap(_run_worker_task, tasks, chunksize=1)]
+            finally:
+                pool.close()
+                pool.join()
+
+        return results
+
+    def merge_results(self, results, **params):
+        """ Merges the output of all of the scenarios into the final
+        flood, wetland, and building outputs with
+        :meth:`.finish_results`.
+
+        Parameters
+        ----------
+        results : list of tuples
+            The paths (or None) to the floods, flooded wetlands, and
+            flooded buildings of each scenario, as returned by
+            :meth:`._analyze_scenario`.
+        **params : keyword arguments
+            Keyword arguments of analysis parameters generated by
+            :meth:`._get_parameter_values`
+
+        Returns
+        -------
+        None
+
+        """
+
+        wetlands = params.get('wetlands', None)
+        buildings = params.get('buildings', None)
+
+        all_floods = [r[0] for r in results]
+        all_wetlands = [r[1] for r in results if r[1] is not None]
+        all_buildings = [r[2] for r in results if r[2] is not None]
+
+        self.finish_results(
+            params['flood_output'],
+            all_floods,
+            msg="Merging and cleaning up all flood results",
+            verbose=True,
+            asMessage=True,
+        )
 
+        if wetlands is not None:
+            wtld_output = params.get(
+                'wetland_output',
+                utils.create_temp_filename(params['wetlands'], prefix='output_', filetype='shape',
+                                           register=False)
+            )
+            self.finish_results(
+                wtld_output,
+                all_wetlands,
+                sourcename=params['wetlands'],
+                msg="Merging and cleaning up all wetlands results",
+                verbose=True,
+                asMessage=True,
+            )
+
+        if buildings is not None:
+            bldg_output = params.get(
+                'building_output',
+                utils.create_temp_filename(params['buildings'], prefix='output_', filetype='shape',
+                                           register=False)
+            )
+            self.finish_results(
+                bldg_output,
+                all_buildings,
+                sourcename=params['buildings'],
+                msg="Merging and cleaning up all buildings results",
+                verbose=True,
+                asMessage=True,
+            )
+
+    @profiling.traced()
     def main_execute(self, **params):
         """ Performs the flood-impact analysis on multiple flood
         elevations.
@@ -774,6 +1107,34 @@ class StandardScenarios(object):
         wetland_output, building_output : str, optional
             Filenames where the flooded wetlands and building footprints
             will be saved.
+        trace : str, optional
+            Path to a JSON file where a Chrome trace of the run's
+            spans will be saved (see :mod:`tidegates.profiling`).
+        jobs : int, optional (1)
+            Number of worker processes among which the scenarios will
+            be divided.
+        cache : str, optional
+            Folder in which the DEM and zones are cached as arrays (see
+            :func:`tidegates.analysis.process_dem_and_zones`).
+        memmap : bool or str, optional
+            Keep the DEM and zones arrays in memory-mapped files in the
+            run's scratch folder (or the given folder) instead of in
+            memory. Worker processes map the same files (arrays held in
+            memory are written to shared files for them once, see
+            :class:`tidegates.utils.SharedArrays`).
+        compact : bool, optional
+            Hold the DEM and zones as :class:`tidegates.utils.CompactArrays`
+            (float32 elevations, narrow zone codes, and a bit-packed
+            validity mask) instead of the full arrays.
+        prefilter : bool, optional (False)
+            Intersect the floods of each scenario with only the
+            wetlands and buildings that the largest flood of the run
+            intersects, instead of the full layers (see
+            :func:`tidegates.analysis.prefilter_assets`).
+        pipelined : bool, optional (False)
+            With a single job, flood the array of the next scenario in
+            a background thread while the current one is analyzed
+            (see :class:`tidegates.pipeline.Pipeline`).
 
         Returns
         -------
@@ -781,74 +1142,177 @@ class StandardScenarios(object):
 
         """
 
-        wetlands = params.get('wetlands', None)
-        buildings = params.get('buildings', None)
+        trace = params.pop('trace', None)
+        if trace is not None:
+            with profiling.Tracer(trace):
+                return self.main_execute(**params)
 
-        all_floods = []
-        all_wetlands = []
-        all_buildings = []
+        jobs = int(params.pop('jobs', None) or 1)
+        cache = params.pop('cache', None)
+        memmap = params.pop('memmap', False)
+        compact = params.pop('compact', False)
+        prefilter = params.pop('prefilter', False)
+        pipelined = params.pop('pipelined', False)
 
-        with utils.WorkSpace(params['workspace']), utils.OverwriteState(True):
+        with utils.AnalysisSession(params['workspace']) as session:
 
             topo_array, zones_array, template = tidegates.process_dem_and_zones(
                 dem=params['dem'],
                 zones=params['zones'],
-                ID_column=params['ID_column']
+                ID_column=params['ID_column'],
+                cache=cache,
+                memmap=session.scratch if memmap is True else memmap,
             )
+            if compact:
+                zones_array = utils.CompactArrays.from_arrays(topo_array, zones_array)
+                topo_array = None
+
+            scenarios = self.make_scenarios(**params)
+            extent = None
+            if prefilter:
+                extent = self._prefilter_assets(topo_array, zones_array, template,
+                                                scenarios, **params)
+
+            try:
+                if jobs > 1:
+                    results = self._analyze_in_parallel(topo_array, zones_array, template,
+                                                        scenarios, jobs, prefilter_extent=extent,
+                                                        **params)
+                elif pipelined:
+                    results = self._analyze_pipelined(topo_array, zones_array, template,
+                                                      scenarios, prefilter_extent=extent, **params)
+                else:
+                    results = self._analyze_sequentially(topo_array, zones_array, template,
+                                                         scenarios, prefilter_extent=extent,
+                                                         **params)
+            finally:
+                _release_candidates(extent)
+
+            self.merge_results(results, **params)
+
+    @profiling.traced()
+    def zone_statistics(self, realizations=0, sigma=0.15, ead=False, cache=None,
+                        **params):
+        """ Computes the flooded area, flooded wetland area, and number
+        of impacted buildings of the scenarios with the batched engine
+        (see :mod:`tidegates.engine`) instead of geoprocessing each
+        flood. No datasets are saved.
 
-            for num, scenario in enumerate(self.make_scenarios(**params)):
-                fldlyr, wtlndlyr, blgdlyr = self.analyze(
-                    topo_array=topo_array,
-                    zones_array=zones_array,
-                    template=template,
-                    elev=scenario['elev'],
-                    surge=scenario['surge_name'],
-                    slr=scenario['slr'],
-                    num=num,
-                    **params
-                )
-                all_floods.append(fldlyr.dataSource)
-                if wetlands is not None:
-                    all_wetlands.append(wtlndlyr.dataSource)
+        Parameters
+        ----------
+        realizations : int, optional (0)
+            Number of DEMs perturbed with vertical errors (see
+            :func:`tidegates.engine.ensemble`) whose statistics are
+            summarized as percentiles.
+        sigma : float, optional (0.15)
+            Standard deviation of the vertical errors of the DEM (in
+            the units of the DEM).
+        ead : bool, optional (False)
+            Also integrate the statistics over the return periods of
+            the storm surges, for each sea level rise (see
+            :func:`tidegates.engine.expected_annual_damage`).
+        cache : str, optional
+            See :meth:`.main_execute`.
+        **params : keyword arguments
+            The workspace, dem, zones, ID_column, (optional) wetlands,
+            buildings, and elevation parameters of
+            :meth:`.main_execute`.
 
-                if buildings is not None:
-                    all_buildings.append(blgdlyr.dataSource)
+        Returns
+        -------
+        stats : OrderedDict
+            "scenarios" holds, for each scenario of
+            :meth:`.make_scenarios`, its flood elevation (ft), surge,
+            and sea level rise, the total of each statistic over the
+            zones ("area", "wetlands", and "buildings", with areas in
+            the squared units of the DEM), and, with ``realizations``,
+            the 5th, 50th, and 95th percentiles of each total (e.g.,
+            "buildings_percentiles"). Buildings are counted from their
+            rasterized footprints (see :func:`tidegates.analysis.zone_index`).
+            With ``ead``, "ead" holds the expected annual value of each
+            total for each sea level rise (ft).
 
-            self.finish_results(
-                params['flood_output'],
-                all_floods,
-                msg="Merging and cleaning up all flood results",
+        """
+
+        with utils.AnalysisSession(params['workspace']):
+            topo_array, zones_array, template = tidegates.process_dem_and_zones(
+                dem=params['dem'],
+                zones=params['zones'],
+                ID_column=params['ID_column'],
+                cache=cache,
+            )
+            index = tidegates.zone_index(
+                topo_array, zones_array, template,
+                wetlands=params.get('wetlands'),
+                buildings=params.get('buildings'),
                 verbose=True,
                 asMessage=True,
             )
 
-            if wetlands is not None:
-                wtld_output = params.get(
-                    'wetland_output',
-                    utils.create_temp_filename(params['wetlands'], prefix='output_', filetype='shape')
-                )
-                self.finish_results(
-                    wtld_output,
-                    all_wetlands,
-                    sourcename=params['wetlands'],
-                    msg="Merging and cleaning up all wetlands results",
-                    verbose=True,
-                    asMessage=True,
-                )
+        scenarios = self.make_scenarios(**params)
+        elevations = [
+            _flood_elevation(elev=s['elev'], surge=s['surge_name'], slr=s['slr'])
+            for s in scenarios
+        ]
+        levels = numpy.array(elevations) * tidegates.analysis.METERS_PER_FOOT
 
-            if buildings is not None:
-                bldg_output = params.get(
-                    'building_output',
-                    utils.create_temp_filename(params['buildings'], prefix='output_', filetype='shape')
-                )
-                self.finish_results(
-                    bldg_output,
-                    all_buildings,
-                    sourcename=params['buildings'],
-                    msg="Merging and cleaning up all buildings results",
-                    verbose=True,
-                    asMessage=True,
-                )
+        totals = OrderedDict(
+            (name, values.sum(axis=-1)) for name, values in index.impacts(levels).items()
+        )
+        bands = None
+        if realizations:
+            bands = engine.ensemble(index, levels, realizations=realizations, sigma=sigma).totals()
+
+        stats = OrderedDict()
+        stats['scenarios'] = []
+        for n, scenario in enumerate(scenarios):
+            row = OrderedDict([
+                ('elevation', elevations[n]),
+                ('surge', scenario['surge_name']),
+                ('slr', None if scenario['slr'] is None else float(scenario['slr'])),
+            ])
+            for name, values in totals.items():
+                row[name] = values[n].item()
+                if bands is not None:
+                    row[name + '_percentiles'] = bands[name][:, n].tolist()
+            stats['scenarios'].append(row)
+
+        if ead:
+            damages = engine.expected_annual_damage(index).totals()
+            stats['ead'] = []
+            for n, slr in enumerate(SEALEVELRISE):
+                row = OrderedDict([('slr', float(slr))])
+                for name, values in damages.items():
+                    row[name] = values[n].item()
+                stats['ead'].append(row)
+
+        return stats
+
+
+# state of the worker processes used by `_analyze_in_parallel`
+_worker = {}
+
+
+def _init_worker(toolclass, topo_array, zones_array, template, workspace, backend,
+                 namespace=None): # pragma: no cover
+    backends.set_backend(backend)
+    _worker['tbx'] = toolclass()
+    _worker['arrays'] = (utils.SharedArrays.attach(topo_array),
+                         utils.SharedArrays.attach(zones_array), template)
+    _worker['workspace'] = workspace
+
+    # the run's namespace, made unique to this worker
+    _worker['namespace'] = '_'.join(str(n) for n in (namespace, os.getpid()) if n is not None)
+
+
+def _run_worker_task(task): # pragma: no cover
+    num, scenario, params = task
+    # the worker deletes its own intermediates; the outputs are
+    # returned to (and deleted by) the run
+    with utils.AnalysisSession(_worker['workspace'], namespace=_worker['namespace'],
+                               scratch=False):
+        return _worker['tbx']._analyze_scenario(*_worker['arrays'], num=num,
+                                                scenario=scenario, **params)
 
 
 class Flooder(StandardScenarios):
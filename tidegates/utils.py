@@ -17,23 +17,37 @@ Written by Paul Hobson (phobson@geosyntec.com)
 
 
 import os
+import errno
+import shutil
+import uuid
+import socket
 import datetime
+import tempfile
 import itertools
+import threading
 from functools import wraps
 from contextlib import contextmanager
 
 
 import numpy
 
-import arcpy
+from ._lazy import arcpy
+
+from . import profiling
+from . import backends
 
 
 class RasterTemplate(object):
     """ Georeferencing template for Rasters.
 
-    This mimics the attributes of teh ``arcpy.Raster`` class enough
-    that it can be used as a template to georeference numpy arrays
-    when converting to rasters.
+    An immutable geotransform: the position of the raster's lower left
+    (south west) corner, the size of its cells, its shape, and its
+    coordinate reference system. It mimics the attributes of the
+    ``arcpy.Raster`` class enough that it can be used as a template to
+    georeference numpy arrays when converting to rasters, but it only
+    builds ``arcpy`` (or :mod:`tidegates.backends`) objects when those
+    attributes are used. It's therefore cheap to pickle and send to
+    worker processes.
 
     Parameters
     ----------
@@ -42,25 +56,54 @@ class RasterTemplate(object):
     xmin, ymin : float
         The x- and y-coordinates of the raster's lower left (south west)
         corner.
+    nrows, ncols : int, optional
+        The number of rows and columns of the raster. Required for the
+        upper bounds of the extent and the window arithmetic.
+    cellheight : int or float, optional
+        The height of the raster's cells, when not the same as
+        ``cellsize``.
+    crs : str, optional
+        The raster's coordinate reference system as a string (WKT or
+        Esri's projection string).
 
     Attributes
     ----------
-    cellsize : int or float
-        The width of the raster's cells.
+    meanCellWidth, meanCellHeight : int or float
+        The width and height of the raster's cells.
     extent : Extent
-        Yet another mock-ish class that ``x`` and ``y`` are stored in
-        ``extent.lowerLeft`` as an ``arcpy.Point``.
+        The extent of the raster. ``xmin`` and ``ymin`` are stored in
+        ``extent.lowerLeft`` as an ``arcpy.Point``. The upper bounds are
+        NaN when the shape isn't known.
 
     See also
     --------
     arcpy.Extent
 
+    Examples
+    --------
+    >>> from tidegates import utils
+    >>> template = utils.RasterTemplate(10, 1000, 2000, nrows=300, ncols=400)
+    >>> template.index(1055, 4995)
+    (0, 5)
+    >>> r0, r1, c0, c1 = template.window(1000, 2000, 1500, 2500)
+    >>> subtemplate = template.subset((r0, r1, c0, c1))
+
     """
 
-    def __init__(self, cellsize, xmin, ymin):
-        self.meanCellWidth = cellsize
-        self.meanCellHeight = cellsize
-        self.extent = arcpy.Extent(xmin, ymin, numpy.nan, numpy.nan)
+    __slots__ = ('xmin', 'ymin', 'cellwidth', 'cellheight', 'nrows', 'ncols',
+                 'crs', '_converted')
+
+    def __init__(self, cellsize, xmin, ymin, nrows=None, ncols=None,
+                 cellheight=None, crs=None):
+        _set = object.__setattr__
+        _set(self, 'cellwidth', cellsize)
+        _set(self, 'cellheight', cellsize if cellheight is None else cellheight)
+        _set(self, 'xmin', xmin)
+        _set(self, 'ymin', ymin)
+        _set(self, 'nrows', None if nrows is None else int(nrows))
+        _set(self, 'ncols', None if ncols is None else int(ncols))
+        _set(self, 'crs', crs or None)
+        _set(self, '_converted', {})
 
     @classmethod
     def from_raster(cls, raster):
@@ -78,13 +121,289 @@ class RasterTemplate(object):
         template : RasterTemplate
 
         """
+
+        srs = getattr(raster, 'spatialReference', None)
+        if srs is not None and not isinstance(srs, backends._string_types):
+            srs = srs.exportToString()
+
         template = cls(
-            raster.meanCellHeight,
+            raster.meanCellWidth,
             raster.extent.lowerLeft.X,
             raster.extent.lowerLeft.Y,
+            nrows=getattr(raster, 'height', None),
+            ncols=getattr(raster, 'width', None),
+            cellheight=raster.meanCellHeight,
+            crs=srs,
         )
         return template
 
+    def __setattr__(self, attr, value):
+        raise AttributeError('RasterTemplate objects are immutable')
+
+    def __reduce__(self):
+        return (RasterTemplate, (self.cellwidth, self.xmin, self.ymin, self.nrows,
+                                 self.ncols, self.cellheight, self.crs))
+
+    def __eq__(self, other):
+        if not isinstance(other, RasterTemplate):
+            return NotImplemented
+        return self.__reduce__()[1] == other.__reduce__()[1]
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.__reduce__()[1])
+
+    def __repr__(self):
+        return '<RasterTemplate {}x{} at ({}, {}), cells {} x {}>'.format(
+            self.nrows, self.ncols, self.xmin, self.ymin,
+            self.cellwidth, self.cellheight,
+        )
+
+    @property
+    def meanCellWidth(self):
+        return self.cellwidth
+
+    @property
+    def meanCellHeight(self):
+        return self.cellheight
+
+    @property
+    def shape(self):
+        """ ``(nrows, ncols)`` of the raster, or None if unknown. """
+        if self.nrows is None or self.ncols is None:
+            return None
+        return (self.nrows, self.ncols)
+
+    @property
+    def xmax(self):
+        if self.ncols is None:
+            return numpy.nan
+        return self.xmin + self.ncols * self.cellwidth
+
+    @property
+    def ymax(self):
+        if self.nrows is None:
+            return numpy.nan
+        return self.ymin + self.nrows * self.cellheight
+
+    @property
+    def georef(self):
+        """ ``(cellsize, xmin, ymin, nrows, ncols)``, the positional
+        arguments that recreate the template (e.g., after saving them
+        to a ``.npz`` file). Unknown dimensions are -1.
+
+        """
+
+        return (self.cellwidth, self.xmin, self.ymin,
+                -1 if self.nrows is None else self.nrows,
+                -1 if self.ncols is None else self.ncols)
+
+    @classmethod
+    def from_georef(cls, georef, crs=None, shape=None):
+        """ Recreates a template from its :attr:`georef` (or the
+        ``(cellsize, xmin, ymin)`` of older versions).
+
+        Parameters
+        ----------
+        georef : sequence of numbers
+        crs : str, optional
+        shape : tuple of ints, optional
+            Shape of the array of the template, used when ``georef``
+            does not include it.
+
+        Returns
+        -------
+        template : RasterTemplate
+
+        """
+
+        georef = [float(g) for g in georef]
+        cellsize, xmin, ymin = georef[:3]
+        nrows, ncols = georef[3:5] if len(georef) >= 5 else (-1, -1)
+        if (nrows < 0 or ncols < 0) and shape is not None:
+            nrows, ncols = shape
+        return cls(
+            cellsize, xmin, ymin,
+            nrows=None if nrows < 0 else nrows,
+            ncols=None if ncols < 0 else ncols,
+            crs=crs,
+        )
+
+    @property
+    def geotransform(self):
+        """ The GDAL-style geotransform: ``(xmin, cell width, 0, ymax,
+        0, -cell height)``.
+
+        """
+
+        return (self.xmin, self.cellwidth, 0.0, self.ymax, 0.0, -self.cellheight)
+
+    def _convert(self, name, build):
+        # `arcpy` objects are only built the first time they are needed
+        # (per backend, since the backend can change during a session)
+        key = (name, backends.get_backend().name)
+        if key not in self._converted:
+            try:
+                self._converted[key] = build(key[1] == 'arcpy')
+            except ImportError:
+                # no ArcGIS: the same stand-ins as the other backends
+                self._converted[key] = build(False)
+        return self._converted[key]
+
+    @property
+    def extent(self):
+        def build(use_arcpy):
+            Extent = arcpy.Extent if use_arcpy else backends.Extent
+            return Extent(self.xmin, self.ymin, self.xmax, self.ymax)
+        return self._convert('extent', build)
+
+    @property
+    def spatialReference(self):
+        """ The ``arcpy.SpatialReference`` of the template with the
+        arcpy backend, otherwise the CRS string (like
+        :class:`tidegates.backends.Raster`). None if unknown.
+
+        """
+
+        def build(use_arcpy):
+            if self.crs is None or not use_arcpy:
+                return self.crs
+            srs = arcpy.SpatialReference()
+            srs.loadFromString(self.crs)
+            return srs
+        return self._convert('spatialReference', build)
+
+    def _require_shape(self):
+        if self.shape is None:
+            raise ValueError('the shape of the template is not known')
+
+    def with_shape(self, nrows, ncols):
+        """ Returns a copy of the template with the given shape. """
+        return RasterTemplate(self.cellwidth, self.xmin, self.ymin, nrows=nrows, ncols=ncols,
+                              cellheight=self.cellheight, crs=self.crs)
+
+    def index(self, x, y):
+        """ Row and column of the cell(s) containing coordinates.
+
+        Parameters
+        ----------
+        x, y : float or numpy.ndarray
+
+        Returns
+        -------
+        row, col : int or numpy.ndarray of ints
+            Not limited to the shape of the template, so points outside
+            of the raster have negative or too-large indices.
+
+        """
+
+        self._require_shape()
+        row = numpy.floor(numpy.true_divide(self.ymax - numpy.asarray(y), self.cellheight))
+        col = numpy.floor(numpy.true_divide(numpy.asarray(x) - self.xmin, self.cellwidth))
+        row, col = row.astype(int), col.astype(int)
+        if row.ndim == 0:
+            return int(row), int(col)
+        return row, col
+
+    def xy(self, row, col):
+        """ Coordinates of the center(s) of cell(s).
+
+        Parameters
+        ----------
+        row, col : int or numpy.ndarray of ints
+
+        Returns
+        -------
+        x, y : float or numpy.ndarray
+
+        """
+
+        self._require_shape()
+        x = self.xmin + (numpy.asarray(col) + 0.5) * self.cellwidth
+        y = self.ymax - (numpy.asarray(row) + 0.5) * self.cellheight
+        if x.ndim == 0:
+            return float(x), float(y)
+        return x, y
+
+    def window(self, xmin, ymin, xmax, ymax):
+        """ The rows and columns of the cells that overlap a bounding
+        box, clipped to the raster.
+
+        Parameters
+        ----------
+        xmin, ymin, xmax, ymax : float
+
+        Returns
+        -------
+        window : tuple of ints
+            ``(r0, r1, c0, c1)`` such that ``array[r0:r1, c0:c1]`` is
+            the part of the raster's array inside the box.
+
+        """
+
+        self._require_shape()
+        r0 = int(numpy.floor(numpy.true_divide(self.ymax - ymax, self.cellheight)))
+        r1 = int(numpy.ceil(numpy.true_divide(self.ymax - ymin, self.cellheight)))
+        c0 = int(numpy.floor(numpy.true_divide(xmin - self.xmin, self.cellwidth)))
+        c1 = int(numpy.ceil(numpy.true_divide(xmax - self.xmin, self.cellwidth)))
+        r0, r1 = (min(max(r, 0), self.nrows) for r in (r0, r1))
+        c0, c1 = (min(max(c, 0), self.ncols) for c in (c0, c1))
+        return (r0, r1, c0, c1)
+
+    def subset(self, window):
+        """ The template of part of the raster.
+
+        Parameters
+        ----------
+        window : tuple of ints
+            ``(r0, r1, c0, c1)``, the rows and columns of the part of
+            the raster (e.g., from :meth:`window` or :meth:`tiles`).
+
+        Returns
+        -------
+        subtemplate : RasterTemplate
+            Georeferences ``array[r0:r1, c0:c1]``.
+
+        """
+
+        self._require_shape()
+        r0, r1, c0, c1 = window
+        return RasterTemplate(
+            self.cellwidth,
+            self.xmin + c0 * self.cellwidth,
+            self.ymin + (self.nrows - r1) * self.cellheight,
+            nrows=r1 - r0,
+            ncols=c1 - c0,
+            cellheight=self.cellheight,
+            crs=self.crs,
+        )
+
+    def tiles(self, size=None):
+        """ Splits the raster into square tiles.
+
+        Parameters
+        ----------
+        size : int, optional
+            Width and height of the tiles in cells. Defaults to
+            :data:`TILE_SIZE`. Tiles on the right and bottom edges may
+            be smaller.
+
+        Yields
+        ------
+        window : tuple of ints
+            ``(r0, r1, c0, c1)`` of each tile, row by row.
+
+        """
+
+        self._require_shape()
+        size = size or TILE_SIZE
+        for r0 in range(0, self.nrows, size):
+            for c0 in range(0, self.ncols, size):
+                yield (r0, min(r0 + size, self.nrows), c0, min(c0 + size, self.ncols))
+
 
 
 class EasyMapDoc(object):
@@ -121,6 +440,9 @@ class EasyMapDoc(object):
     >>> ezmd = utils.EasyMapDoc('CURRENT')
     >>> ezmd.add_layer(myLayer)
 
+    >>> # Adding many layers, redrawing the map only once:
+    >>> ezmd.add_layers(['floods_1.shp', 'floods_2.shp', 'floods_3.shp'])
+
     """
 
     def __init__(self, *args, **kwargs):
@@ -129,6 +451,10 @@ class EasyMapDoc(object):
         except RuntimeError:
             self.mapdoc = None
 
+        self._is_current = bool(args) and args[0] == 'CURRENT'
+        self._dataframes = None
+        self._index = None
+
     @property
     def layers(self):
         """
@@ -141,7 +467,37 @@ class EasyMapDoc(object):
         """
         All of the dataframes in the map.
         """
-        return arcpy.mapping.ListDataFrames(self.mapdoc)
+        if self._dataframes is None:
+            self._dataframes = arcpy.mapping.ListDataFrames(self.mapdoc)
+        return self._dataframes
+
+    def _layer_index(self):
+        """ Maps the names of the (non-group) layers to the first layer
+        with that name. Rebuilt with a single listing of the layers
+        whenever layers have been added.
+
+        """
+
+        if self._index is None:
+            index = {}
+            for lyr in self.layers:
+                if not lyr.isGroupLayer:
+                    index.setdefault(lyr.name, lyr)
+            self._index = index
+        return self._index
+
+    def refresh(self):
+        """ Forgets the listed dataframes and layers (e.g., after the
+        map was changed by other means) and, when this is the "CURRENT"
+        map, redraws the table of contents and the map.
+
+        """
+
+        self._dataframes = None
+        self._index = None
+        if self._is_current:
+            arcpy.RefreshTOC()
+            arcpy.RefreshActiveView()
 
     def findLayerByName(self, name):
         """ Finds a `layer`_ in the map by searching for an exact match
@@ -171,9 +527,7 @@ class EasyMapDoc(object):
 
         """
 
-        for lyr in self.layers:
-            if not lyr.isGroupLayer and lyr.name == name:
-                return lyr
+        return self._layer_index().get(name)
 
     def add_layer(self, layer, df=None, position='top'):
         """ Simply adds a `layer`_ to a map.
@@ -205,6 +559,43 @@ class EasyMapDoc(object):
 
         """
 
+        return self.add_layers([layer], df=df, position=position, refresh=False)[0]
+
+    def add_layers(self, layers, df=None, position='top', refresh=True):
+        """ Adds many `layers`_ to a map, and then redraws it once.
+
+        .. _layers: http://goo.gl/KfrGNa
+
+        Parameters
+        ----------
+        layers : list of str or arcpy.mapping.Layer
+            The datasets to be added to the map.
+        df : arcpy.mapping.DataFrame, optional
+            The specific dataframe to which the layers will be added.
+            If not provided, the data will be added to the first
+            dataframe in the map.
+        position : str, optional ('TOP')
+            The positional within `df` where the data will be added.
+            Valid options are: 'auto_arrange', 'bottom', and 'top'.
+            In both 'top' and 'bottom', the layers end up in the order
+            they are given.
+        refresh : bool, optional (True)
+            Whether to redraw the table of contents and the map (once,
+            after all of the layers are added).
+
+        Returns
+        -------
+        layers : list of arcpy.mapping.Layer
+            The sucessfully added layers.
+
+        Examples
+        --------
+        >>> from tidegates import utils
+        >>> ezmd = utils.EasyMapDoc('CURRENT')
+        >>> ezmd.add_layers(['floods.shp', 'flooded_wetlands.shp'])
+
+        """
+
         # if no dataframe is provided, select the first
         if df is None:
             df = self.dataframes[0]
@@ -212,16 +603,207 @@ class EasyMapDoc(object):
         # check that the position is valid
         valid_positions = ['auto_arrange', 'bottom', 'top']
         if position.lower() not in valid_positions:
-            raise ValueError('Position: %s is not in %s' % (position.lower, valid_positions))
+            raise ValueError('Position: %s is not in %s' % (position.lower(), valid_positions))
+
+        # layers can be paths to files. if so, convert to Layer objects
+        layers = [load_data(layer, 'layer') for layer in layers]
+
+        # layers added at the top end up above the ones added before
+        ordered = layers[::-1] if position.lower() == 'top' else layers
+        for layer in ordered:
+            arcpy.mapping.AddLayer(df, layer, position.upper())
+
+        # the new layers are found by the next lookup
+        self._index = None
+
+        if refresh and self._is_current:
+            arcpy.RefreshTOC()
+            arcpy.RefreshActiveView()
+
+        return layers
+
+
+# the sessions, namespaces, registries, and caches entered by each
+# thread (innermost last), like the ExecutionContexts of
+# tidegates.backends
+_local = threading.local()
+_STACKS = ('sessions', 'namespaces', 'registries', 'caches')
+
+
+def _stack(name):
+    """ The current thread's list of entered ``name`` (e.g.,
+    "sessions").
+
+    """
+
+    if not hasattr(_local, name):
+        setattr(_local, name, [])
+    return getattr(_local, name)
+
+
+def _thread_state():
+    """ A copy of the sessions, namespaces, registries, and caches of
+    the current thread, for :func:`_inherit`.
+
+    """
+
+    return dict((name, list(_stack(name))) for name in _STACKS)
+
+
+@contextmanager
+def _inherit(state):
+    """ Uses the sessions, namespaces, registries, and caches of
+    ``state`` (from :func:`_thread_state` in the thread that handed work
+    to this one) in the current thread.
+
+    """
+
+    saved = _thread_state()
+    for name, stack in state.items():
+        setattr(_local, name, list(stack))
+    try:
+        yield
+    finally:
+        for name, stack in saved.items():
+            setattr(_local, name, stack)
+
+
+class AnalysisSession(object):
+    """ Holds the extension licenses, environment, caches, and scratch
+    space of a whole run.
+
+    Inside the session (i.e., its ``with`` block):
+
+    * the extensions are checked out once, so :func:`Extension` doesn't
+      check them out and back in around every geoprocessing call;
+    * the workspace and ``overwriteOutput`` are set once, so
+      :func:`WorkSpace` and :func:`OverwriteState` with the same values
+      don't touch the environment;
+    * temporary names get their own :func:`TempNamespace`, temporary
+      datasets are tracked by a :class:`TempRegistry`, and datasets and
+      field names are cached in a :class:`DatasetCache`;
+    * arrays can be memory-mapped in a scratch folder that is deleted
+      (with its contents) when the session ends.
+
+    Parameters
+    ----------
+    workspace : str, optional
+        Folder or geodatabase of the run. Defaults to the current
+        workspace.
+    overwrite : bool, optional (True)
+        Value of ``overwriteOutput`` during the session.
+    extensions : list of str, optional (['spatial'])
+        The ArcGIS extensions to check out (only with the ``arcpy``
+        backend).
+    namespace : str, optional
+        Namespace of the temporary names (see :func:`TempNamespace`).
+        Defaults to a new random one.
+    registry, cache : bool, optional (True)
+        Whether to track the temporary datasets and to cache loaded
+        datasets.
+    scratch : bool, optional (True)
+        Whether to create a scratch folder.
+
+    Attributes
+    ----------
+    registry : TempRegistry or None
+    cache : DatasetCache or None
+    namespace : str
+    scratch : str or None
+        Path to the scratch folder.
+
+    Examples
+    --------
+    >>> with utils.AnalysisSession('C:/gis/project') as session:
+    ...     topo, zones, template = tidegates.process_dem_and_zones(
+    ...         'dem.tif', 'zones.shp', 'GeoID', memmap=session.scratch
+    ...     )
+    ...     for elev in [4, 6, 8]:
+    ...         tidegates.flood_area(topo, zones, template, 'GeoID', elev)
+
+    """
+
+    def __init__(self, workspace=None, overwrite=True, extensions=('spatial',),
+                 namespace=None, registry=True, cache=True, scratch=True):
+        self.workspace = workspace
+        self.overwrite = overwrite
+        self.extensions = [name.lower() for name in extensions]
+        self.namespace = namespace
+        self.registry = TempRegistry() if registry else None
+        self.cache = DatasetCache() if cache else None
+        self.scratch = scratch
+        self._contexts = []
+        self._checked_out = []
+
+    @staticmethod
+    def active():
+        """ The innermost session in use, or None. """
+        sessions = _stack('sessions')
+        return sessions[-1] if sessions else None
+
+    def has_extension(self, name):
+        """ True if the session checked out the extension ``name``. """
+        return name.lower() in self._checked_out
+
+    def _enter(self, context):
+        value = context.__enter__()
+        self._contexts.append(context)
+        return value
+
+    def open(self):
+        if self.workspace is None:
+            self.workspace = backends.env().workspace
+
+        try:
+            self._enter(WorkSpace(self.workspace))
+            self._enter(OverwriteState(self.overwrite))
+            self.namespace = self._enter(TempNamespace(self.namespace))
+            for context in (self.registry, self.cache):
+                if context is not None:
+                    self._enter(context)
+
+            if backends.get_backend().name == 'arcpy':
+                for name in self.extensions:
+                    if arcpy.CheckExtension(name) != u"Available":
+                        raise RuntimeError("%s license isn't available" % name)
+                    arcpy.CheckOutExtension(name)
+                    self._checked_out.append(name)
+
+            if self.scratch is True:
+                self.scratch = tempfile.mkdtemp(prefix='_tidegates_scratch_')
+        except:
+            self.close()
+            raise
+
+        _stack('sessions').append(self)
+        return self
+
+    def close(self):
+        """ Checks the extensions back in, restores the environment,
+        deletes the temporary datasets and the scratch folder.
+
+        """
+
+        if self in _stack('sessions'):
+            _stack('sessions').remove(self)
+
+        while self._checked_out:
+            arcpy.CheckInExtension(self._checked_out.pop())
+
+        while self._contexts:
+            self._contexts.pop().__exit__(None, None, None)
 
-        # layer can be a path to a file. if so, convert to a Layer object
-        layer = load_data(layer, 'layer')
+        if self.scratch and self.scratch is not True:
+            # memory-mapped arrays that are still open can't be deleted
+            # (on Windows), but they are in the temporary folder anyway
+            shutil.rmtree(self.scratch, ignore_errors=True)
+            self.scratch = None
 
-        # add the layer to the map
-        arcpy.mapping.AddLayer(df, layer, position.upper())
+    def __enter__(self):
+        return self.open()
 
-        # return the layer
-        return layer
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 @contextmanager
@@ -231,6 +813,8 @@ def Extension(name):
     Inside the context manager, the extension will be checked out. Once
     the interpreter leaves the code block by any means (e.g., sucessful
     execution, raised exception) the extension will be checked back in.
+    Inside an :class:`AnalysisSession` that has already checked out the
+    extension, nothing is checked out or in.
 
     Examples
     --------
@@ -240,13 +824,19 @@ def Extension(name):
 
     """
 
-    if arcpy.CheckExtension(name) == u"Available":
-        status = arcpy.CheckOutExtension(name)
-        yield status
-    else:
+    session = AnalysisSession.active()
+    if session is not None and session.has_extension(name):
+        yield u"CheckedOut"
+        return
+
+    if arcpy.CheckExtension(name) != u"Available":
         raise RuntimeError("%s license isn't available" % name)
 
-    arcpy.CheckInExtension(name)
+    status = arcpy.CheckOutExtension(name)
+    try:
+        yield status
+    finally:
+        arcpy.CheckInExtension(name)
 
 
 @contextmanager
@@ -258,11 +848,14 @@ def OverwriteState(state):
     be set to the given value. Once the interpreter leaves the code
     block by any means (e.g., sucessful execution, raised exception),
     ``arcpy.env.overwriteOutput`` will reset to its original value.
+    With other backends, their own ``env`` is modified instead, and
+    inside a :class:`tidegates.backends.ExecutionContext`, only the
+    current thread's setting is changed (see :mod:`tidegates.backends`).
 
     Parameters
     ----------
-    path : str
-        Path to the directory that will be set as the current workspace.
+    state : bool
+        Whether existing outputs can be overwritten.
 
     Examples
     --------
@@ -272,10 +865,19 @@ def OverwriteState(state):
 
     """
 
-    orig_state = arcpy.env.overwriteOutput
-    arcpy.env.overwriteOutput = bool(state)
-    yield
-    arcpy.env.overwriteOutput = orig_state
+    orig_state = backends.env().overwriteOutput
+    if orig_state == bool(state):
+        # already set (e.g., pinned by an AnalysisSession)
+        yield
+    elif backends.current_context() is not None:
+        with backends.ExecutionContext(overwriteOutput=bool(state)):
+            yield
+    else:
+        backends.env().overwriteOutput = bool(state)
+        try:
+            yield
+        finally:
+            backends.env().overwriteOutput = orig_state
 
 
 @contextmanager
@@ -287,6 +889,10 @@ def WorkSpace(path):
     be set to the given value. Once the interpreter leaves the code
     block by any means (e.g., sucessful execution, raised exception),
     `arcpy.env.workspace`_ will reset to its original value.
+    With other backends, their own ``env`` is modified instead, and
+    inside a :class:`tidegates.backends.ExecutionContext`, only the
+    current thread's workspace is changed (see
+    :mod:`tidegates.backends`).
 
     .. _arcpy.env.workspace: http://goo.gl/0NpeFN
 
@@ -303,10 +909,36 @@ def WorkSpace(path):
 
     """
 
-    orig_workspace = arcpy.env.workspace
-    arcpy.env.workspace = path
-    yield
-    arcpy.env.workspace = orig_workspace
+    orig_workspace = backends.env().workspace
+    if orig_workspace == path:
+        # already set (e.g., pinned by an AnalysisSession)
+        yield
+    elif backends.current_context() is not None:
+        with backends.ExecutionContext(workspace=path):
+            yield
+    else:
+        backends.env().workspace = path
+        try:
+            yield
+        finally:
+            backends.env().workspace = orig_workspace
+
+
+@contextmanager
+def _arcpy_env(**settings):
+    """ Temporarily applies settings (e.g., ``extent``) to
+    ``arcpy.env``.
+
+    """
+
+    original = dict((name, getattr(arcpy.env, name)) for name in settings)
+    for name, value in settings.items():
+        setattr(arcpy.env, name, value)
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(arcpy.env, name, value)
 
 
 def _status(msg, verbose=False, asMessage=False, addTab=False): # pragma: no cover
@@ -324,9 +956,14 @@ def update_status(): # pragma: no cover
     arguments related to printing status messages to stdin or as arcpy
     messages.
 
+    When :mod:`tidegates.profiling` is active, each call is also
+    recorded as a span.
+
     """
 
     def decorate(func):
+        traced_func = profiling.traced()(func)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             msg = kwargs.pop("msg", None)
@@ -335,64 +972,563 @@ def update_status(): # pragma: no cover
             addTab = kwargs.pop("addTab", False)
             _status(msg, verbose=verbose, asMessage=asMessage, addTab=addTab)
 
-            return func(*args, **kwargs)
+            return traced_func(*args, **kwargs)
         return wrapper
     return decorate
 
 
-def create_temp_filename(filepath, filetype=None, prefix='_temp_', num=None):
-    """ Helper function to create temporary filenames before to be saved
-    before the final output has been generated.
+@contextmanager
+def TempNamespace(name=None):
+    """ Context manager that adds a namespace to the names from
+    :func:`create_temp_filename`.
+
+    Runs (or worker processes) that share a workspace and each use
+    their own namespace never overwrite each other's temporary files,
+    even for the same scenario ``num``.
+
+    Parameters
+    ----------
+    name : str, optional
+        The namespace. Defaults to a new random one. It must only
+        contain characters that are valid in dataset names.
+
+    Examples
+    --------
+    >>> with tidegates.utils.WorkSpace('C:/gis'), tidegates.utils.TempNamespace('a1'):
+    ...     tidegates.utils.create_temp_filename('floods', filetype='raster', num=3)
+    C:/gis/_temp_floods_3_a1.tif
+
+    """
+
+    if name is None:
+        name = uuid.uuid4().hex[:8]
+
+    _stack('namespaces').append(name)
+    try:
+        yield name
+    finally:
+        _stack('namespaces').remove(name)
+
+
+def create_temp_filename(filepath, filetype=None, prefix='_temp_', num=None,
+                         register=True):
+    """ Helper function to create temporary filenames before to be saved
+    before the final output has been generated.
+
+    Parameters
+    ----------
+    filepath : str
+        The file path/name of what the final output will eventually be.
+    filetype : str, optional
+        The type of file to be created. Valid values: "Raster" or
+        "Shape".
+    prefix : str, optional ('_temp_')
+        The prefix that will be applied to ``filepath``.
+    num : int, optional
+        A file "number" that can be appended to the end of the
+        filename (before the namespace from :func:`TempNamespace`, if
+        any).
+    register : bool, optional (True)
+        Record the name in the active :class:`TempRegistry` (if any) so
+        that the file is deleted when the run ends. Use False for
+        names of final outputs.
+
+    Returns
+    -------
+    str
+
+    Examples
+    --------
+    >>> create_temp_filename('path/to/flooded_wetlands', filetype='shape')
+    path/to/_temp_flooded_wetlands.shp
+
+    """
+
+    file_extensions = {
+        'raster': '.tif',
+        'shape': '.shp'
+    }
+
+    if num is None:
+        num = ''
+    else:
+        num = '_{}'.format(num)
+
+    namespaces = _stack('namespaces')
+    if namespaces:
+        num += '_{}'.format(namespaces[-1])
+
+    ws = backends.env().workspace or '.'
+    filename, _ = os.path.splitext(os.path.basename(filepath))
+    folder = os.path.dirname(filepath)
+    if folder != '':
+        final_workspace = os.path.join(ws, folder)
+    else:
+        final_workspace = ws
+
+    if os.path.splitext(final_workspace)[1] == '.gdb':
+        ext = ''
+    else:
+        ext = file_extensions[filetype.lower()]
+
+
+    path = os.path.join(ws, folder, prefix + filename + num + ext)
+    registry = TempRegistry.active()
+    if register and registry is not None:
+        registry.add(path)
+    return path
+
+
+def _result_path(result):
+    """ The path of a temporary result (a path, Layer, Raster, or
+    geoprocessing Result).
+
+    """
+
+    if isinstance(result, backends._string_types):
+        return result
+    elif hasattr(result, 'dataSource'):
+        return result.dataSource
+    elif hasattr(result, 'getOutput'):
+        return result.getOutput(0)
+    # Rasters' `path` doesn't include the name
+    return os.path.join(result.path, result.name)
+
+
+def _process_alive(pid):
+    """ True if a process with the given ID is running on this
+    machine.
+
+    """
+
+    if os.name == 'nt': # pragma: no cover
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class TempRegistry(object):
+    """ Records the temporary datasets of a run and makes sure that
+    they are deleted.
+
+    While the registry is active (i.e., inside its ``with`` block),
+    every name from :func:`create_temp_filename` is recorded, and the
+    results passed to :func:`defer_cleanup` are queued and deleted in
+    batches (once ``batch_size`` of them are queued, or on
+    :meth:`flush`) instead of one by one. Deletions happen in the
+    thread that queues or flushes them, since geoprocessing tools
+    aren't thread-safe. Anything left when the block exits (e.g.,
+    after an error) is deleted then.
+
+    The recorded paths are also written to a manifest file next to the
+    workspace. If the run's process dies before the manifest is
+    removed, the next registry opened in that folder deletes its
+    leftovers.
+
+    Parameters
+    ----------
+    workspace : str, optional
+        Folder or geodatabase of the run. Defaults to the current
+        workspace.
+    batch_size : int, optional (25)
+        Maximum number of datasets deleted with a single call to
+        :func:`cleanup_temp_results`.
+    sweep : bool, optional (True)
+        Delete the leftovers of crashed runs when the registry is
+        opened.
+
+    Attributes
+    ----------
+    paths : list of str
+        The temporary datasets that haven't been deleted yet,
+        including registered names that haven't been written yet.
+    errors : list of tuple
+        ``(path, exception)`` for the datasets that couldn't be
+        deleted. They are left in the manifest so that a later run can
+        try again.
+
+    Examples
+    --------
+    >>> with utils.WorkSpace('C:/gis/project'), utils.TempRegistry() as registry:
+    ...     flooded = tidegates.flood_area(topo, zones, template, 'GeoID', 8.0)
+    ...     utils.defer_cleanup(flooded)
+
+    """
+
+    manifest_prefix = '_tidegates_temp_'
+
+    def __init__(self, workspace=None, batch_size=25, sweep=True):
+        self.workspace = workspace
+        self.batch_size = batch_size
+        self.sweep_on_open = sweep
+        self.paths = []
+        self.errors = []
+        self.manifest = None
+        self._lock = threading.Lock()
+        self._pending = []
+
+    @staticmethod
+    def active():
+        """ The innermost registry in use, or None. """
+        registries = _stack('registries')
+        return registries[-1] if registries else None
+
+    @classmethod
+    def _manifest_folder(cls, workspace):
+        folder = os.path.abspath(workspace or '.')
+        while os.path.splitext(folder)[1].lower() == '.gdb':
+            folder = os.path.dirname(folder)
+        return folder
+
+    def _resolve(self, result):
+        path = _result_path(result)
+        return os.path.join(os.path.abspath(self.workspace or '.'), path)
+
+    def _write_manifest(self):
+        with open(self.manifest, 'w') as manifest:
+            manifest.write('{} {}\n'.format(socket.gethostname(), os.getpid()))
+            for path in self.paths:
+                manifest.write(path + '\n')
+
+    def open(self):
+        if self.workspace is None:
+            self.workspace = backends.env().workspace
+
+        folder = self._manifest_folder(self.workspace)
+        if self.sweep_on_open:
+            self.sweep(folder)
+
+        fd, self.manifest = tempfile.mkstemp(prefix=self.manifest_prefix, suffix='.txt', dir=folder)
+        os.close(fd)
+        self._write_manifest()
+        _stack('registries').append(self)
+        return self
+
+    def add(self, path):
+        """ Records a temporary dataset and returns its path. """
+        path = self._resolve(path)
+        with self._lock:
+            if path not in self.paths:
+                self.paths.append(path)
+                if self.manifest is not None:
+                    with open(self.manifest, 'a') as manifest:
+                        manifest.write(path + '\n')
+        return path
+
+    def _delete(self, batch):
+        """ Deletes the datasets of ``batch`` that exist and stops
+        tracking the ones that were deleted. Every other registered
+        name is kept until :meth:`close`.
+
+        """
+
+        existing = [path for path in batch if dataset_exists(path)]
+        failed = []
+        try:
+            if existing:
+                cleanup_temp_results(*existing)
+        except Exception:
+            # one of them failed, so find out which
+            for path in existing:
+                try:
+                    if dataset_exists(path):
+                        cleanup_temp_results(path)
+                except Exception as e:
+                    self.errors.append((path, e))
+                    failed.append(path)
+
+        deleted = [path for path in existing if path not in failed]
+        with self._lock:
+            self.paths = [path for path in self.paths if path not in deleted]
+
+    def delete(self, *results):
+        """ Queues the results (paths, Layers, or Rasters) to be
+        deleted, and deletes the queue once it holds ``batch_size``
+        of them.
+
+        """
+
+        context = backends.current_context()
+        with self._lock:
+            self._pending.extend((context, self._resolve(result)) for result in results)
+            full = len(self._pending) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        """ Deletes the queued results, ``batch_size`` at a time. """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        # delete each context's paths with its own backend
+        for context, group in itertools.groupby(pending, lambda item: item[0]):
+            paths = [path for _, path in group]
+            with backends.activate(context):
+                for n in range(0, len(paths), self.batch_size):
+                    self._delete(paths[n:n + self.batch_size])
+
+    def close(self):
+        """ Deletes the remaining temporary datasets and removes the
+        manifest (unless some of them couldn't be deleted).
+
+        """
+
+        self.flush()
+
+        # try again the ones that failed (e.g., they were still locked)
+        self.errors = []
+        self._delete(list(self.paths))
+
+        # names that were never written have nothing left to delete
+        self.paths = [path for path in self.paths if dataset_exists(path)]
+
+        if self in _stack('registries'):
+            _stack('registries').remove(self)
+
+        if self.manifest is not None:
+            if self.paths:
+                self._write_manifest()
+            else:
+                os.remove(self.manifest)
+
+    @classmethod
+    def sweep(cls, folder):
+        """ Deletes the datasets listed in the manifests of runs (on
+        this machine) whose process is no longer running.
+
+        Returns
+        -------
+        deleted : list of str
+
+        """
+
+        deleted = []
+        hostname = socket.gethostname()
+        for name in sorted(os.listdir(folder)):
+            if not (name.startswith(cls.manifest_prefix) and name.endswith('.txt')):
+                continue
+
+            manifest = os.path.join(folder, name)
+            with open(manifest, 'r') as f:
+                lines = [line.strip() for line in f if line.strip()]
+
+            try:
+                host, pid = lines[0].rsplit(' ', 1)
+                pid = int(pid)
+            except (IndexError, ValueError):
+                continue
+
+            if host != hostname or _process_alive(pid):
+                continue
+
+            remaining = []
+            for path in lines[1:]:
+                try:
+                    if dataset_exists(path):
+                        cleanup_temp_results(path)
+                        deleted.append(path)
+                except Exception:
+                    remaining.append(path)
+
+            if remaining:
+                with open(manifest, 'w') as f:
+                    f.write(lines[0] + '\n')
+                    f.write('\n'.join(remaining) + '\n')
+            else:
+                os.remove(manifest)
+
+        return deleted
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@update_status() # None
+def defer_cleanup(*results):
+    """ Queues temporary results to be deleted in batches when a
+    :class:`TempRegistry` is active, or deletes them right away (with
+    :func:`cleanup_temp_results`) otherwise.
+
+    Parameters
+    ----------
+    *results : str, Layers, or Rasters
+        The temporary results
+
+    Returns
+    -------
+    None
+
+    """
+
+    registry = TempRegistry.active()
+    if registry is None:
+        cleanup_temp_results(*results)
+    else:
+        registry.delete(*results)
+
+
+class DatasetCache(object):
+    """ Run-scoped cache of loaded datasets and of their field names.
+
+    While the cache is active (i.e., inside its ``with`` block),
+    :func:`load_data` returns the same Raster or Layer each time a
+    path is loaded, and :func:`_check_fields` lists the fields of a
+    table only once. The functions of this module that write, delete,
+    or add fields to a dataset drop it from the cache, so changes
+    made through this module are always seen. Changes made by other
+    means (e.g., calling ``arcpy`` directly) need a call to
+    :meth:`invalidate`.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups that were (or weren't) in the cache.
+
+    Examples
+    --------
+    >>> with utils.WorkSpace('C:/gis/project'), utils.DatasetCache() as cache:
+    ...     floods = tidegates.assess_impact('floods.shp', 'GeoID', ...)
+    >>> cache.hits, cache.misses
+    (14, 3)
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datasets = {}
+        self._fields = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def active():
+        """ The innermost cache in use, or None. """
+        caches = _stack('caches')
+        return caches[-1] if caches else None
+
+    @staticmethod
+    def _key(data):
+        path = os.path.join(backends.env().workspace or '.', _result_path(data))
+        return os.path.normcase(os.path.abspath(path))
+
+    def _get(self, store, key, load):
+        with self._lock:
+            if key in store:
+                self.hits += 1
+                return store[key]
+
+        value = load()
+        with self._lock:
+            self.misses += 1
+            store[key] = value
+        return value
+
+    def dataset(self, datapath, datatype, greedyRasters, loader):
+        """ The dataset at ``datapath`` (loaded with ``loader`` the
+        first time).
+
+        """
+
+        key = (self._key(datapath), datatype.lower(), greedyRasters)
+        return self._get(self._datasets, key,
+                         lambda: loader(datapath, datatype, greedyRasters=greedyRasters))
+
+    def fields(self, table):
+        """ The names of the fields of ``table``. """
+        names = self._get(self._fields, self._key(table),
+                          lambda: [field.name for field in arcpy.ListFields(table)])
+        return list(names)
+
+    def invalidate(self, data, datasets=True):
+        """ Drops the field names (and, unless ``datasets`` is False,
+        the loaded datasets) of ``data`` from the cache.
+
+        """
+
+        key = self._key(data)
+        with self._lock:
+            self._fields.pop(key, None)
+            if datasets:
+                for cached in [k for k in self._datasets if k[0] == key]:
+                    del self._datasets[cached]
+
+    def clear(self):
+        with self._lock:
+            self._datasets.clear()
+            self._fields.clear()
+
+    def __enter__(self):
+        _stack('caches').append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _stack('caches').remove(self)
+        self.clear()
+
+
+def _invalidate(data, datasets=True):
+    cache = DatasetCache.active()
+    if cache is not None and data is not None:
+        cache.invalidate(data, datasets=datasets)
+
+
+def _cached_load(func):
+    """ Decorator that sends calls to :func:`load_data` with a path
+    through the active :class:`DatasetCache`.
+
+    """
 
-    Parameters
-    ----------
-    filepath : str
-        The file path/name of what the final output will eventually be.
-    filetype : str, optional
-        The type of file to be created. Valid values: "Raster" or
-        "Shape".
-    prefix : str, optional ('_temp_')
-        The prefix that will be applied to ``filepath``.
-    num : int, optional
-        A file "number" that can be appended to the very end of the
-        filename.
+    @wraps(func)
+    def wrapper(datapath, datatype, greedyRasters=True):
+        cache = DatasetCache.active()
+        if cache is None or not isinstance(datapath, backends._string_types):
+            return func(datapath, datatype, greedyRasters=greedyRasters)
+        return cache.dataset(datapath, datatype, greedyRasters, func)
+    return wrapper
 
-    Returns
-    -------
-    str
 
-    Examples
-    --------
-    >>> create_temp_filename('path/to/flooded_wetlands', filetype='shape')
-    path/to/_temp_flooded_wetlands.shp
+def _writes_output(func):
+    """ Decorator for functions that return the dataset they wrote:
+    drops it from the active :class:`DatasetCache`.
 
     """
 
-    file_extensions = {
-        'raster': '.tif',
-        'shape': '.shp'
-    }
-
-    if num is None:
-        num = ''
-    else:
-        num = '_{}'.format(num)
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        output = func(*args, **kwargs)
+        _invalidate(output)
+        return output
+    return wrapper
 
-    ws = arcpy.env.workspace or '.'
-    filename, _ = os.path.splitext(os.path.basename(filepath))
-    folder = os.path.dirname(filepath)
-    if folder != '':
-        final_workspace = os.path.join(ws, folder)
-    else:
-        final_workspace = ws
 
-    if os.path.splitext(final_workspace)[1] == '.gdb':
-        ext = ''
-    else:
-        ext = file_extensions[filetype.lower()]
+def _deletes_inputs(func):
+    """ Decorator for functions that delete the datasets they are
+    given: drops them from the active :class:`DatasetCache`.
 
+    """
 
-    return os.path.join(ws, folder, prefix + filename + num + ext)
+    @wraps(func)
+    def wrapper(*results):
+        for result in results:
+            _invalidate(result)
+        return func(*results)
+    return wrapper
 
 
 def _check_fields(table, *fieldnames, **kwargs):
@@ -421,7 +1557,11 @@ def _check_fields(table, *fieldnames, **kwargs):
 
     should_exist = kwargs.pop('should_exist', False)
 
-    existing_fields = [field.name for field in arcpy.ListFields(table)]
+    cache = DatasetCache.active()
+    if cache is None:
+        existing_fields = [field.name for field in arcpy.ListFields(table)]
+    else:
+        existing_fields = cache.fields(table)
     bad_names = []
     for name in fieldnames:
         exists = name in existing_fields
@@ -489,7 +1629,231 @@ def result_to_layer(result):
     return arcpy.mapping.Layer(result.getOutput(0))
 
 
+def _raster_name(raster):
+    path = getattr(raster, 'catalogPath', None) or getattr(raster, 'dataSource', None) or str(raster)
+    return os.path.splitext(os.path.basename(path))[0] or 'array'
+
+
+def scratch_array(shape, dtype, folder=None, name='array'):
+    """ Creates a new, writable array backed by a ``.npy`` file.
+
+    Parameters
+    ----------
+    shape : tuple of ints
+    dtype : numpy dtype
+    folder : str, optional
+        Where the file is created. Defaults to the system's temporary
+        folder.
+    name : str, optional
+        Included in the name of the file (``_temp_<name>_XXXX.npy``).
+
+    Returns
+    -------
+    array : numpy.memmap
+
+    See also
+    --------
+    to_memmap
+
+    """
+
+    folder = folder or tempfile.gettempdir()
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    handle, path = tempfile.mkstemp(suffix='.npy', prefix='_temp_{}_'.format(name), dir=folder)
+    os.close(handle)
+    return numpy.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+def readonly_memmap(array):
+    """ Flushes a writable array from :func:`scratch_array` and maps
+    its file again, read-only.
+
+    """
+
+    array.flush()
+    return numpy.load(array.filename, mmap_mode='r')
+
+
+def to_memmap(array, folder=None, name='array'):
+    """ Copies an array into a read-only, memory-mapped ``.npy`` file.
+
+    Other processes can map the same file (e.g., with
+    ``numpy.load(memmapped.filename, mmap_mode='r')``) and share its
+    pages instead of holding their own copy, and the OS only pages in
+    the parts of the array that are used.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+    folder, name : str, optional
+        See :func:`scratch_array`.
+
+    Returns
+    -------
+    memmapped : numpy.memmap
+
+    """
+
+    memmapped = scratch_array(array.shape, array.dtype, folder=folder, name=name)
+    memmapped[...] = array
+    return readonly_memmap(memmapped)
+
+
+class SharedArrays(object):
+    """ Publishes arrays once, as read-only memory-mapped ``.npy``
+    files, so that worker processes can attach to them without copies.
+
+    Sending arrays to worker processes pickles them, which takes time
+    and gives every worker its own copy. A published array is sent as
+    the path to its file instead (see :meth:`publish`), and every
+    worker that :meth:`attach`-es it maps the same pages of the OS's
+    file cache. Arrays that already are memory-mapped ``.npy`` files
+    (e.g., from ``process_dem_and_zones(..., memmap=True)``) are not
+    copied again.
+
+    The files are written to a folder that is deleted when the block
+    exits. The folder also records the host and process ID of its
+    owner: if the owner dies without deleting it, the next
+    ``SharedArrays`` opened in the same parent folder does.
+
+    Parameters
+    ----------
+    folder : str, optional
+        Parent folder of the shared files. Defaults to the system's
+        temporary folder.
+    sweep : bool, optional (True)
+        Delete the leftovers of crashed runs when opened.
+
+    Attributes
+    ----------
+    folder : str or None
+        The folder holding the published arrays while open.
+
+    Examples
+    --------
+    >>> with utils.SharedArrays() as shared:
+    ...     initargs = (shared.publish(topo, 'topo'), shared.publish(zones, 'zones'))
+    ...     pool = multiprocessing.Pool(4, initializer=init, initargs=initargs)
+    ...     # in `init`: topo = utils.SharedArrays.attach(topo_handle)
+
+    """
+
+    folder_prefix = '_tidegates_shared_'
+    owner_file = 'owner.txt'
+
+    def __init__(self, folder=None, sweep=True):
+        self.parent = folder or tempfile.gettempdir()
+        self.sweep_stale = sweep
+        self.folder = None
+
+    def open(self):
+        if not os.path.exists(self.parent):
+            os.makedirs(self.parent)
+        if self.sweep_stale:
+            SharedArrays.sweep(self.parent)
+
+        self.folder = tempfile.mkdtemp(prefix=self.folder_prefix, dir=self.parent)
+        with open(os.path.join(self.folder, self.owner_file), 'w') as f:
+            f.write('{} {}\n'.format(socket.gethostname(), os.getpid()))
+        return self
+
+    def publish(self, array, name='array'):
+        """ Makes an array available to other processes.
+
+        Parameters
+        ----------
+        array : numpy.ndarray
+            Anything else (e.g., :class:`CompactArrays`) is returned as
+            is and will be pickled.
+        name : str, optional
+            Included in the name of the file.
+
+        Returns
+        -------
+        handle : str or object
+            Pass it to :meth:`attach` in the other process.
+
+        """
+
+        if not isinstance(array, numpy.ndarray):
+            return array
+
+        filename = getattr(array, 'filename', None)
+        if filename and filename.endswith('.npy') and os.path.exists(filename):
+            if numpy.load(filename, mmap_mode='r').shape == array.shape:
+                return filename
+
+        if self.folder is None:
+            raise ValueError('SharedArrays must be open to publish arrays')
+
+        memmapped = scratch_array(array.shape, array.dtype, folder=self.folder, name=name)
+        memmapped[...] = array
+        memmapped.flush()
+        filename = memmapped.filename
+
+        # don't keep the file mapped here, or it can't be deleted (on
+        # Windows) when the block exits
+        del memmapped
+        return filename
+
+    @staticmethod
+    def attach(handle):
+        """ The read-only array of a handle from :meth:`publish`. """
+        if isinstance(handle, backends._string_types):
+            return numpy.load(handle, mmap_mode='r')
+        return handle
+
+    def close(self):
+        """ Deletes the published arrays. """
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @classmethod
+    def sweep(cls, folder):
+        """ Deletes the shared folders of processes (on this machine)
+        that are no longer running.
+
+        Returns
+        -------
+        deleted : list of str
+
+        """
+
+        deleted = []
+        hostname = socket.gethostname()
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if not (name.startswith(cls.folder_prefix) and os.path.isdir(path)):
+                continue
+
+            try:
+                with open(os.path.join(path, cls.owner_file), 'r') as f:
+                    host, pid = f.read().strip().rsplit(' ', 1)
+                pid = int(pid)
+            except (IOError, OSError, ValueError):
+                continue
+
+            if host != hostname or _process_alive(pid):
+                continue
+
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                deleted.append(path)
+
+        return deleted
+
+
 @update_status() # list of arrays
+@backends.dispatch
 def rasters_to_arrays(*rasters, **kwargs):
     """ Converts an arbitrary number of `rasters`_ to `numpy arrays`_.
     Relies on `arcpy.RasterToNumPyArray`_.
@@ -507,6 +1871,15 @@ def rasters_to_arrays(*rasters, **kwargs):
         returned. However, when ``squeeze = True`` and only one raster
         is provided, the array will be **squeezed** out of the list
         and returned directly.
+    memmap : bool or str, optional (False)
+        When True (or the path to a folder), each raster is read tile
+        by tile (see :meth:`RasterTemplate.tiles`) into a ``.npy`` file
+        in the temporary (or given) folder and returned as a read-only
+        ``numpy.memmap`` of that file (see :func:`scratch_array`).
+        Deleting the files is up to the caller.
+    window : tuple of ints, optional
+        ``(r0, r1, c0, c1)``, to only read ``[r0:r1, c0:c1]`` of each
+        raster (e.g., a tile from :meth:`RasterTemplate.tiles`).
 
     Returns
     -------
@@ -521,10 +1894,44 @@ def rasters_to_arrays(*rasters, **kwargs):
     """
 
     squeeze = kwargs.pop("squeeze", False)
+    memmap = kwargs.pop("memmap", False)
+    window = kwargs.pop("window", None)
+    folder = None if memmap is True else memmap
+
+    def read(raster, template, window):
+        r0, r1, c0, c1 = window
+        return arcpy.RasterToNumPyArray(
+            raster,
+            lower_left_corner=template.subset(window).extent.lowerLeft,
+            ncols=c1 - c0,
+            nrows=r1 - r0,
+            nodata_to_value=-999,
+        )
 
     arrays = []
     for n, r in enumerate(rasters):
-        arrays.append(arcpy.RasterToNumPyArray(r, nodata_to_value=-999))
+        raster = load_data(r, 'raster')
+        template = RasterTemplate.from_raster(raster)
+        if window is not None:
+            template = template.subset(window)
+
+        if memmap:
+            # read tile by tile into the file, so that the whole
+            # raster is never in memory at once
+            array = None
+            for tile in template.tiles():
+                block = read(raster, template, tile)
+                if array is None:
+                    array = scratch_array(template.shape, block.dtype, folder=folder,
+                                          name=_raster_name(r))
+                t0, t1, u0, u1 = tile
+                array[t0:t1, u0:u1] = block
+            array = readonly_memmap(array)
+        elif window is not None:
+            array = read(raster, template, (0, template.nrows, 0, template.ncols))
+        else:
+            array = arcpy.RasterToNumPyArray(r, nodata_to_value=-999)
+        arrays.append(array)
 
     if squeeze and len(arrays) == 1:
         arrays = arrays[0]
@@ -532,8 +1939,41 @@ def rasters_to_arrays(*rasters, **kwargs):
     return arrays
 
 
+# width and height (in cells) of the tiles of tiled rasters
+TILE_SIZE = 256
+
+# overview (pyramid) factors of rasters written with ``overviews=True``
+OVERVIEW_FACTORS = (2, 4, 8, 16)
+
+
+@contextmanager
+def _raster_storage(tiled=False, compress=None, overviews=None):
+    """ Temporarily applies the tiling, compression, and pyramid
+    settings of :func:`array_to_raster` to ``arcpy.env``.
+
+    """
+
+    settings = {}
+    if tiled:
+        settings['tileSize'] = '{0} {0}'.format(TILE_SIZE)
+    if compress is not None:
+        settings['compression'] = compress
+    if overviews is not None:
+        if overviews is False:
+            settings['pyramid'] = 'NONE'
+        else:
+            levels = len(OVERVIEW_FACTORS if overviews is True else overviews)
+            settings['pyramid'] = 'PYRAMIDS {} NEAREST'.format(levels)
+
+    with _arcpy_env(**settings):
+        yield
+
+
 @update_status() # raster
-def array_to_raster(array, template, outfile=None):
+@_writes_output
+@backends.dispatch
+def array_to_raster(array, template, outfile=None, nodata=0, tiled=False,
+                    compress=None, overviews=None):
     """ Create an arcpy.Raster from a numpy.ndarray based on a template.
     This wrapper around `arcpy.NumPyArrayToRaster`_.
 
@@ -546,6 +1986,18 @@ def array_to_raster(array, template, outfile=None):
     template : arcpy.Raster or RasterTemplate
         The raster whose, extent, position, and cell size will be
         applied to ``array``.
+    outfile : str, optional
+        Path to where the raster should be saved.
+    nodata : int or float, optional (0)
+        Value in ``array`` that represents missing data.
+    tiled : bool, optional (False)
+        Store the raster in square tiles (:data:`TILE_SIZE`) instead of
+        strips.
+    compress : str, optional
+        Compression of the raster (e.g., "LZW").
+    overviews : bool or sequence of ints, optional
+        Build overviews (pyramids) with the given (or the default
+        :data:`OVERVIEW_FACTORS`) reduction factors.
 
     Returns
     -------
@@ -573,16 +2025,19 @@ def array_to_raster(array, template, outfile=None):
         lower_left_corner=template.extent.lowerLeft,
         x_cell_size=template.meanCellWidth,
         y_cell_size=template.meanCellHeight,
-        value_to_nodata=0
+        value_to_nodata=nodata
     )
 
     if outfile is not None:
-        newraster.save(outfile)
+        with _raster_storage(tiled=tiled, compress=compress, overviews=overviews):
+            newraster.save(outfile)
 
     return newraster
 
 
 @update_status() # raster or layer
+@_cached_load
+@backends.dispatch
 def load_data(datapath, datatype, greedyRasters=True, **verbosity):
     """ Loads vector and raster data from filepaths.
 
@@ -638,7 +2093,10 @@ def load_data(datapath, datatype, greedyRasters=True, **verbosity):
 
 
 @update_status() # raster
-def polygons_to_raster(polygons, ID_column, cellsize=4, outfile=None):
+@_writes_output
+@backends.dispatch
+def polygons_to_raster(polygons, ID_column, cellsize=4, outfile=None,
+                       extent=None, all_touched=False):
     """ Prepare tidegates' areas of influence polygons for flooding
     by converting to a raster. Relies on
     `arcpy.conversion.PolygonToRaster`_.
@@ -655,6 +2113,16 @@ def polygons_to_raster(polygons, ID_column, cellsize=4, outfile=None):
         each geomstry with a tidegate.
     cellsize : int
         Desired cell dimension of the output raster. Default is 4 m.
+    extent : tuple of floats, optional
+        ``(xmin, ymin, xmax, ymax)`` of the output raster (e.g., of the
+        zones of influence, so that other polygons line up with their
+        cells). By default, the raster covers the polygons.
+    all_touched : bool, optional (False)
+        By default, a cell takes the value of the polygon that covers
+        its center. When True, polygons also get the cells that they
+        only partly cover (with arcpy, the cells in which they have the
+        largest area), so that polygons smaller than a cell (e.g.,
+        building footprints) still show up.
 
     Returns
     -------
@@ -682,12 +2150,17 @@ def polygons_to_raster(polygons, ID_column, cellsize=4, outfile=None):
 
     _zones = load_data(polygons, 'shape')
 
-    with OverwriteState(True), Extension("spatial"):
+    settings = {}
+    if extent is not None:
+        settings['extent'] = arcpy.Extent(*extent)
+
+    with OverwriteState(True), Extension("spatial"), _arcpy_env(**settings):
         result = arcpy.conversion.PolygonToRaster(
             in_features=_zones,
             value_field=ID_column,
             cellsize=cellsize,
             out_rasterdataset=outfile,
+            cell_assignment='MAXIMUM_AREA' if all_touched else 'CELL_CENTER',
         )
 
     zones = result_to_raster(result)
@@ -696,6 +2169,8 @@ def polygons_to_raster(polygons, ID_column, cellsize=4, outfile=None):
 
 
 @update_status() # raster
+@_writes_output
+@backends.dispatch
 def clip_dem_to_zones(dem, zones, outfile=None):
     """ Limits the extent of the topographic data (``dem``) to that of
     the zones of influence  so that we can easily use array
@@ -739,7 +2214,9 @@ def clip_dem_to_zones(dem, zones, outfile=None):
 
 
 @update_status() # layer
-def raster_to_polygons(zonal_raster, filename, newfield=None):
+@_writes_output
+@backends.dispatch
+def raster_to_polygons(zonal_raster, filename, newfield=None, simplify=True):
     """
     Converts zonal rasters to polygons layers. This is basically just
     a thing wrapper around arcpy.conversion.RasterToPolygon. The
@@ -761,6 +2238,10 @@ def raster_to_polygons(zonal_raster, filename, newfield=None):
     newfield : str, optional
         By default, the field that contains the raster values is called
         "gridcode". Use this parameter to change the name of that field.
+    simplify : bool, optional (True)
+        Smooth the edges of the polygons. When False, they follow the
+        edges of the cells exactly, so they cover every (and only the)
+        cells with values.
 
     Returns
     -------
@@ -779,7 +2260,7 @@ def raster_to_polygons(zonal_raster, filename, newfield=None):
         results = arcpy.conversion.RasterToPolygon(
             in_raster=zonal_raster,
             out_polygon_features=filename,
-            simplify="SIMPLIFY",
+            simplify="SIMPLIFY" if simplify else "NO_SIMPLIFY",
             raster_field="Value",
         )
 
@@ -796,6 +2277,8 @@ def raster_to_polygons(zonal_raster, filename, newfield=None):
 
 
 @update_status() # layer
+@_writes_output
+@backends.dispatch
 def aggregate_polygons(polygons, ID_field, filename):
     """
     Dissolves (aggregates) polygons into a single feature the unique
@@ -808,9 +2291,9 @@ def aggregate_polygons(polygons, ID_field, filename):
     ----------
     polygons : arcpy.mapping.Layer
         The layer of polygons to be aggregated.
-    ID_field : string
-        The name of the field in ``polygons`` on which the individual
-        polygons will be grouped.
+    ID_field : string or list of strings
+        The name(s) of the field(s) in ``polygons`` on which the
+        individual polygons will be grouped.
     filename : string
         Path to where the aggregated polygons will be saved.
 
@@ -842,44 +2325,255 @@ def aggregate_polygons(polygons, ID_field, filename):
     return dissolved
 
 
+class CompactArrays(object):
+    """ Memory-efficient representation of the DEM and zones arrays.
+
+    The elevations are stored as 32-bit floats, the zones as dense
+    codes (0 outside of the zones, 1 to K for the K zones) in the
+    narrowest unsigned integer type that fits them, and the cells with
+    missing elevations (NaN or the -999 sentinel of
+    :func:`rasters_to_arrays`) in a separate, bit-packed mask. That's
+    about 5 bytes per cell instead of the 12 to 16 of the float64 and
+    int32/int64 arrays, and :meth:`flood_zones` never has to look for
+    missing values again.
+
+    Parameters
+    ----------
+    topo : numpy.ndarray of float32
+    codes : numpy.ndarray of unsigned ints
+    zone_ids : numpy.ndarray
+        Zone ID of each code from 1 to K.
+    validity : numpy.ndarray of uint8
+        Bit-packed mask of the cells with valid elevations.
+
+    See also
+    --------
+    CompactArrays.from_arrays
+
+    Examples
+    --------
+    >>> topo, zones, template = tidegates.process_dem_and_zones(dem, ZOI, 'GeoID')
+    >>> compact = utils.CompactArrays.from_arrays(topo, zones)
+    >>> del topo, zones
+    >>> flooded = utils.flood_zones(compact, None, 2.9)
+
+    """
+
+    def __init__(self, topo, codes, zone_ids, validity):
+        self.topo = topo
+        self.codes = codes
+        self.zone_ids = zone_ids
+        self.validity = validity
+        self._lookup = numpy.hstack([[0], zone_ids]).astype(zone_ids.dtype)
+
+    @classmethod
+    def from_arrays(cls, topo_array, zones_array):
+        """ Compacts the arrays returned by
+        :func:`tidegates.analysis.process_dem_and_zones`.
+
+        """
+
+        valid = numpy.isfinite(topo_array) & (topo_array != -999)
+        topo = numpy.where(valid, topo_array, 0).astype(numpy.float32)
+
+        zoned = zones_array > 0
+        zone_ids, inverse = numpy.unique(zones_array[zoned], return_inverse=True)
+        codes = numpy.zeros(zones_array.shape, dtype=numpy.min_scalar_type(zone_ids.shape[0]))
+        codes[zoned] = inverse + 1
+
+        zone_ids = zone_ids.astype(numpy.min_scalar_type(zone_ids.max() if zone_ids.shape[0] else 0))
+        return cls(topo, codes, zone_ids, numpy.packbits(valid, axis=None))
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.topo.nbytes + self.codes.nbytes + self.zone_ids.nbytes + self.validity.nbytes
+
+    @property
+    def valid(self):
+        """ Boolean mask of the cells with valid elevations. """
+        size = self.codes.size
+        return numpy.unpackbits(self.validity)[:size].reshape(self.shape).astype(bool)
+
+    @property
+    def zones(self):
+        """ The zone IDs of each cell (0 outside of the zones). """
+        return self._lookup[self.codes]
+
+    def to_arrays(self):
+        """ The DEM (as float64, with -999 for missing elevations) and
+        the zone IDs in the original representation.
+
+        """
+
+        topo = numpy.where(self.valid, self.topo, -999).astype(float)
+        return topo, self.zones
+
+    def _code_levels(self, elevation):
+        """ Converts water levels given by zone ID (see
+        :func:`flood_zones`) into water levels by code.
+
+        """
+
+        if hasattr(elevation, 'items'):
+            elevation = _level_vector(self.zone_ids, elevation)
+        elif isinstance(elevation, (list, tuple)) and elevation and hasattr(elevation[0], 'items'):
+            size = max([int(self.zone_ids.max())] + [int(z) for levels in elevation for z in levels]) + 1
+            elevation = [_level_vector(self.zone_ids, levels, size=size) for levels in elevation]
+
+        levels = numpy.asarray(elevation, dtype=float)
+        if levels.ndim in (1, 2) and levels.shape != self.shape:
+            if levels.shape[-1] <= self.zone_ids.max():
+                raise ValueError("water levels must be given up to zone ID {}".format(self.zone_ids.max()))
+            levels = levels[..., self._lookup][..., self.codes]
+        return levels
+
+    def flood_zones(self, elevation):
+        """ Equivalent to :func:`flood_zones` on the original arrays.
+
+        Returns
+        -------
+        flooded_array : numpy.array
+            Array of zone IDs only where there is flooding.
+
+        """
+
+        # missing elevations are treated as -999, like in flood_zones
+        levels = self._code_levels(elevation)
+        unflooded_mask = numpy.where(self.valid, self.topo > levels, levels < -999)
+        final_mask = (self.codes == 0) | unflooded_mask
+        flooded_codes = numpy.array(numpy.broadcast_to(self.codes, final_mask.shape))
+        flooded_codes[final_mask] = 0
+        return self._lookup[flooded_codes]
+
+
+def _level_vector(zones_array, levels, size=None):
+    """ Converts a mapping of zone ID to water level into an array
+    indexed by zone ID. Zones missing from the mapping never flood.
+
+    """
+
+    if size is None:
+        size = max([int(zones_array.max())] + [int(z) for z in levels]) + 1
+    vector = numpy.empty(size, dtype=float)
+    vector.fill(-numpy.inf)
+    for zone, level in levels.items():
+        vector[int(zone)] = level
+    return vector
+
+
+def _water_levels(zones_array, elevation):
+    """ Water level(s) of each cell of the zones.
+
+    Parameters
+    ----------
+    zones_array : numpy.array
+    elevation : float, mapping, numpy.array, or raster
+        See :func:`flood_zones`.
+
+    Returns
+    -------
+    levels : float or numpy.array
+        Broadcastable against ``zones_array`` (with a leading batch
+        dimension when ``elevation`` is a batch).
+
+    """
+
+    if hasattr(elevation, 'items'):
+        elevation = _level_vector(zones_array, elevation)
+    elif isinstance(elevation, (list, tuple)) and elevation and hasattr(elevation[0], 'items'):
+        size = max([int(zones_array.max())] + [int(z) for levels in elevation for z in levels]) + 1
+        elevation = [_level_vector(zones_array, levels, size=size) for levels in elevation]
+    elif hasattr(elevation, 'extent'):
+        elevation = rasters_to_arrays(elevation, squeeze=True)
+
+    levels = numpy.asarray(elevation, dtype=float)
+    if levels.ndim == 0 or levels.shape == zones_array.shape or levels.shape[1:] == zones_array.shape:
+        return levels
+
+    if levels.ndim in (1, 2):
+        if levels.shape[-1] <= zones_array.max():
+            raise ValueError("water levels must be given up to zone ID {}".format(zones_array.max()))
+        return levels[..., numpy.clip(zones_array, 0, None)]
+
+    raise ValueError("water levels with shape {} don't match the zones {}".format(
+        levels.shape, zones_array.shape))
+
+
 @update_status() # array
 def flood_zones(zones_array, topo_array, elevation):
     """ Mask out non-flooded portions of arrays.
 
     Parameters
     ----------
-    zones_array : numpy.array
-        Array of zone IDs from each zone of influence.
+    zones_array : numpy.array or CompactArrays
+        Array of zone IDs from each zone of influence, or the compacted
+        zones and DEM (in which case ``topo_array`` is ignored).
     topo_array : numpy.array
         Digital elevation model (as an array) of the areas.
-    elevation : float
+    elevation : float, mapping, numpy.array, or raster
         The flood elevation *above* which everything will be masked.
+        This can be:
+
+          - a single elevation for all of the zones,
+          - a mapping of zone ID to the elevation in that zone (zones
+            not in the mapping are not flooded),
+          - a 1D array of elevations indexed by zone ID,
+          - a water surface (array or raster) aligned with the zones,
+          - a batch (list of mappings, 2D array of elevations by zone
+            ID, or 3D array of water surfaces) of any of the above.
 
     Returns
     -------
     flooded_array : numpy.array
-        Array of zone IDs only where there is flooding.
+        Array of zone IDs only where there is flooding. Batches return
+        one array per item in the batch, stacked along the first axis.
+
+    Examples
+    --------
+    >>> # each tidegate with its own design tailwater
+    >>> flooded = utils.flood_zones(zones, topo, {1: 2.4, 2: 3.1, 3: 2.7})
+    >>> # 50 scenarios for 3 tidegates in one pass
+    >>> levels = numpy.zeros((50, zones.max() + 1))
+    >>> levels[:, 1:] = numpy.random.uniform(2, 4, size=(50, 3))
+    >>> flooded = utils.flood_zones(zones, topo, levels)
+    >>> flooded.shape
+    (50, 100, 100)
 
     """
 
+    if isinstance(zones_array, CompactArrays):
+        if hasattr(elevation, 'extent'):
+            elevation = rasters_to_arrays(elevation, squeeze=True)
+        return zones_array.flood_zones(elevation)
+
+    levels = _water_levels(zones_array, elevation)
+
     # compute mask of non-zoned areas of topo
     nonzone_mask = zones_array <= 0
 
-    invalid_mask = numpy.ma.masked_invalid(topo_array).mask
-    topo_array[invalid_mask] = -999
+    # treat invalid elevations as -999 without modifying the input,
+    # which may be a read-only memmap
+    invalid_mask = ~numpy.isfinite(topo_array)
+    if invalid_mask.any():
+        topo_array = numpy.where(invalid_mask, -999, topo_array)
 
     # mask out zoned areas above the flood elevation
-    unflooded_mask = topo_array > elevation
+    unflooded_mask = topo_array > levels
 
     # apply the mask to the zone array
     final_mask = nonzone_mask | unflooded_mask
-    flooded_array = zones_array.copy()
+    flooded_array = numpy.array(numpy.broadcast_to(zones_array, final_mask.shape))
     flooded_array[final_mask] = 0
 
     return flooded_array
 
 
 @update_status() # None
+@backends.dispatch
 def add_field_with_value(table, field_name, field_value=None,
                          overwrite=False, **field_opts):
     """ Adds a numeric or text field to an attribute table and sets it
@@ -948,13 +2642,34 @@ def add_field_with_value(table, field_name, field_value=None,
         field_type=field_type,
         **field_opts
     )
+    _invalidate(table, datasets=False)
 
     # set the value in all rows
     if field_value is not None:
         populate_field(table, lambda row: field_value, field_name)
 
 
+@backends.dispatch
+def dataset_exists(path):
+    """ Checks if a dataset exists. Relies on ``arcpy.Exists``.
+
+    Parameters
+    ----------
+    path : str
+        Path to the dataset (or its name in the current workspace).
+
+    Returns
+    -------
+    bool
+
+    """
+
+    return bool(arcpy.Exists(path))
+
+
 @update_status() # None
+@_deletes_inputs
+@backends.dispatch
 def cleanup_temp_results(*results):
     """ Deletes temporary results from the current workspace.
 
@@ -987,11 +2702,13 @@ def cleanup_temp_results(*results):
         else:
             raise ValueError("Input must be paths, Results, Rasters, or Layers")
 
-        fullpath = os.path.join(os.path.abspath(arcpy.env.workspace), path)
+        fullpath = os.path.join(os.path.abspath(backends.env().workspace or '.'), path)
         arcpy.management.Delete(fullpath)
 
 
 @update_status() # layer
+@_writes_output
+@backends.dispatch
 def intersect_polygon_layers(destination, *layers, **intersect_options):
     """
     Intersect polygon layers with each other. Basically a thin wrapper
@@ -1037,7 +2754,43 @@ def intersect_polygon_layers(destination, *layers, **intersect_options):
     return intersected
 
 
+@update_status() # layer
+@backends.dispatch
+def select_intersecting(features, boundary):
+    """ A layer of the features that intersect a boundary. Relies on
+    ``arcpy.management.SelectLayerByLocation``.
+
+    Geoprocessing tools only see the selected features of the layer,
+    but their outputs keep the IDs and attributes of the original
+    dataset. The layer has the name of the dataset, so the fields that
+    ``arcpy.analysis.Intersect`` adds for it are named the same as for
+    the dataset (see :func:`source_id_field`). It only exists in the
+    current process.
+
+    Parameters
+    ----------
+    features : str or arcpy.mapping.Layer
+        The features (or their path) to select from.
+    boundary : str or arcpy.mapping.Layer
+        The polygons (or their path) that the selected features must
+        intersect.
+
+    Returns
+    -------
+    layer : arcpy.mapping.Layer
+        A layer of ``features`` with the intersecting features
+        selected.
+
+    """
+
+    # a new layer, so that the selection doesn't leak into `features`
+    layer = arcpy.mapping.Layer(_result_path(features))
+    arcpy.management.SelectLayerByLocation(layer, 'INTERSECT', boundary)
+    return layer
+
+
 @update_status() # dict
+@backends.dispatch
 def groupby_and_aggregate(input_path, groupfield, valuefield,
                           aggfxn=None):
     """
@@ -1119,6 +2872,7 @@ def groupby_and_aggregate(input_path, groupfield, valuefield,
 
 
 @update_status() # None
+@backends.dispatch
 def rename_column(table, oldname, newname, newalias=None): # pragma: no cover
     """
     .. warning: Not yet implemented.
@@ -1141,6 +2895,7 @@ def rename_column(table, oldname, newname, newalias=None): # pragma: no cover
 
 
 @update_status() # None
+@backends.dispatch
 def populate_field(table, value_fxn, valuefield, *keyfields):
     """
     Loops through the records of a table and populates the value of one
@@ -1192,6 +2947,7 @@ def populate_field(table, value_fxn, valuefield, *keyfields):
 
 
 @update_status() # layers
+@backends.dispatch
 def copy_data(destfolder, *source_layers, **kwargs):
     """ Copies an arbitrary number of spatial files to a new folder.
 
@@ -1225,6 +2981,8 @@ def copy_data(destfolder, *source_layers, **kwargs):
         os.path.join(destfolder, os.path.basename(lyr))
         for lyr in source_layers
     ]
+    for name in outputnames:
+        _invalidate(name)
 
     copied = [load_data(name, "layer") for name in outputnames]
     if squeeze and len(copied) == 1:
@@ -1234,6 +2992,8 @@ def copy_data(destfolder, *source_layers, **kwargs):
 
 
 @update_status()
+@_writes_output
+@backends.dispatch
 def concat_results(destination, *input_files):
     """ Concatentates (merges) serveral datasets into a single shapefile
     or feature class.
@@ -1264,12 +3024,23 @@ def concat_results(destination, *input_files):
 
 
 @update_status()
+@_writes_output
+@backends.dispatch
 def join_results_to_baseline(destination, result_file, baseline_file):
     """ Joins attributes of a geoprocessing result to a baseline dataset
     and saves the results to another file.
 
-    Relies on `arcpy.analysis.SpatialJoin`_.
+    When the results are pieces of the baseline features from
+    `arcpy.analysis.Intersect`_ (i.e., they have its "FID_<baseline>"
+    field, see :func:`source_id_field`), the attributes of the
+    baseline feature that each result came from are joined to it on
+    that field with ``arcpy.management.JoinField``. Otherwise, the
+    results are joined to every baseline feature that they intersect
+    with a ``JOIN_ONE_TO_MANY`` `arcpy.analysis.SpatialJoin`_. Either
+    way, the output has one feature, with the geometry of the baseline
+    feature, per matching result.
 
+    .. _arcpy.analysis.Intersect: http://goo.gl/O9YMY6
     .. _arcpy.analysis.SpatialJoin: http://resources.arcgis.com/en/help/main/10.2/index.html#//00080000000q000000
 
     Parameters
@@ -1292,13 +3063,75 @@ def join_results_to_baseline(destination, result_file, baseline_file):
 
     """
 
-    result = arcpy.analysis.SpatialJoin(
-        target_features=baseline_file,
-        join_features=result_file,
-        out_feature_class=destination,
-        join_operation="JOIN_ONE_TO_MANY",
-        join_type="KEEP_COMMON",
-        match_option="INTERSECT",
+    idfield = source_id_field(result_file, baseline_file)
+    if idfield is None:
+        result = arcpy.analysis.SpatialJoin(
+            target_features=baseline_file,
+            join_features=result_file,
+            out_feature_class=destination,
+            join_operation="JOIN_ONE_TO_MANY",
+            join_type="KEEP_COMMON",
+            match_option="INTERSECT",
+        )
+        return result_to_layer(result)
+
+    # join the baseline's attributes to a copy of the results on the
+    # IDs of the features they came from
+    result = arcpy.management.CopyFeatures(result_file, destination)
+    arcpy.management.JoinField(
+        in_data=destination,
+        in_field=idfield,
+        join_table=baseline_file,
+        join_field=arcpy.Describe(baseline_file).OIDFieldName,
     )
+    _invalidate(destination)
+
+    # and give them the geometry of those features
+    needed = set(row[0] for row in arcpy.da.SearchCursor(destination, [idfield]))
+    shapes = {}
+    with arcpy.da.SearchCursor(baseline_file, ['OID@', 'SHAPE@']) as cur:
+        for oid, shape in cur:
+            if oid in needed:
+                shapes[oid] = shape
+
+    with arcpy.da.UpdateCursor(destination, [idfield, 'SHAPE@']) as cur:
+        for row in cur:
+            if row[0] in shapes:
+                cur.updateRow([row[0], shapes[row[0]]])
+            else:
+                cur.deleteRow()
 
     return result_to_layer(result)
+
+
+@backends.dispatch
+def source_id_field(table, source):
+    """ Name of the field that `arcpy.analysis.Intersect`_ adds to
+    ``table`` with the object IDs of the features of ``source`` that
+    its features came from (e.g., "FID_buildings", or "FID_buildi" in
+    a shapefile).
+
+    .. _arcpy.analysis.Intersect: http://goo.gl/O9YMY6
+
+    Parameters
+    ----------
+    table : str or arcpy.mapping.Layer
+        The output of :func:`intersect_polygon_layers` (or of a tool
+        that keeps its fields).
+    source : str or arcpy.mapping.Layer
+        One of the layers that were intersected.
+
+    Returns
+    -------
+    fieldname : str or None
+        None if ``table`` doesn't have the field.
+
+    """
+
+    fieldnames = [field.name for field in arcpy.ListFields(table)]
+    fidfield = 'FID_' + load_data(source, 'layer').name
+    folder = os.path.dirname(_result_path(table))
+    for name in [fidfield, arcpy.ValidateFieldName(fidfield, folder)]:
+        if name in fieldnames:
+            return name
+    return None